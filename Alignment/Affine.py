@@ -0,0 +1,602 @@
+import argparse
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from Alignment.Cigar import CigarAlignment
+from Alignment.Directions import BandedDirectionMatrix, DirectionMatrix
+from Alignment.NWA import Sequence, _best_remaining, _best_substitution, _substitution_rows
+from Helpful_Structures import SubstitutionMatrix, MATRICES
+
+
+# Implementation of Gotoh's algorithm, alignment with affine gap penalties
+# A gap of k characters scores gap_open + (k - 1) * gap_extend, so one long gap costs less than many short ones.
+# Every cell tracks three states: finishing on a substitution (M), on a character of the first string against a
+# gap (X, reached moving up) or on a character of the second string against a gap (Y, reached moving left).
+# Only two rows of scores are kept, and the backtrace of all three states shares a single nibble per cell,
+# so the extra states cost no more memory than the linear gap aligners.
+
+MODES = ('global', 'local', 'overlap')
+
+# A backtrace nibble holds the best state of its cell in the low two bits, and in the high two bits
+# whether the X and Y states of the cell extended a gap rather than opening one
+STATE_M = 0
+STATE_X = 1
+STATE_Y = 2
+STATE_END = 3
+STATES = 3
+X_EXTENDS = 4
+Y_EXTENDS = 8
+
+# Score given to states a cell can not be in, low enough that no move out of them is ever taken
+_IMPOSSIBLE = -(1 << 40)
+
+
+def _check(mode: str, gap_open: int, gap_extend: int):
+    if mode not in MODES:
+        raise ValueError(f'Unknown mode {mode}, expected one of {", ".join(MODES)}')
+    # Gaps in the same state are then always joined, which lets a whole row of Y states be found at once
+    if gap_open > gap_extend:
+        raise ValueError(f'Opening a gap ({gap_open}) must not score more than extending one ({gap_extend})')
+
+
+def _cells(diagonal_best: np.ndarray, above_best: np.ndarray, above_up: np.ndarray, substitution: np.ndarray,
+           columns: np.ndarray, seed_closed: int, seed_left: int, gap_open: int, gap_extend: int,
+           floor: Optional[int], with_flags: bool = True):
+    """
+    Fill a run of neighbouring cells of a row
+    The X state only depends on the row above, and a run of Y states accumulates gap_extend per step, so removing
+    j * gap_extend from each cell lets the Y states of the whole run be resolved by a running maximum
+    :param diagonal_best: Best scores of the cells above and to the left of the run
+    :param above_best: Best scores of the cells above the run
+    :param above_up: X scores of the cells above the run
+    :param substitution: Scores of the row's character against the run's characters of the second string
+    :param columns: The columns of the run
+    :param seed_closed: Best score of the cell left of the run, not counting its Y state
+    :param seed_left: Y score of the cell left of the run
+    :param gap_open: Score of the first character of a gap
+    :param gap_extend: Score of every further character of a gap
+    :param floor: Lowest score a cell may take, 0 for local alignment or None for no floor
+    :param with_flags: Whether to compute the backtrace of the run
+    :return: The best and X scores of the run, and its backtrace nibbles or None
+    """
+    if not len(columns):
+        return columns, columns, np.zeros(0, dtype=np.uint8)
+    up = np.maximum(above_best + gap_open, above_up + gap_extend)
+    diagonal = diagonal_best + substitution
+    closed = np.maximum(diagonal, up)
+    if floor is not None:
+        np.maximum(closed, floor, out=closed)
+
+    offsets = columns * gap_extend
+    candidates = np.empty(len(columns) + 1, dtype=np.int64)
+    candidates[0] = seed_left - (columns[0] - 1) * gap_extend
+    candidates[1] = seed_closed + gap_open - offsets[0]
+    candidates[2:] = closed[:-1] + gap_open - offsets[1:]
+    left = np.maximum.accumulate(candidates)[1:] + offsets
+    best = np.maximum(closed, left)
+    if not with_flags:
+        return best, up, None
+
+    flags = np.where(diagonal == best, STATE_M, np.where(up == best, STATE_X, STATE_Y)).astype(np.uint8)
+    if floor is not None:
+        flags[best == floor] = STATE_END
+    flags |= (above_up + gap_extend == up).astype(np.uint8) * X_EXTENDS
+    flags |= (np.concatenate(([seed_left], left[:-1])) + gap_extend == left).astype(np.uint8) * Y_EXTENDS
+    return best, up, flags
+
+
+def _rows(string_one: Sequence, string_two: Sequence, mode: str, match: int, mismatch: int, gap_open: int,
+          gap_extend: int, substitution_matrix: Optional[SubstitutionMatrix] = None,
+          start_gap: Optional[int] = None, with_flags: bool = False) -> Iterator:
+    """
+    Score the matrix a row at a time, only keeping the row above
+    :param start_gap: Score of the first character of a gap running down column 0 in global mode,
+                      {gap_open} unless the gap was already opened before the strings
+    :param with_flags: Whether to compute the backtrace of every row
+    :return: For every row i, (i, best scores, X scores, backtrace nibbles or None)
+    """
+    m = len(string_one)
+    n = len(string_two)
+    start_gap = gap_open if start_gap is None else start_gap
+    floor = 0 if mode == 'local' else None
+    columns = np.arange(1, n + 1, dtype=np.int64)
+
+    best = np.zeros(n + 1, dtype=np.int64)
+    up = np.full(n + 1, _IMPOSSIBLE, dtype=np.int64)
+    flags = np.empty(n + 1, dtype=np.uint8)
+    flags[0] = STATE_END
+    if mode == 'local':
+        flags[1:] = STATE_END
+    else:
+        if mode == 'global':
+            best[1:] = gap_open + (columns - 1) * gap_extend
+        flags[1:] = STATE_Y | Y_EXTENDS
+        flags[1:2] = STATE_Y
+    yield 0, best, up, flags if with_flags else None
+
+    substitution_rows = _substitution_rows(string_one, string_two, match, mismatch, substitution_matrix)
+    for i in range(1, m + 1):
+        first_best = start_gap + (i - 1) * gap_extend if mode == 'global' else 0
+        row_best, row_up, row_flags = _cells(best[:-1], best[1:], up[1:], substitution_rows[string_one[i - 1]],
+                                             columns, first_best, _IMPOSSIBLE, gap_open, gap_extend, floor,
+                                             with_flags)
+        best = np.concatenate(([first_best], row_best))
+        up = np.concatenate(([first_best if mode == 'global' else _IMPOSSIBLE], row_up))
+        if with_flags:
+            first_flags = STATE_END if mode == 'local' else STATE_X | (X_EXTENDS if i > 1 else 0)
+            flags = np.concatenate(([first_flags], row_flags)).astype(np.uint8)
+        yield i, best, up, flags if with_flags else None
+
+
+def _fill(string_one: Sequence, string_two: Sequence, mode: str, match: int, mismatch: int, gap_open: int,
+          gap_extend: int, packed: bool = False, substitution_matrix: Optional[SubstitutionMatrix] = None,
+          start_gap: Optional[int] = None, keep_scores: bool = False):
+    """
+    Fill the backtrace of the whole matrix a row at a time using vectorised operations
+    :param keep_scores: Whether to also keep every row of best scores, for the verbose printer
+    :return: The direction matrix, the last row of best and X scores, the best score of any cell and the first
+             cell in row major order reaching it, and the kept score rows
+    """
+    directions = DirectionMatrix(len(string_one) + 1, len(string_two) + 1, packed)
+    scores = []
+    max_score, max_location = 0, (0, 0)
+    for i, best, up, flags in _rows(string_one, string_two, mode, match, mismatch, gap_open, gap_extend,
+                                    substitution_matrix, start_gap, with_flags=True):
+        directions.set_row(i, flags)
+        if keep_scores:
+            scores.append(best)
+        row_max = int(best.max())
+        if row_max > max_score:
+            max_score, max_location = row_max, (i, int(np.argmax(best)))
+    return directions, best, up, max_score, max_location, scores
+
+
+def _fill_banded(string_one: Sequence, string_two: Sequence, overlap: bool, match: int, mismatch: int,
+                 gap_open: int, gap_extend: int, lowest_diagonal: int, highest_diagonal: int, packed: bool = False,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Fill only the cells whose diagonal j - i lies between {lowest_diagonal} and {highest_diagonal}
+    :return: The score of the best in-band alignment, the banded direction matrix, and the banded best scores
+             along the highest and lowest diagonals
+    """
+    m = len(string_one)
+    n = len(string_two)
+    width = highest_diagonal - lowest_diagonal + 1
+
+    # Rows are stored in band order as in nwa, column c of row i holds cell (i, i + lowest_diagonal + c)
+    # The extra final column is never written, so moving up off the edge of the band is never chosen
+    previous_best = np.full(width + 1, _IMPOSSIBLE, dtype=np.int64)
+    previous_up = np.full(width + 1, _IMPOSSIBLE, dtype=np.int64)
+    current_best = np.full(width + 1, _IMPOSSIBLE, dtype=np.int64)
+    current_up = np.full(width + 1, _IMPOSSIBLE, dtype=np.int64)
+    directions = BandedDirectionMatrix(m + 1, lowest_diagonal, highest_diagonal, packed)
+    substitution_rows = _substitution_rows(string_one, string_two, match, mismatch, substitution_matrix)
+    flags = np.zeros(width, dtype=np.uint8)
+    upper_edge = np.full(m + 1, _IMPOSSIBLE, dtype=np.int64)
+    lower_edge = np.full(m + 1, _IMPOSSIBLE, dtype=np.int64)
+
+    for i in range(m + 1):
+        current_best.fill(_IMPOSSIBLE)
+        current_up.fill(_IMPOSSIBLE)
+        flags.fill(0)
+        offset = i + lowest_diagonal
+        first, last = max(0, offset), min(n, i + highest_diagonal)
+        first_best = _IMPOSSIBLE
+
+        if first == 0:
+            first_best = 0 if overlap or i == 0 else gap_open + (i - 1) * gap_extend
+            current_best[-offset] = first_best
+            current_up[-offset] = first_best if not overlap and i > 0 else _IMPOSSIBLE
+            flags[-offset] = STATE_END if i == 0 else STATE_X | (X_EXTENDS if i > 1 else 0)
+        if i == 0:
+            columns = np.arange(1, last + 1)
+            current_best[columns - offset] = 0 if overlap else gap_open + (columns - 1) * gap_extend
+            flags[columns - offset] = np.where(columns > 1, STATE_Y | Y_EXTENDS, STATE_Y)
+        elif last >= max(1, first):
+            columns = np.arange(max(1, first), last + 1, dtype=np.int64)
+            band_columns = columns - offset
+            best, up, run_flags = _cells(previous_best[band_columns], previous_best[band_columns + 1],
+                                         previous_up[band_columns + 1],
+                                         substitution_rows[string_one[i - 1]][columns - 1], columns,
+                                         first_best, _IMPOSSIBLE, gap_open, gap_extend, None)
+            current_best[band_columns] = best
+            current_up[band_columns] = up
+            flags[band_columns] = run_flags
+        directions.set_row(i, flags)
+        upper_edge[i], lower_edge[i] = current_best[width - 1], current_best[0]
+        previous_best, current_best = current_best, previous_best
+        previous_up, current_up = current_up, previous_up
+    return int(previous_best[n - m - lowest_diagonal]), directions, upper_edge, lower_edge
+
+
+def _out_of_band_bound(m: int, n: int, overlap: bool, best_substitution: int, gap_extend: int,
+                       lowest_diagonal: int, highest_diagonal: int,
+                       upper_edge: np.ndarray, lower_edge: np.ndarray) -> float:
+    """
+    Upper bound on the score of any alignment whose path leaves the band
+    The argument of nwa carries over, as no character of a gap can score more than {gap_extend}
+    :return: The bound, or -inf if no path can leave the band
+    """
+    bounds = [np.array([-np.inf])]
+    rows = np.arange(m + 1)
+
+    exits = (rows + highest_diagonal >= 0) & (rows + highest_diagonal + 1 <= n)
+    exit_rows = rows[exits]
+    bounds.append(upper_edge[exits] + gap_extend
+                  + _best_remaining(m, n, exit_rows, exit_rows + highest_diagonal + 1, best_substitution, gap_extend))
+
+    exits = (rows + lowest_diagonal >= 0) & (rows + lowest_diagonal <= n) & (rows + 1 <= m)
+    exit_rows = rows[exits]
+    bounds.append(lower_edge[exits] + gap_extend
+                  + _best_remaining(m, n, exit_rows + 1, exit_rows + lowest_diagonal, best_substitution, gap_extend))
+
+    if overlap:
+        starts_i = np.concatenate((rows, np.zeros(n, dtype=np.int64)))
+        starts_j = np.concatenate((np.zeros(m + 1, dtype=np.int64), np.arange(1, n + 1)))
+        outside = (starts_j - starts_i < lowest_diagonal) | (starts_j - starts_i > highest_diagonal)
+        bounds.append(_best_remaining(m, n, starts_i[outside], starts_j[outside], best_substitution, gap_extend))
+
+    return float(max(bound.max(initial=-np.inf) for bound in bounds))
+
+
+def _gotoh_banded(string_one: Sequence, string_two: Sequence, overlap: bool, match: int, mismatch: int,
+                  gap_open: int, gap_extend: int, band: int, packed: bool = False, verbose: bool = False,
+                  substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Align within a band around the main diagonal, doubling the band until the result is provably optimal
+    :return: The optimal score, and the banded direction matrix it was found with
+    """
+    m = len(string_one)
+    n = len(string_two)
+    best_substitution = _best_substitution(match, mismatch, substitution_matrix)
+    while True:
+        lowest_diagonal = min(0, n - m) - band
+        highest_diagonal = max(0, n - m) + band
+        score, directions, upper_edge, lower_edge = _fill_banded(string_one, string_two, overlap, match, mismatch,
+                                                                 gap_open, gap_extend, lowest_diagonal,
+                                                                 highest_diagonal, packed, substitution_matrix)
+        covers_matrix = lowest_diagonal <= -m and highest_diagonal >= n
+        bound = _out_of_band_bound(m, n, overlap, best_substitution, gap_extend,
+                                   lowest_diagonal, highest_diagonal, upper_edge, lower_edge)
+        if verbose:
+            print(f'\tBand of {band} diagonals scored {score}, paths leaving the band score at most {bound}')
+        if covers_matrix or score >= bound:
+            return score, directions
+        band = max(1, band * 2)
+
+
+def _traceback(string_one: Sequence, string_two: Sequence, directions: DirectionMatrix, i: int, j: int,
+               state: int, score: int, verbose: bool = False) -> CigarAlignment:
+    """
+    Follow the backtrace from cell (i, j) in {state} until the start of the alignment
+    """
+    # Ops are collected from the end backwards and reversed once, rather than prepending to strings
+    ops = []
+    while (i > 0 or j > 0) and state != STATE_END:
+        flags = directions[i, j]
+        if state == STATE_M:
+            ops.append('M' if string_one[i - 1] == string_two[j - 1] else 'X')
+            i -= 1
+            j -= 1
+            state = directions[i, j] & STATES
+        elif state == STATE_X:
+            ops.append('I')
+            i -= 1
+            state = STATE_X if flags & X_EXTENDS else directions[i, j] & STATES
+        else:
+            ops.append('D')
+            j -= 1
+            state = STATE_Y if flags & Y_EXTENDS else directions[i, j] & STATES
+        if verbose:
+            to_return_one, to_return_two = CigarAlignment.from_ops(string_one, string_two, ops[::-1], score,
+                                                                   i, j).aligned()
+            print(f'\tMoving to ({i}, {j}) in state {"MXYE"[state]}, Updating strings:'
+                  f'\n\t\t{to_return_one}\n\t\t{to_return_two}')
+    return CigarAlignment.from_ops(string_one, string_two, reversed(ops), score, i, j)
+
+
+def gotoh(string_one: Sequence, string_two: Sequence, verbose: bool = False, mode: str = 'global',
+          match: int = 1, mismatch: int = -1, gap_open: int = -3, gap_extend: int = -1, packed: bool = False,
+          band: Optional[int] = None, substitution_matrix: Optional[SubstitutionMatrix] = None, cigar: bool = False):
+    """
+    Calculate the best alignment of two strings with affine gap penalties
+    :param string_one: The first string
+    :param string_two: The second string
+    :param verbose: Should the function be verbose
+    :param mode: 'global' aligns the whole strings, 'local' the best pair of substrings, and 'overlap' lets
+                 gaps before the start of either string go unpenalised as in nwa's overlap detection
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param gap_open: Penalty for the first character of a gap
+    :param gap_extend: Penalty for every further character of a gap
+    :param packed: Whether to store the backtrace with two cells per byte
+    :param band: If given, only compute cells within {band} diagonals of the main diagonal, widening the band
+                 until the alignment is provably optimal. Not available in local mode
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :param cigar: Whether to return the alignment as a CigarAlignment rather than two gapped strings
+    :return: The alignment of {string_one} and {string_two}, and its score
+    """
+    _check(mode, gap_open, gap_extend)
+    m = len(string_one)
+    n = len(string_two)
+
+    if verbose:
+        print(f'Aligning {string_one} and {string_two} in {mode} mode, gaps scoring {gap_open} + {gap_extend} '
+              f'per further character\n')
+        print(f'1. Producing the graph:')
+
+    if band is not None:
+        if band < 0:
+            raise ValueError(f'The band must not be negative, got {band}')
+        if mode == 'local':
+            raise ValueError('A band can only be used in global or overlap mode')
+        score, directions = _gotoh_banded(string_one, string_two, mode == 'overlap', match, mismatch, gap_open,
+                                          gap_extend, band, packed, verbose, substitution_matrix)
+        i, j = m, n
+    else:
+        directions, best, _, max_score, max_location, scores = _fill(string_one, string_two, mode, match,
+                                                                     mismatch, gap_open, gap_extend, packed,
+                                                                     substitution_matrix, keep_scores=verbose)
+        if mode == 'local':
+            score, (i, j) = max_score, max_location
+        else:
+            score, i, j = int(best[n]), m, n
+        if verbose:
+            width = max(len(str(int(value))) for row in scores for value in row)
+            print(f'\t    {" ".join(character.rjust(width) for character in " " + str(string_two))}')
+            print(f'\t{"-" * ((n + 1) * (width + 1) + 4)}')
+            for letter, row in zip(' ' + str(string_one), scores):
+                print(f'\t{letter} | {" ".join(str(int(value)).rjust(width) for value in row)}')
+            print()
+
+    if verbose:
+        print('2. Navigating the graph (backtracking):')
+    alignment = _traceback(string_one, string_two, directions, i, j, directions[i, j] & STATES, score, verbose)
+    if cigar:
+        return alignment, score
+    return alignment.aligned(), score
+
+
+def gotoh_score(string_one: Sequence, string_two: Sequence, verbose: bool = False, mode: str = 'global',
+                match: int = 1, mismatch: int = -1, gap_open: int = -3, gap_extend: int = -1,
+                substitution_matrix: Optional[SubstitutionMatrix] = None) -> Tuple[int, Tuple[int, int]]:
+    """
+    Calculate the best affine gap alignment score of two strings keeping only two rows of the matrix
+    :return: The best score, and the cell (i, j) where the alignment finishes
+    """
+    _check(mode, gap_open, gap_extend)
+    max_score, location = 0, (0, 0)
+    for i, best, _, _ in _rows(string_one, string_two, mode, match, mismatch, gap_open, gap_extend,
+                               substitution_matrix):
+        if mode == 'local' and best.max() > max_score:
+            max_score, location = int(best.max()), (i, int(np.argmax(best)))
+    if mode != 'local':
+        max_score, location = int(best[-1]), (len(string_one), len(string_two))
+    if verbose:
+        print(f'Best {mode} alignment score of {string_one} and {string_two} is {max_score}, '
+              f'finishing at {location}')
+    return max_score, location
+
+
+def _last_rows(string_one: Sequence, string_two: Sequence, match: int, mismatch: int, gap_open: int,
+               gap_extend: int, substitution_matrix: Optional[SubstitutionMatrix], start_gap: int):
+    """
+    The last row of best and X scores of a global alignment
+    """
+    for _, best, up, _ in _rows(string_one, string_two, 'global', match, mismatch, gap_open, gap_extend,
+                                substitution_matrix, start_gap):
+        pass
+    return best, up
+
+
+def _split(first_string: Sequence, second_string: Sequence, match: int, mismatch: int, gap_open: int,
+           gap_extend: int, substitution_matrix: Optional[SubstitutionMatrix], start_gap: int, end_gap: int):
+    """
+    Find where the optimal alignment path crosses the middle row of {first_string} (Myers and Miller)
+    The path either passes through a cell of the middle row, or runs down a gap through it, in which case the
+    forward and reverse halves each opened the same gap
+    :return: The index of {second_string} where the path crosses, and whether it crosses inside a gap
+    """
+    first_string_mid = len(first_string) // 2
+    forward_best, forward_up = _last_rows(first_string[:first_string_mid], second_string, match, mismatch,
+                                          gap_open, gap_extend, substitution_matrix, start_gap)
+    # Reverse as we work backwards from the second half
+    reverse_best, reverse_up = _last_rows(first_string[first_string_mid:][::-1], second_string[::-1], match,
+                                          mismatch, gap_open, gap_extend, substitution_matrix, end_gap)
+    through = forward_best + reverse_best[::-1]
+    in_gap = forward_up + reverse_up[::-1] - gap_open + gap_extend
+    through_mid, gap_mid = int(np.argmax(through)), int(np.argmax(in_gap))
+    if in_gap[gap_mid] > through[through_mid]:
+        return gap_mid, True
+    return through_mid, False
+
+
+def _align_directly(first_string: Sequence, second_string: Sequence, match: int, mismatch: int, gap_open: int,
+                    gap_extend: int, substitution_matrix: Optional[SubstitutionMatrix], start_gap: int,
+                    end_gap: int):
+    """
+    Align sub-problems small enough to keep their whole backtrace
+    """
+    if len(first_string) == 0:
+        return '-' * len(second_string), str(second_string)
+    elif len(second_string) == 0:
+        return str(first_string), '-' * len(first_string)
+    m = len(first_string)
+    n = len(second_string)
+    directions, best, up, _, _, _ = _fill(first_string, second_string, 'global', match, mismatch, gap_open,
+                                          gap_extend, substitution_matrix=substitution_matrix, start_gap=start_gap)
+    # A gap running into the end of the strings continues one that is already open when {end_gap} says so
+    state = directions[m, n] & STATES
+    if up[n] - gap_open + end_gap > best[n]:
+        state = STATE_X
+    return _traceback(first_string, second_string, directions, m, n, state, 0).aligned()
+
+
+# Sub-problems with at most this many cells are aligned with a full backtrace, which is small at this size
+_DIRECT_CELLS = 1 << 16
+
+
+def _myers_miller(first_string: Sequence, second_string: Sequence, verbose: bool, match: int, mismatch: int,
+                  gap_open: int, gap_extend: int, substitution_matrix: Optional[SubstitutionMatrix]):
+    """
+    Hirschberg's algorithm extended to affine gaps, using an explicit stack of sub-problems
+    Each sub-problem remembers the score of the first character of a gap running into its start or end,
+    which is {gap_extend} rather than {gap_open} when the gap was split off from a neighbouring sub-problem
+    :return: The global alignment of {first_string} and {second_string}
+    """
+    Z, W = [], []
+    stack = [(first_string, second_string, gap_open, gap_open, 0)]
+    while stack:
+        first, second, start_gap, end_gap, depth = stack.pop()
+        if verbose:
+            tab_space = "\t" * depth
+            to_print_second = second if len(second) != 0 else '_'
+            to_print_first = first if len(first) != 0 else '_'
+            print(f'{tab_space}Calculating: {to_print_first} and {to_print_second}')
+        if len(first) <= 1 or len(second) <= 1 or len(first) * len(second) <= _DIRECT_CELLS:
+            Z_part, W_part = _align_directly(first, second, match, mismatch, gap_open, gap_extend,
+                                             substitution_matrix, start_gap, end_gap)
+            if verbose:
+                tab_space = "\t" * (depth + 1)
+                print(f'{tab_space}Returning: {Z_part}, {W_part}')
+            Z.append(Z_part)
+            W.append(W_part)
+            continue
+
+        first_string_mid = len(first) // 2
+        second_string_mid, in_gap = _split(first, second, match, mismatch, gap_open, gap_extend,
+                                           substitution_matrix, start_gap, end_gap)
+        if in_gap:
+            # The two characters either side of the middle are deleted as part of one gap
+            stack.append((first[first_string_mid + 1:], second[second_string_mid:], gap_extend, end_gap,
+                          depth + 1))
+            stack.append((first[first_string_mid - 1:first_string_mid + 1], second[second_string_mid:second_string_mid],
+                          gap_extend, gap_extend, depth + 1))
+            stack.append((first[:first_string_mid - 1], second[:second_string_mid], start_gap, gap_extend,
+                          depth + 1))
+        else:
+            stack.append((first[first_string_mid:], second[second_string_mid:], gap_open, end_gap, depth + 1))
+            stack.append((first[:first_string_mid], second[:second_string_mid], start_gap, gap_open, depth + 1))
+    return ''.join(Z), ''.join(W)
+
+
+def gotoh_linear(string_one: Sequence, string_two: Sequence, verbose: bool = False, mode: str = 'global',
+                 match: int = 1, mismatch: int = -1, gap_open: int = -3, gap_extend: int = -1,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None, cigar: bool = False):
+    """
+    Calculate the best alignment of two strings with affine gap penalties in O(m + n) space
+    Local and overlap alignments first find the region they cover with score-only passes, which is then
+    aligned globally with Myers and Miller's divide and conquer
+    :return: The alignment of {string_one} and {string_two}, and its score
+    """
+    _check(mode, gap_open, gap_extend)
+    m = len(string_one)
+    n = len(string_two)
+    settings = (match, mismatch, gap_open, gap_extend, substitution_matrix)
+
+    if mode == 'local':
+        score, (end_one, end_two) = gotoh_score(string_one, string_two, mode='local', match=match,
+                                                mismatch=mismatch, gap_open=gap_open, gap_extend=gap_extend,
+                                                substitution_matrix=substitution_matrix)
+        start_one, start_two = end_one, end_two
+        if score > 0:
+            # The prefixes ending at the best cell are aligned backwards until a cell reaches the best score
+            for i, best, _, _ in _rows(string_one[:end_one][::-1], string_two[:end_two][::-1], 'global', *settings):
+                reached = np.flatnonzero(best == score)
+                if len(reached):
+                    start_one, start_two = end_one - i, end_two - int(reached[0])
+                    break
+        lead_one, lead_two = '', ''
+    elif mode == 'overlap':
+        # Gaps before either string are free, so the alignment is a global one of a suffix of one string
+        # and the whole of the other, whichever scores best from a reverse pass
+        last_column = np.empty(m + 1, dtype=np.int64)
+        for i, best, _, _ in _rows(string_one[::-1], string_two[::-1], 'global', *settings):
+            last_column[m - i] = best[n]
+        from_row = best[::-1]
+        start_one, start_two = (int(np.argmax(last_column)), 0) if last_column.max() >= from_row.max() else \
+            (0, int(np.argmax(from_row)))
+        score = int(max(last_column.max(), from_row.max()))
+        end_one, end_two = m, n
+        lead_one = str(string_one[:start_one]) + '-' * start_two
+        lead_two = '-' * start_one + str(string_two[:start_two])
+    else:
+        start_one, start_two, end_one, end_two = 0, 0, m, n
+        score = int(_last_rows(string_one, string_two, *settings, gap_open)[0][n])
+        lead_one, lead_two = '', ''
+
+    if verbose:
+        print(f'Best {mode} alignment scores {score}, covering [{start_one}:{end_one}] & [{start_two}:{end_two}]')
+    aligned_one, aligned_two = _myers_miller(string_one[start_one:end_one], string_two[start_two:end_two], verbose,
+                                             *settings)
+    if mode == 'overlap':
+        alignment = CigarAlignment.from_aligned(string_one, string_two, lead_one + aligned_one, lead_two + aligned_two,
+                                                score)
+    else:
+        alignment = CigarAlignment.from_aligned(string_one, string_two, aligned_one, aligned_two, score,
+                                                start_one, start_two)
+    if cigar:
+        return alignment, score
+    return alignment.aligned(), score
+
+
+def main(first_string: str, second_string: str, verbose: bool = False, mode: str = 'global',
+         gap_open: int = -3, gap_extend: int = -1, mismatch: int = -1, match: int = 1, band: Optional[int] = None,
+         score_only: bool = False, linear_space: bool = False, substitution_matrix: Optional[str] = None,
+         cigar: bool = False):
+    table = MATRICES.get(substitution_matrix)
+    if score_only:
+        score, location = gotoh_score(first_string, second_string, verbose, mode, match, mismatch, gap_open,
+                                      gap_extend, table)
+        print(f'Best {mode} alignment score of "{first_string}" and "{second_string}" is {score}, '
+              f'finishing at {location}')
+        return
+    if linear_space:
+        alignment, score = gotoh_linear(first_string, second_string, verbose, mode, match, mismatch, gap_open,
+                                        gap_extend, table, cigar=True)
+    else:
+        alignment, score = gotoh(first_string, second_string, verbose, mode, match, mismatch, gap_open, gap_extend,
+                                 band=band, substitution_matrix=table, cigar=True)
+    if cigar:
+        print(f'{mode.capitalize()} Alignment of "{first_string}" and "{second_string}": {alignment} from '
+              f'[{alignment.start_one}:{alignment.end_one}] & [{alignment.start_two}:{alignment.end_two}]')
+    else:
+        aligned_one, aligned_two = alignment.aligned()
+        print(f'{mode.capitalize()} Alignment of "{first_string}" and "{second_string}": \n'
+              f'{aligned_one} & \n{aligned_two}')
+    print(f'With a score of {score}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the optimal alignment of two strings with affine gaps.')
+    parser.add_argument('-f', '--first', required=True, type=str,
+                        help='First string.')
+    parser.add_argument('-s', '--second', required=True, type=str,
+                        help='Second string.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-mo', '--mode', required=False, type=str, default='global', choices=MODES,
+                        help='Find a global, local or overlap alignment.')
+    parser.add_argument('-go', '--gap_open', required=False, type=int, default=-3,
+                        help='Penalty for the first character of a gap.')
+    parser.add_argument('-ge', '--gap_extend', required=False, type=int, default=-1,
+                        help='Penalty for every further character of a gap.')
+    parser.add_argument('-mm', '--mismatch', required=False, type=int, default=-1,
+                        help='Penalty for accepting a mismatch.')
+    parser.add_argument('-m', '--match', required=False, type=int, default=1,
+                        help='Reward for accepting a match.')
+    parser.add_argument('-bw', '--band', required=False, type=int, default=None,
+                        help='Only compute cells within this many diagonals of the main diagonal.')
+    parser.add_argument('-so', '--score_only', action='store_true', required=False,
+                        help='Only report the best score and where it finishes, using linear space.')
+    parser.add_argument('-ls', '--linear_space', action='store_true', required=False,
+                        help='Find the alignment using linear space.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    parser.add_argument('-cg', '--cigar', action='store_true', required=False,
+                        help='Print the alignment as a CIGAR string and the positions it covers.')
+    args = parser.parse_args()
+
+    main(args.first, args.second, args.verbose, args.mode, args.gap_open, args.gap_extend, args.mismatch,
+         args.match, args.band, args.score_only, args.linear_space, args.substitution_matrix, args.cigar)
@@ -0,0 +1,189 @@
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from Alignment.Cigar import CigarAlignment
+from Alignment.NWA import Sequence, nwa
+from Alignment.SWA import swa_linear
+from Helpful_Structures import SubstitutionMatrix, MATRICES, read_sequences
+
+
+# Alignment of one query against many targets in a pool of worker processes
+# The query and scoring are sent to every worker once when it starts, after which only targets are sent.
+# Targets are read a window of a few chunks per worker at a time, sorted by length within the window and cut into
+# chunks of similar work, which are handed out longest first. A new chunk is only submitted when one finishes, so
+# the targets are never all held in memory.
+# Workers only send back the CIGAR runs of each alignment, which are joined to the strings again on arrival.
+
+MODES = ('global', 'local')
+
+# Settings of the current worker process, set once by _initialise_worker
+_worker: Dict[str, object] = {}
+
+
+def align_pair(query: Sequence, target: Sequence, mode: str = 'global', match: int = 1, mismatch: int = -1,
+               indel: int = -1, substitution_matrix: Optional[SubstitutionMatrix] = None) -> CigarAlignment:
+    """
+    Align a query against a single target
+    :return: The alignment
+    """
+    if mode == 'global':
+        alignment, _ = nwa(query, target, match=match, mismatch=mismatch, indel=indel, backend='numpy',
+                           substitution_matrix=substitution_matrix, cigar=True)
+        return alignment
+    alignment, _ = swa_linear(query, target, match=match, mismatch=mismatch, indel=indel,
+                              substitution_matrix=substitution_matrix, cigar=True)
+    return alignment
+
+
+def _initialise_worker(query: Sequence, settings: dict):
+    _worker['query'] = query
+    _worker['settings'] = settings
+
+
+def _align_chunk(chunk: List[Tuple[int, Sequence]]):
+    query, settings = _worker['query'], _worker['settings']
+    results = []
+    for index, target in chunk:
+        alignment = align_pair(query, target, **settings)
+        results.append((index, (alignment.cigar, alignment.score, alignment.start_one, alignment.start_two)))
+    return results
+
+
+def _chunks(targets: Iterator[Tuple[int, Sequence]], query_length: int, chunk_size: int,
+            window: int) -> Iterator[List[Tuple[int, Sequence]]]:
+    """
+    Group targets of similar length, so chunks hold a similar number of cells
+    Targets are read {window} chunks' worth at a time, and only sorted within what has been read
+    :return: Chunks of (index, target), the most expensive of each window first
+    """
+    while True:
+        batch = list(islice(targets, window * chunk_size))
+        if not batch:
+            return
+        batch.sort(key=lambda item: -len(item[1]))
+        total = sum(max(1, query_length * len(target)) for _, target in batch)
+        # Chunks hold at most {chunk_size} targets, and a chunk of long targets closes once it holds its share of cells
+        cells_per_chunk = max(1, total * chunk_size // len(batch))
+        chunk, cells = [], 0
+        for index, target in batch:
+            chunk.append((index, target))
+            cells += max(1, query_length * len(target))
+            if len(chunk) >= chunk_size or cells >= cells_per_chunk:
+                yield chunk
+                chunk, cells = [], 0
+        if chunk:
+            yield chunk
+
+
+def align_many(query: Sequence, targets: Iterable[Sequence], mode: str = 'global', verbose: bool = False,
+               match: int = 1, mismatch: int = -1, indel: int = -1, processes: int = 1, chunk_size: int = 64,
+               ordered: bool = True, substitution_matrix: Optional[SubstitutionMatrix] = None) -> Iterator:
+    """
+    Align a query against every target, streaming results back as they are produced
+    :param query: The query string
+    :param targets: The target strings, consumed lazily so files of any size can be aligned against
+    :param mode: 'global' aligns with nwa, 'local' finds the best local alignment
+    :param verbose: Should the function be verbose
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param processes: Number of worker processes, 1 aligns in the current process
+    :param chunk_size: Most targets sent to a worker at once
+    :param ordered: Whether to yield results in the order of {targets}, rather than as soon as they complete
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :return: Pairs (index, alignment) where alignment is the CigarAlignment of the query and the target numbered
+             {index}
+    """
+    if mode not in MODES:
+        raise ValueError(f'Unknown mode {mode}, expected one of {", ".join(MODES)}')
+    settings = {'mode': mode, 'match': match, 'mismatch': mismatch, 'indel': indel,
+                'substitution_matrix': substitution_matrix}
+    if verbose:
+        print(f'Aligning in chunks of up to {chunk_size} targets using {processes} processes')
+    return _stream(query, enumerate(targets), settings, verbose, processes, chunk_size, ordered)
+
+
+def _stream(query: Sequence, targets: Iterator[Tuple[int, Sequence]], settings: dict, verbose: bool,
+            processes: int, chunk_size: int, ordered: bool) -> Iterator:
+    """
+    Generator behind align_many, kept separate so invalid arguments are reported as soon as it is called
+    """
+    if processes <= 1:
+        for index, target in targets:
+            yield index, align_pair(query, target, **settings)
+        return
+
+    # Results which finished before earlier targets, held until those are yielded
+    waiting = {}
+    next_index = 0
+    chunks = _chunks(targets, len(query), chunk_size, 2 * processes)
+    with ProcessPoolExecutor(processes, initializer=_initialise_worker, initargs=(query, settings)) as pool:
+        # Only a few chunks per worker are in flight, each kept here to join its targets to their alignments
+        pending = {pool.submit(_align_chunk, chunk): dict(chunk) for chunk in islice(chunks, 2 * processes)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk_targets = pending.pop(future)
+                results = [(index, CigarAlignment(query, chunk_targets[index], *compact))
+                           for index, compact in future.result()]
+                for chunk in islice(chunks, 1):
+                    pending[pool.submit(_align_chunk, chunk)] = dict(chunk)
+                if verbose:
+                    print(f'\tChunk of {len(results)} targets finished, {len(pending)} chunks in flight')
+                if not ordered:
+                    yield from results
+                    continue
+                waiting.update(results)
+                while next_index in waiting:
+                    yield next_index, waiting.pop(next_index)
+                    next_index += 1
+
+
+def main(first_string: str, targets_path: str, verbose: bool = False,
+         indel: int = -1, mismatch: int = -1, match: int = 1, mode: str = 'global', processes: int = 1,
+         chunk_size: int = 64, ordered: bool = True, substitution_matrix: Optional[str] = None):
+    names = []
+
+    def targets():
+        for name, target in read_sequences(targets_path):
+            names.append(name)
+            yield target
+
+    for index, alignment in align_many(first_string, targets(), mode, verbose, match, mismatch, indel, processes,
+                                       chunk_size, ordered, MATRICES.get(substitution_matrix)):
+        aligned_one, aligned_two = alignment.aligned()
+        print(f'{names[index]}: query [{alignment.start_one}:{alignment.end_one}] & '
+              f'target [{alignment.start_two}:{alignment.end_two}] with a score of {alignment.score} '
+              f'and CIGAR {alignment}\n{aligned_one} & \n{aligned_two}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Align a string against every string in a file.')
+    parser.add_argument('-f', '--first', required=True, type=str,
+                        help='First string, used as the query.')
+    parser.add_argument('-t', '--targets', required=True, type=str,
+                        help='FASTA file, or file with one string per line, of the targets.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-id', '--indel', required=False, type=int, default=-1,
+                        help='Penalty for inserting / deleting.')
+    parser.add_argument('-mm', '--mismatch', required=False, type=int, default=-1,
+                        help='Penalty for accepting a mismatch.')
+    parser.add_argument('-m', '--match', required=False, type=int, default=1,
+                        help='Reward for accepting a match.')
+    parser.add_argument('-mo', '--mode', required=False, type=str, default='global', choices=MODES,
+                        help='Find global or local alignments.')
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-c', '--chunk_size', required=False, type=int, default=64,
+                        help='Most targets sent to a worker at once.')
+    parser.add_argument('-u', '--unordered', action='store_true', required=False,
+                        help='Print results as soon as they complete rather than in file order.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    args = parser.parse_args()
+
+    main(args.first, args.targets, args.verbose, args.indel, args.mismatch, args.match, args.mode,
+         args.processes, args.chunk_size, not args.unordered, args.substitution_matrix)
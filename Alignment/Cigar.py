@@ -0,0 +1,103 @@
+import re
+from itertools import groupby
+from typing import Iterable, List, Optional, Tuple
+
+# Run-length description of an alignment, as in the CIGAR strings of the SAM format
+# Ops are read with the first string as the query and the second as the reference:
+#   M - a match, consuming a character of both strings
+#   X - a mismatch, consuming a character of both strings
+#   I - a character of the first string aligned against a gap
+#   D - a character of the second string aligned against a gap
+
+OPS = 'MXID'
+
+# Ops which consume a character of the first and of the second string
+_CONSUMES_ONE = 'MXI'
+_CONSUMES_TWO = 'MXD'
+
+
+def parse_cigar(cigar: str) -> List[Tuple[int, str]]:
+    """
+    Split a CIGAR string such as '3M1I2X' into its runs
+    :return: The (length, op) of every run
+    """
+    runs = re.findall(r'(\d+)([A-Z=])', cigar)
+    if ''.join(length + op for length, op in runs) != cigar or any(op not in OPS for _, op in runs):
+        raise ValueError(f'{cigar} is not a CIGAR string of {OPS} ops')
+    return [(int(length), op) for length, op in runs]
+
+
+class CigarAlignment:
+    def __init__(self, string_one, string_two, cigar: List[Tuple[int, str]], score: int,
+                 start_one: int = 0, start_two: int = 0):
+        """
+        An alignment stored as CIGAR runs and the positions where it starts
+        The strings are only referenced, the gapped strings are built when first asked for
+        :param string_one: The first string
+        :param string_two: The second string
+        :param cigar: The (length, op) of every run
+        :param score: The score of the alignment
+        :param start_one: Position in {string_one} where the alignment starts
+        :param start_two: Position in {string_two} where the alignment starts
+        """
+        self.string_one = string_one
+        self.string_two = string_two
+        self.cigar = cigar
+        self.score = score
+        self.start_one = start_one
+        self.start_two = start_two
+        self.end_one = start_one + sum(length for length, op in cigar if op in _CONSUMES_ONE)
+        self.end_two = start_two + sum(length for length, op in cigar if op in _CONSUMES_TWO)
+        self._aligned: Optional[Tuple[str, str]] = None
+
+    @classmethod
+    def from_ops(cls, string_one, string_two, ops: Iterable[str], score: int,
+                 start_one: int = 0, start_two: int = 0) -> 'CigarAlignment':
+        """
+        Build an alignment from its ops, one per column
+        """
+        cigar = [(sum(1 for _ in run), op) for op, run in groupby(ops)]
+        return cls(string_one, string_two, cigar, score, start_one, start_two)
+
+    @classmethod
+    def from_aligned(cls, string_one, string_two, aligned_one: str, aligned_two: str, score: int,
+                     start_one: int = 0, start_two: int = 0) -> 'CigarAlignment':
+        """
+        Build an alignment from its two gapped strings
+        """
+        ops = ('I' if second == '-' else 'D' if first == '-' else 'M' if first == second else 'X'
+               for first, second in zip(aligned_one, aligned_two))
+        alignment = cls.from_ops(string_one, string_two, ops, score, start_one, start_two)
+        alignment._aligned = aligned_one, aligned_two
+        return alignment
+
+    def __str__(self) -> str:
+        return ''.join(f'{length}{op}' for length, op in self.cigar)
+
+    def __repr__(self) -> str:
+        return (f'CigarAlignment({str(self)!r}, score={self.score}, '
+                f'one=[{self.start_one}:{self.end_one}], two=[{self.start_two}:{self.end_two}])')
+
+    def __len__(self) -> int:
+        return sum(length for length, _ in self.cigar)
+
+    def aligned(self) -> Tuple[str, str]:
+        """
+        The gapped strings of the alignment, built once in linear time
+        """
+        if self._aligned is None:
+            one, two = [], []
+            i, j = self.start_one, self.start_two
+            for length, op in self.cigar:
+                if op in _CONSUMES_ONE:
+                    one.append(str(self.string_one[i:i + length]))
+                    i += length
+                else:
+                    one.append('-' * length)
+                if op in _CONSUMES_TWO:
+                    two.append(str(self.string_two[j:j + length]))
+                    j += length
+                else:
+                    two.append('-' * length)
+            self._aligned = ''.join(one), ''.join(two)
+        return self._aligned
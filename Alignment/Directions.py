@@ -0,0 +1,127 @@
+import numpy as np
+
+# Compact storage for the backtrace of the alignment algorithms
+# Each direction is a single bit, so every cell fits in a nibble and two cells can share a byte
+
+DIAGONAL = 1
+UP = 2
+LEFT = 4
+END = 8
+
+# Order in which directions are listed, and therefore preferred when backtracking
+LETTERS = ((DIAGONAL, 'D'), (UP, 'U'), (LEFT, 'L'), (END, 'E'))
+
+
+def first_direction(flags: int) -> str:
+    """
+    Find the preferred direction stored in a cell
+    :param flags: The bitfield of a cell
+    :return: The letter of the first direction set in {flags}, '' if none are set
+    """
+    for bit, letter in LETTERS:
+        if flags & bit:
+            return letter
+    return ''
+
+
+def decode(flags: int) -> str:
+    """
+    Convert the bitfield of a cell into the textual form used by the verbose printers
+    :param flags: The bitfield of a cell
+    :return: A string such as '(D,U,L)', or '' if no directions are set
+    """
+    letters = [letter for bit, letter in LETTERS if flags & bit]
+    return f'({",".join(letters)})' if letters else ''
+
+
+class DirectionMatrix:
+    def __init__(self, rows: int, columns: int, packed: bool = False):
+        """
+        A uint8 matrix of direction bitfields
+        :param rows: Number of rows in the matrix
+        :param columns: Number of columns in the matrix
+        :param packed: Whether to store two cells per byte
+        """
+        self.rows = rows
+        self.columns = columns
+        self.packed = packed
+        self.cells = np.zeros((rows, (columns + 1) // 2 if packed else columns), dtype=np.uint8)
+
+    @property
+    def nbytes(self) -> int:
+        return self.cells.nbytes
+
+    def __getitem__(self, index) -> int:
+        i, j = index
+        if j < 0:
+            j += self.columns
+        if not self.packed:
+            return int(self.cells[i, j])
+        return (int(self.cells[i, j >> 1]) >> ((j & 1) << 2)) & 0xF
+
+    def __setitem__(self, index, flags: int):
+        i, j = index
+        if j < 0:
+            j += self.columns
+        if not self.packed:
+            self.cells[i, j] = flags
+            return
+        shift = (j & 1) << 2
+        self.cells[i, j >> 1] = (int(self.cells[i, j >> 1]) & ~(0xF << shift) & 0xFF) | ((flags & 0xF) << shift)
+
+    def set_row(self, i: int, flags):
+        """
+        Overwrite a full row of the matrix
+        :param i: The row to overwrite
+        :param flags: The bitfields of every cell in the row
+        """
+        flags = np.asarray(flags, dtype=np.uint8)
+        if not self.packed:
+            self.cells[i] = flags
+            return
+        padded = np.zeros(self.cells.shape[1] * 2, dtype=np.uint8)
+        padded[:self.columns] = flags
+        self.cells[i] = padded[0::2] | (padded[1::2] << 4)
+
+    def row(self, i: int) -> np.ndarray:
+        """
+        Read a full row of the matrix
+        :param i: The row to read
+        :return: The bitfields of every cell in the row, one per byte
+        """
+        if not self.packed:
+            return self.cells[i].copy()
+        unpacked = np.empty(self.cells.shape[1] * 2, dtype=np.uint8)
+        unpacked[0::2] = self.cells[i] & 0xF
+        unpacked[1::2] = self.cells[i] >> 4
+        return unpacked[:self.columns]
+
+    def decode(self, i: int, j: int) -> str:
+        return decode(self[i, j])
+
+
+class BandedDirectionMatrix(DirectionMatrix):
+    def __init__(self, rows: int, lowest_diagonal: int, highest_diagonal: int, packed: bool = False):
+        """
+        A direction matrix which only stores cells whose diagonal j - i lies within a band
+        Cells are addressed by their (i, j) position, and rows passed to set_row are in band order
+        :param rows: Number of rows in the matrix
+        :param lowest_diagonal: Smallest value of j - i stored
+        :param highest_diagonal: Largest value of j - i stored
+        :param packed: Whether to store two cells per byte
+        """
+        super().__init__(rows, highest_diagonal - lowest_diagonal + 1, packed)
+        self.lowest_diagonal = lowest_diagonal
+        self.highest_diagonal = highest_diagonal
+
+    def __getitem__(self, index) -> int:
+        i, j = index
+        if not self.lowest_diagonal <= j - i <= self.highest_diagonal:
+            return 0
+        return super().__getitem__((i, j - i - self.lowest_diagonal))
+
+    def __setitem__(self, index, flags: int):
+        i, j = index
+        if not self.lowest_diagonal <= j - i <= self.highest_diagonal:
+            raise IndexError(f'Cell ({i}, {j}) lies outside of the band')
+        super().__setitem__((i, j - i - self.lowest_diagonal), flags)
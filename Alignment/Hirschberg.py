@@ -1,14 +1,20 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
-from Alignment.NWA import nwa
+import numpy as np
+
+from Alignment.NWA import Sequence, nwa, _score_row, _substitution_rows
+from Helpful_Structures import SubstitutionMatrix, MATRICES
 
 
 # Implementation of Hirschberg's algorithm
 # Video providing a visual explanation: https://www.youtube.com/watch?v=cPQeJt-2Y1Q&ab_channel=DavidPowell
 
 
-def nwaScore(string_one: str, string_two: str, verbose: bool = False,
-             match: int = 1, mismatch: int = -1, indel: int = -1):
+def nwaScore(string_one: Sequence, string_two: Sequence, verbose: bool = False,
+             match: int = 1, mismatch: int = -1, indel: int = -1,
+             substitution_matrix: Optional[SubstitutionMatrix] = None) -> np.ndarray:
     """
     Caluclate the last row of the matrix produced by NWA, using O(n) space
     :param string_one: The first string
@@ -17,82 +23,160 @@ def nwaScore(string_one: str, string_two: str, verbose: bool = False,
     :param match: Reward for finding a match
     :param mismatch: Penalty for accepting a mismatch
     :param indel: Penalty for accepting an insert / delete
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
     :return: The last row of the matrix produced by {string_one} and {string_two}
     """
 
     m = len(string_one)
     n = len(string_two)
 
-    current = [i * indel for i in range(n + 1)]
-    next = [0 for i in range(n + 1)]
+    gap_offsets = np.arange(n + 1, dtype=np.int64) * indel
+    current = gap_offsets.copy()
+    next = np.empty(n + 1, dtype=np.int64)
+    candidates = np.empty(n + 1, dtype=np.int64)
+    substitution_rows = _substitution_rows(string_one, string_two, match, mismatch, substitution_matrix)
 
     for i in range(1, m + 1):
-        next[0] = -i
-        for j in range(1, n + 1):
-            diagonal = current[j - 1] + (match if string_two[j - 1] == string_one[i - 1] else mismatch)
-            up = current[j] + indel
-            left = next[j - 1] + indel
-            next[j] = max(diagonal, up, left)
-        current = next
-        next = [0 for i in range(n + 1)]
+        next[0] = i * indel
+        _score_row(current, substitution_rows[string_one[i - 1]], indel, gap_offsets, candidates, next)
+        current, next = next, current
     return current
 
 
-def hirschberg(first_string: str, second_string: str, verbose: bool = False, tabs: int = 0,
-               indel: int = -1, mismatch: int = -1, match: int = 1):
-    if verbose:
-        tab_space = "\t" * tabs
-        to_print_second = second_string if len(second_string) != 0 else '_'
-        to_print_first = first_string if len(first_string) != 0 else '_'
-        print(f'{tab_space}Calculating: {to_print_first} and {to_print_second}')
-    Z = ""
-    W = ""
+def _split(first_string: Sequence, second_string: Sequence, match: int, mismatch: int, indel: int,
+           substitution_matrix: Optional[SubstitutionMatrix] = None) -> int:
+    """
+    Find where the optimal alignment path crosses the middle row of {first_string}
+    :return: The index of {second_string} aligned against the middle of {first_string}
+    """
+    first_string_mid = len(first_string) // 2
+    scoreL = nwaScore(first_string[:first_string_mid], second_string, match=match, mismatch=mismatch, indel=indel,
+                      substitution_matrix=substitution_matrix)
+    # Reverse as we work backwards from the second half
+    scoreR = nwaScore(first_string[first_string_mid:][::-1], second_string[::-1],
+                      match=match, mismatch=mismatch, indel=indel, substitution_matrix=substitution_matrix)
+    return int(np.argmax(scoreL + scoreR[::-1]))
+
+
+def _align_directly(first_string: Sequence, second_string: Sequence, match: int, mismatch: int, indel: int,
+                    substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Align sub-problems too small to split, one string is empty or a single character
+    """
     if len(first_string) == 0:
-        for i in range(0, len(second_string)):
-            Z += '-'
-            W += second_string[i]
-        if verbose:
-            tab_space = "\t" * (tabs + 1)
-            print(f'{tab_space}Returning: {Z}, {W}')
-        return Z, W
+        return '-' * len(second_string), str(second_string)
     elif len(second_string) == 0:
-        for i in range(0, len(first_string)):
-            Z += first_string[i]
-            W += '-'
-        if verbose:
-            tab_space = "\t" * (tabs + 1)
-            print(f'{tab_space}Returning: {Z}, {W}')
-        return Z, W
-    elif len(first_string) == 1 or len(second_string) == 1:
-        Z, W = nwa(first_string, second_string)
-        if verbose:
-            tab_space = "\t" * (tabs + 1)
-            print(f'{tab_space}Returning: {Z}, {W}')
-        return Z, W
-    first_string_len = len(first_string)
-    first_string_mid = first_string_len // 2
-
-    scoreL = nwaScore(first_string[:first_string_mid], second_string, indel=indel, mismatch=mismatch, match=match)
-    scoreR = nwaScore(first_string[first_string_mid:][::-1], second_string[::-1], indel=indel, mismatch=mismatch,
-                      match=match)
-    # Reverse as we work backwards from the second half
+        return str(first_string), '-' * len(first_string)
+    alignment, _ = nwa(first_string, second_string, match=match, mismatch=mismatch, indel=indel,
+                       substitution_matrix=substitution_matrix)
+    return alignment
 
-    sum_of_scores = [i + j for i, j in zip(scoreL, scoreR[::-1])]
-    second_string_mid = max(range(len(sum_of_scores)), key=sum_of_scores.__getitem__)
 
-    Z1, W1 = hirschberg(first_string[:first_string_mid], second_string[:second_string_mid], verbose, tabs + 1)
-    Z2, W2 = hirschberg(first_string[first_string_mid:], second_string[second_string_mid:], verbose, tabs + 1)
+def _hirschberg_serial(first_string: Sequence, second_string: Sequence, verbose: bool = False, tabs: int = 0,
+                       indel: int = -1, mismatch: int = -1, match: int = 1,
+                       substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Hirschberg's algorithm using an explicit stack of sub-problems rather than recursion
+    Sub-problems are popped left to right, so the pieces can be joined in the order they are produced
+    :return: The global alignment of {first_string} and {second_string}
+    """
+    Z, W = [], []
+    stack = [(first_string, second_string, tabs)]
+    while stack:
+        first, second, depth = stack.pop()
+        if verbose:
+            tab_space = "\t" * depth
+            to_print_second = second if len(second) != 0 else '_'
+            to_print_first = first if len(first) != 0 else '_'
+            print(f'{tab_space}Calculating: {to_print_first} and {to_print_second}')
+        if len(first) <= 1 or len(second) <= 1:
+            Z_part, W_part = _align_directly(first, second, match, mismatch, indel, substitution_matrix)
+            if verbose:
+                tab_space = "\t" * (depth + 1)
+                print(f'{tab_space}Returning: {Z_part}, {W_part}')
+            Z.append(Z_part)
+            W.append(W_part)
+            continue
+
+        first_string_mid = len(first) // 2
+        second_string_mid = _split(first, second, match, mismatch, indel, substitution_matrix)
+        stack.append((first[first_string_mid:], second[second_string_mid:], depth + 1))
+        stack.append((first[:first_string_mid], second[:second_string_mid], depth + 1))
+    return ''.join(Z), ''.join(W)
+
+
+def _split_task(task):
+    first_string, second_string, match, mismatch, indel, substitution_matrix = task
+    return _split(first_string, second_string, match, mismatch, indel, substitution_matrix)
+
+
+def _align_task(task):
+    first_string, second_string, match, mismatch, indel, substitution_matrix = task
+    return _hirschberg_serial(first_string, second_string, indel=indel, mismatch=mismatch, match=match,
+                              substitution_matrix=substitution_matrix)
+
+
+def hirschberg(first_string: Sequence, second_string: Sequence, verbose: bool = False, tabs: int = 0,
+               indel: int = -1, mismatch: int = -1, match: int = 1,
+               processes: int = 1, parallel_threshold: int = 1 << 22,
+               substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Calculate the global alignment of two strings in linear space
+    :param first_string: The first string
+    :param second_string: The second string
+    :param verbose: Should the function be verbose
+    :param tabs: Indentation of the verbose output
+    :param indel: Penalty for accepting an insert / delete
+    :param mismatch: Penalty for accepting a mismatch
+    :param match: Reward for finding a match
+    :param processes: Number of worker processes, 1 aligns in the current process
+    :param parallel_threshold: Sub-problems with at least this many cells are split in parallel,
+                               smaller ones are aligned whole by a single worker
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :return: The global alignment of {first_string} and {second_string}
+    """
+    if processes <= 1:
+        return _hirschberg_serial(first_string, second_string, verbose, tabs, indel, mismatch, match,
+                                  substitution_matrix)
+
+    # The two halves of a split are independent, so every large sub-problem in the
+    # frontier can be split at the same time, keeping the frontier in left to right order
+    tab_space = "\t" * tabs
+    frontier = [(first_string, second_string)]
+    with ProcessPoolExecutor(processes) as pool:
+        while True:
+            large = [count for count, (first, second) in enumerate(frontier)
+                     if len(first) > 1 and len(second) > 1 and len(first) * len(second) >= parallel_threshold]
+            if not large:
+                break
+            if verbose:
+                print(f'{tab_space}Splitting {len(large)} sub-problems in parallel')
+            mids = pool.map(_split_task, [(*frontier[count], match, mismatch, indel, substitution_matrix)
+                                          for count in large])
+            splits = dict(zip(large, mids))
+            new_frontier = []
+            for count, (first, second) in enumerate(frontier):
+                if count not in splits:
+                    new_frontier.append((first, second))
+                    continue
+                first_string_mid, second_string_mid = len(first) // 2, splits[count]
+                new_frontier.append((first[:first_string_mid], second[:second_string_mid]))
+                new_frontier.append((first[first_string_mid:], second[second_string_mid:]))
+            frontier = new_frontier
 
-    if verbose:
-        tab_space = "\t" * (tabs + 1)
-        print(f'{tab_space}Returning: {Z}, {W}')
-    return Z1 + Z2, W1 + W2
+        if verbose:
+            print(f'{tab_space}Aligning {len(frontier)} sub-problems in parallel')
+        pieces = list(pool.map(_align_task, [(first, second, match, mismatch, indel, substitution_matrix)
+                                             for first, second in frontier]))
+    return ''.join(Z for Z, _ in pieces), ''.join(W for _, W in pieces)
 
 
 def main(first_string: str, second_string: str, verbose: bool = False,
-         indel: int = -1, mismatch=-1, match: int = 1):
+         indel: int = -1, mismatch=-1, match: int = 1, processes: int = 1,
+         substitution_matrix: Optional[str] = None):
     global_alignment = hirschberg(first_string, second_string, verbose,
-                                  indel=indel, mismatch=mismatch, match=match)
+                                  indel=indel, mismatch=mismatch, match=match, processes=processes,
+                                  substitution_matrix=MATRICES.get(substitution_matrix))
     print(f'Global Alignment of "{first_string}" and "{second_string}": \n'
           f'{global_alignment[0]} & \n{global_alignment[1]}')
 
@@ -111,6 +195,11 @@ if __name__ == '__main__':
                         help='Penalty for accepting a mismatch.')
     parser.add_argument('-m', '--match', required=False, type=int, default=1,
                         help='Reward for accepting a match.')
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
     args = parser.parse_args()
 
-    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match)
+    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match, args.processes,
+         args.substitution_matrix)
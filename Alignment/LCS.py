@@ -1,17 +1,171 @@
 import argparse
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
 
 # Dynamic programming implementation of LCS problem
 # Interactive demo: https://www.cs.usfca.edu/~galles/visualization/DPLCS.html
 
+METHODS = ('dynamic', 'bit_parallel', 'sparse', 'auto')
+
+# 'auto' uses the sparse method when at most this fraction of cells are matches
+SPARSE_FRACTION = 1 / 100
+
+
+def _match_masks(string_two: str) -> Dict[str, int]:
+    """
+    For each character, an integer with bit j set wherever string_two[j] is that character
+    """
+    masks = {}
+    for j, character in enumerate(string_two):
+        masks[character] = masks.get(character, 0) | (1 << j)
+    return masks
+
+
+def _bit_vector(string_one: str, string_two: str) -> int:
+    """
+    Bit-parallel LCS (Allison-Dix, Crochemore et al.), a whole row of the matrix is held in a single integer
+    Bit j of the result is zero exactly when the LCS of {string_one} and string_two[:j + 1] is one longer
+    than that of string_two[:j]
+    :return: The bit vector after processing every character of {string_one}
+    """
+    n = len(string_two)
+    full = (1 << n) - 1
+    masks = _match_masks(string_two)
+    V = full
+    for character in string_one:
+        U = V & masks.get(character, 0)
+        V = ((V + U) | (V - U)) & full
+    return V
+
+
+def lcs_length(string_one: str, string_two: str) -> int:
+    """
+    Calculate the length of the Longest Common Subsequence of two strings in O(m * n / w) time and O(n) space
+    :param string_one: The first string
+    :param string_two: The second string
+    :return: The length of the Longest Common Subsequence of {string_one} and {string_two}
+    """
+    return len(string_two) - bin(_bit_vector(string_one, string_two)).count('1')
+
+
+def _lcs_row(string_one: str, string_two: str) -> np.ndarray:
+    """
+    Calculate the last row of the LCS matrix from the bit vector
+    :return: The LCS length of {string_one} and string_two[:j] for every j
+    """
+    n = len(string_two)
+    V = _bit_vector(string_one, string_two)
+    bits = np.unpackbits(np.frombuffer(V.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8), bitorder='little')[:n]
+    row = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(1 - bits, out=row[1:])
+    return row
+
+
+def _lcs_linear_space(string_one: str, string_two: str, verbose: bool = False) -> str:
+    """
+    Recover a Longest Common Subsequence with Hirschberg's divide and conquer, using bit-parallel rows
+    Sub-problems are kept on an explicit stack and popped left to right
+    :return: A Longest Common Subsequence of {string_one} and {string_two}
+    """
+    pieces = []
+    stack = [(string_one, string_two)]
+    while stack:
+        first, second = stack.pop()
+        if len(first) == 0 or len(second) == 0:
+            continue
+        if len(first) == 1:
+            if first in second:
+                pieces.append(first)
+            continue
+        first_mid = len(first) // 2
+        forward = _lcs_row(first[:first_mid], second)
+        backward = _lcs_row(first[first_mid:][::-1], second[::-1])
+        second_mid = int(np.argmax(forward + backward[::-1]))
+        if verbose:
+            print(f'\tSplitting {first} and {second} at {first[:first_mid]}|{first[first_mid:]} '
+                  f'and {second[:second_mid]}|{second[second_mid:]}')
+        stack.append((first[first_mid:], second[second_mid:]))
+        stack.append((first[:first_mid], second[:second_mid]))
+    return ''.join(pieces)
+
+
+def count_matches(string_one: str, string_two: str) -> int:
+    """
+    Count the cells of the LCS matrix where the two characters are equal, in O(m + n) time
+    :param string_one: The first string
+    :param string_two: The second string
+    :return: The number of pairs (i, j) with string_one[i] == string_two[j]
+    """
+    counts_two = Counter(string_two)
+    return sum(count * counts_two[character] for character, count in Counter(string_one).items())
+
+
+def _lcs_sparse(string_one: str, string_two: str, verbose: bool = False) -> str:
+    """
+    Hunt-Szymanski, only the r matching cells are visited, taking O((r + n) log n) time
+    thresholds[k] is the smallest position in {string_two} at which a common subsequence of length k + 1 can end
+    :return: A Longest Common Subsequence of {string_one} and {string_two}
+    """
+    positions: Dict[str, List[int]] = {}
+    for j, character in enumerate(string_two):
+        positions.setdefault(character, []).append(j)
+
+    thresholds = []
+    # links[k] is the last match (j, previous link) used by the subsequence ending at thresholds[k]
+    links = []
+    for i, character in enumerate(string_one):
+        # Descending order stops one character of string_one being used twice within the same row
+        for j in reversed(positions.get(character, [])):
+            k = bisect_left(thresholds, j)
+            link = (j, links[k - 1] if k > 0 else None)
+            if k == len(thresholds):
+                thresholds.append(j)
+                links.append(link)
+            else:
+                thresholds[k] = j
+                links[k] = link
+        if verbose:
+            print(f'\t{character} | {thresholds}')
+
+    subsequence = []
+    link = links[-1] if links else None
+    while link is not None:
+        j, link = link
+        subsequence.append(string_two[j])
+    return ''.join(reversed(subsequence))
+
 
-def lcs(string_one: str, string_two: str, verbose: bool = False):
+def lcs(string_one: str, string_two: str, verbose: bool = False, method: str = 'dynamic'):
     """
     Calculate the Longest Common Subsequence of two strings
     :param string_one: The first string
     :param string_two: The second string
     :param verbose: Should the function be verbose
+    :param method: 'dynamic' to fill the whole matrix, 'bit_parallel' to use bit-parallel rows in linear space,
+                   'sparse' to only visit matching cells, or 'auto' to choose between the last two from the
+                   number of matching cells
     :return: The Longest Common Subsequence of {StringOne} and {StringTwo}
     """
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method}, expected one of {", ".join(METHODS)}')
+    if method == 'auto':
+        matches = count_matches(string_one, string_two)
+        method = 'sparse' if matches <= SPARSE_FRACTION * len(string_one) * len(string_two) else 'bit_parallel'
+        if verbose:
+            print(f'{matches} of the {len(string_one) * len(string_two)} cells match, using the {method} method')
+    if method == 'sparse':
+        if verbose:
+            print(f'Finding the Longest Common Subsequence of {string_one} and {string_two}\n')
+            print(f'1. Updating the thresholds for each character:')
+        return _lcs_sparse(string_one, string_two, verbose)
+    if method == 'bit_parallel':
+        if verbose:
+            print(f'Finding the Longest Common Subsequence of {string_one} and {string_two}\n')
+            print(f'1. Splitting around the optimal path:')
+        return _lcs_linear_space(string_one, string_two, verbose)
 
     m = len(string_one)
     n = len(string_two)
@@ -48,8 +202,7 @@ def lcs(string_one: str, string_two: str, verbose: bool = False):
     # Following code is used to print LCS
 
     # Create a character array to store the lcs string
-    lcs = [""] * (index + 1)
-    lcs[index] = "\0"
+    lcs = [""] * index
 
     # Start from the right-most-bottom-most corner and
     # one by one store characters in lcs[]
@@ -81,9 +234,14 @@ def lcs(string_one: str, string_two: str, verbose: bool = False):
     return "".join(lcs)
 
 
-def main(first_string: str, second_string: str, verbose: bool = False):
+def main(first_string: str, second_string: str, verbose: bool = False, method: str = 'dynamic',
+         length_only: bool = False):
+    if length_only:
+        print(f'Length of the Longest Common Subsequence of "{first_string}" and "{second_string}": '
+              f'{lcs_length(first_string, second_string)}')
+        return
     print(f'Longest Common Subsequence of "{first_string}" and "{second_string}": '
-          f'{lcs(first_string, second_string, verbose)}')
+          f'{lcs(first_string, second_string, verbose, method)}')
 
 
 if __name__ == '__main__':
@@ -94,8 +252,12 @@ if __name__ == '__main__':
                         help='Second string.')
     parser.add_argument('-v', '--verbose', action='store_true', required=False,
                         help='Verbose output.')
+    parser.add_argument('-me', '--method', required=False, type=str, default='dynamic', choices=METHODS,
+                        help='Algorithm used to find the subsequence.')
+    parser.add_argument('-l', '--length_only', action='store_true', required=False,
+                        help='Only find the length of the subsequence, using bit-parallel rows.')
     args = parser.parse_args()
 
-    main(args.first, args.second, args.verbose)
+    main(args.first, args.second, args.verbose, args.method, args.length_only)
 
 
@@ -1,108 +1,404 @@
 import argparse
+from typing import Callable, Dict, Optional, Union
+
+import numpy as np
+
+from Alignment.Cigar import CigarAlignment
+from Alignment.Directions import BandedDirectionMatrix, DirectionMatrix, DIAGONAL, UP, LEFT, first_direction
+from Helpful_Structures import EncodedSequence, SubstitutionMatrix, MATRICES, codes_of
 
 
 # Dynamic programming implementation of Needleman-Wunsch Alignment
 # Interactive demo: https://bioboot.github.io/bimm143_W20/class-material/nw/
 
 
-def nwa(string_one: str, string_two: str, verbose: bool = False, overlap_detection: bool = False,
-        match: int = 1, mismatch: int = -1, indel: int = -1):
+BACKENDS = ('python', 'numpy')
+
+Sequence = Union[str, EncodedSequence]
+
+
+def _scorer(match: int, mismatch: int,
+            substitution_matrix: Optional[SubstitutionMatrix] = None) -> Callable[[str, str], int]:
     """
-    Calculate the global alignments of two strings
-    :param string_one: The first string
-    :param string_two: The second string
-    :param verbose: Should the function be verbose
-    :param overlap_detection: Whether to use the overlap detection variant
-    :param match: Reward for finding a match
-    :param mismatch: Penalty for accepting a mismatch
-    :param indel: Penalty for accepting an insert / delete
-    :return: The global alignment of {StringOne} and {StringTwo}
+    The function scoring a pair of characters, from the substitution matrix if one is given
     """
+    if substitution_matrix is not None:
+        return substitution_matrix.score
+    return lambda a, b: match if a == b else mismatch
 
+
+def _best_substitution(match: int, mismatch: int, substitution_matrix: Optional[SubstitutionMatrix] = None) -> int:
+    """
+    The highest score any pair of characters can get
+    """
+    if substitution_matrix is not None:
+        return substitution_matrix.max_score
+    return max(match, mismatch)
+
+
+def _fill_python(string_one: Sequence, string_two: Sequence, overlap_detection: bool,
+                 match: int, mismatch: int, indel: int, packed: bool = False,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Fill the score and direction matrices one cell at a time
+    :return: The score matrix as a list of lists, and the direction matrix
+    """
+    # Characters are compared one at a time, which is faster on plain strings
+    string_one, string_two = str(string_one), str(string_two)
+    substitute = _scorer(match, mismatch, substitution_matrix)
     m = len(string_one)
     n = len(string_two)
 
     score_matrix = [[0 for x in range(n + 1)] for x in range(m + 1)]
-    backtrace = [[' ' for x in range(n + 1)] for x in range(m + 1)]
+    directions = DirectionMatrix(m + 1, n + 1, packed)
 
     for i in range(m + 1):
         score_matrix[i][0] = (indel * i) if not overlap_detection else 0
-        backtrace[i][0] = '(U)'
     for j in range(n + 1):
         score_matrix[0][j] = (indel * j) if not overlap_detection else 0
-        backtrace[0][j] = '(L)'
-    backtrace[0][0] = ''
-
-    # Following steps build score_matrix[m+1][n+1] in bottom up fashion. Note
-    # that score_matrix[i][j] contains length of LCS of X[0..i-1] and Y[0..j-1]
-    if verbose:
-        print(f'Finding the Longest Common Subsequence of {string_one} and {string_two}\n')
-        print(f'1. Producing the graph:')
+    directions.set_row(0, [0] + [LEFT] * n)
 
     for i in range(1, m + 1):
+        row = [UP]
         for j in range(1, n + 1):
-            diagonal = score_matrix[i - 1][j - 1] + (match if string_one[i - 1] == string_two[j - 1] else mismatch)
+            diagonal = score_matrix[i - 1][j - 1] + substitute(string_one[i - 1], string_two[j - 1])
             up = score_matrix[i - 1][j] + indel
             left = score_matrix[i][j - 1] + indel
 
             maximal = max(diagonal, left, up)
-            to_add_to_backtrace = []
             score_matrix[i][j] = maximal
-            for score, direction in [(diagonal, 'D'), (up, 'U'), (left, 'L')]:
-                if score == maximal:
-                    to_add_to_backtrace.append(direction)
-            backtrace[i][j] = f'({",".join(to_add_to_backtrace)})'
+            row.append((DIAGONAL if diagonal == maximal else 0)
+                       | (UP if up == maximal else 0)
+                       | (LEFT if left == maximal else 0))
+        directions.set_row(i, row)
+    return score_matrix, directions
+
+
+def _encode(string: str) -> np.ndarray:
+    """
+    View a string as an array of its code points, so characters can be compared in bulk
+    """
+    return np.frombuffer(string.encode('utf-32-le'), dtype=np.uint32)
+
+
+def _substitution_rows(string_one: Sequence, string_two: Sequence, match: int, mismatch: int,
+                       substitution_matrix: Optional[SubstitutionMatrix] = None) -> Dict[str, np.ndarray]:
+    """
+    Substitution scores only depend on the character of string_one, so compute them once per character
+    With a substitution matrix {string_two} is encoded once, and each row is gathered from the matrix
+    :return: For each character of {string_one}, its score against every character of {string_two}
+    """
+    if substitution_matrix is not None:
+        alphabet = substitution_matrix.alphabet
+        codes_two = codes_of(string_two, alphabet)
+        return {character: substitution_matrix.scores[alphabet.code(character)][codes_two]
+                for character in set(string_one)}
+    encoded_two = _encode(str(string_two))
+    return {character: np.where(encoded_two == ord(character), match, mismatch).astype(np.int32)
+            for character in set(string_one)}
+
+
+def _score_row(previous: np.ndarray, substitution: np.ndarray, indel: int, gap_offsets: np.ndarray,
+               candidates: np.ndarray, current: np.ndarray):
+    """
+    Compute a row of the score matrix from the row above it
+    A run of lefts accumulates indel per step, so removing j * indel from each cell lets
+    the left dependency within a row be resolved by a running maximum
+    :param previous: The row above
+    :param substitution: Scores of the row's character against every character of the second string
+    :param indel: Penalty for accepting an insert / delete
+    :param gap_offsets: j * indel for every column j
+    :param candidates: Scratch space the size of a row
+    :param current: The row to fill, current[0] must already hold its boundary value
+    :return: The diagonal and up scores of every cell after the first
+    """
+    diagonal = previous[:-1] + substitution
+    up = previous[1:] + indel
+    candidates[0] = current[0]
+    np.maximum(diagonal, up, out=candidates[1:])
+    candidates -= gap_offsets
+    np.maximum.accumulate(candidates, out=current)
+    current += gap_offsets
+    return diagonal, up
+
+
+def _fill_numpy(string_one: Sequence, string_two: Sequence, overlap_detection: bool,
+                match: int, mismatch: int, indel: int, packed: bool = False,
+                substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Fill the score and direction matrices a row at a time using vectorised operations
+    :return: The score matrix as a preallocated (m + 1) x (n + 1) int32 array, and the direction matrix
+    """
+    m = len(string_one)
+    n = len(string_two)
+
+    score_matrix = np.zeros((m + 1, n + 1), dtype=np.int32)
+    directions = DirectionMatrix(m + 1, n + 1, packed)
+    gap_offsets = np.arange(n + 1, dtype=np.int32) * indel
+    if not overlap_detection:
+        score_matrix[0] = gap_offsets
+        score_matrix[:, 0] = np.arange(m + 1, dtype=np.int32) * indel
+    directions.set_row(0, [0] + [LEFT] * n)
+
+    substitution_rows = _substitution_rows(string_one, string_two, match, mismatch, substitution_matrix)
+    candidates = np.empty(n + 1, dtype=np.int32)
+    flags = np.empty(n + 1, dtype=np.uint8)
+    flags[0] = UP
+    for i in range(1, m + 1):
+        substitution = substitution_rows[string_one[i - 1]]
+        previous = score_matrix[i - 1]
+        current = score_matrix[i]
+        diagonal, up = _score_row(previous, substitution, indel, gap_offsets, candidates, current)
+
+        flags[1:] = ((diagonal == current[1:]) * DIAGONAL
+                     | (up == current[1:]) * UP
+                     | (current[:-1] + indel == current[1:]) * LEFT)
+        directions.set_row(i, flags)
+    return score_matrix, directions
+
+
+# Score given to cells outside of the band, low enough that no move out of them is ever taken
+_OUTSIDE_BAND = -(1 << 40)
+
 
-    index = score_matrix[m][n]
+def _fill_banded(string_one: Sequence, string_two: Sequence, overlap_detection: bool, match: int, mismatch: int,
+                 indel: int, lowest_diagonal: int, highest_diagonal: int, packed: bool = False,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Fill only the cells whose diagonal j - i lies between {lowest_diagonal} and {highest_diagonal}
+    Only two rows of scores are kept, so memory is dominated by the banded direction matrix
+    :return: The score of the best in-band alignment, the banded direction matrix, and the banded scores
+             along the highest and lowest diagonals
+    """
+    m = len(string_one)
+    n = len(string_two)
+    width = highest_diagonal - lowest_diagonal + 1
+
+    # Rows are stored in band order, column c of row i holds cell (i, i + lowest_diagonal + c)
+    # The extra final column is never written, so moving up off the edge of the band is never chosen
+    previous = np.full(width + 1, _OUTSIDE_BAND, dtype=np.int64)
+    current = np.full(width + 1, _OUTSIDE_BAND, dtype=np.int64)
+    directions = BandedDirectionMatrix(m + 1, lowest_diagonal, highest_diagonal, packed)
+    substitution_rows = _substitution_rows(string_one, string_two, match, mismatch, substitution_matrix)
+    flags = np.zeros(width, dtype=np.uint8)
+    upper_edge = np.full(m + 1, _OUTSIDE_BAND, dtype=np.int64)
+    lower_edge = np.full(m + 1, _OUTSIDE_BAND, dtype=np.int64)
+
+    for i in range(m + 1):
+        current.fill(_OUTSIDE_BAND)
+        flags.fill(0)
+        offset = i + lowest_diagonal
+        first, last = max(0, offset), min(n, i + highest_diagonal)
+
+        if first == 0:
+            current[-offset] = (indel * i) if not overlap_detection else 0
+            flags[-offset] = UP if i > 0 else 0
+        if i == 0:
+            columns = np.arange(1, last + 1)
+            current[columns - offset] = (columns * indel) if not overlap_detection else 0
+            flags[columns - offset] = LEFT
+        elif last >= max(1, first):
+            columns = np.arange(max(1, first), last + 1)
+            band_columns = columns - offset
+            diagonal = previous[band_columns] + substitution_rows[string_one[i - 1]][columns - 1]
+            up = previous[band_columns + 1] + indel
+
+            # Same running maximum as the numpy backend, seeded by the cell to the left of the band row
+            seed = current[band_columns[0] - 1] if band_columns[0] > 0 else _OUTSIDE_BAND
+            gap_offsets = columns * indel
+            candidates = np.empty(len(columns) + 1, dtype=np.int64)
+            candidates[0] = seed - (columns[0] - 1) * indel
+            candidates[1:] = np.maximum(diagonal, up) - gap_offsets
+            scores = np.maximum.accumulate(candidates)[1:] + gap_offsets
+            left = np.concatenate(([seed], scores[:-1])) + indel
+
+            current[band_columns] = scores
+            flags[band_columns] = ((diagonal == scores) * DIAGONAL
+                                   | (up == scores) * UP
+                                   | (left == scores) * LEFT)
+        directions.set_row(i, flags)
+        upper_edge[i], lower_edge[i] = current[width - 1], current[0]
+        previous, current = current, previous
+    return int(previous[n - m - lowest_diagonal]), directions, upper_edge, lower_edge
+
+
+def _best_remaining(m: int, n: int, rows: np.ndarray, columns: np.ndarray, best_substitution: int,
+                    indel: int) -> np.ndarray:
+    """
+    Upper bound on the score of a path from each cell (i, j) to (m, n)
+    Reaching diagonal n - m needs at least |(n - m) - (j - i)| indels and the remaining steps can at best all
+    score {best_substitution}, as the score is linear in the number of indels its maximum is at an extreme
+    """
+    lengths = (m - rows) + (n - columns)
+    fewest_gaps = np.abs((n - m) - (columns - rows))
+    fewest = (lengths - fewest_gaps) / 2 * best_substitution + fewest_gaps * indel
+    return np.maximum(fewest, lengths * indel)
 
+
+def _out_of_band_bound(m: int, n: int, overlap_detection: bool, best_substitution: int, indel: int,
+                       lowest_diagonal: int, highest_diagonal: int,
+                       upper_edge: np.ndarray, lower_edge: np.ndarray) -> float:
+    """
+    Upper bound on the score of any alignment whose path leaves the band
+    A path can only leave by moving left off the highest diagonal or up off the lowest one, and everything
+    before that move stayed in the band, so scores no more than the banded score of the edge cell
+    :param upper_edge: Banded scores of the cells (i, i + highest_diagonal)
+    :param lower_edge: Banded scores of the cells (i, i + lowest_diagonal)
+    :return: The bound, or -inf if no path can leave the band
+    """
+    bounds = [np.array([-np.inf])]
+    rows = np.arange(m + 1)
+
+    # Moving left from (i, i + highest_diagonal) requires the new column to exist
+    exits = (rows + highest_diagonal >= 0) & (rows + highest_diagonal + 1 <= n)
+    exit_rows = rows[exits]
+    bounds.append(upper_edge[exits] + indel
+                  + _best_remaining(m, n, exit_rows, exit_rows + highest_diagonal + 1, best_substitution, indel))
+
+    # Moving up from (i, i + lowest_diagonal) to (i + 1, i + lowest_diagonal) requires the new row to exist
+    exits = (rows + lowest_diagonal >= 0) & (rows + lowest_diagonal <= n) & (rows + 1 <= m)
+    exit_rows = rows[exits]
+    bounds.append(lower_edge[exits] + indel
+                  + _best_remaining(m, n, exit_rows + 1, exit_rows + lowest_diagonal, best_substitution, indel))
+
+    if overlap_detection:
+        # Leading gaps are free, so a path may also start on the top or left edge outside of the band
+        starts_i = np.concatenate((rows, np.zeros(n, dtype=np.int64)))
+        starts_j = np.concatenate((np.zeros(m + 1, dtype=np.int64), np.arange(1, n + 1)))
+        outside = (starts_j - starts_i < lowest_diagonal) | (starts_j - starts_i > highest_diagonal)
+        bounds.append(_best_remaining(m, n, starts_i[outside], starts_j[outside], best_substitution, indel))
+
+    return float(max(bound.max(initial=-np.inf) for bound in bounds))
+
+
+def _nwa_banded(string_one: Sequence, string_two: Sequence, overlap_detection: bool, match: int, mismatch: int,
+                indel: int, band: int, packed: bool = False, verbose: bool = False,
+                substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Align within a band around the main diagonal, doubling the band until the result is provably optimal
+    :return: The optimal score, and the banded direction matrix it was found with
+    """
+    m = len(string_one)
+    n = len(string_two)
+    best_substitution = _best_substitution(match, mismatch, substitution_matrix)
+    while True:
+        # The band always contains both the starting and the finishing diagonal
+        lowest_diagonal = min(0, n - m) - band
+        highest_diagonal = max(0, n - m) + band
+        score, directions, upper_edge, lower_edge = _fill_banded(string_one, string_two, overlap_detection, match,
+                                                                 mismatch, indel, lowest_diagonal,
+                                                                 highest_diagonal, packed, substitution_matrix)
+        covers_matrix = lowest_diagonal <= -m and highest_diagonal >= n
+        bound = _out_of_band_bound(m, n, overlap_detection, best_substitution, indel,
+                                   lowest_diagonal, highest_diagonal, upper_edge, lower_edge)
+        if verbose:
+            print(f'\tBand of {band} diagonals scored {score}, paths leaving the band score at most {bound}')
+        if covers_matrix or score >= bound:
+            return score, directions
+        band = max(1, band * 2)
+
+
+def nwa(string_one: Sequence, string_two: Sequence, verbose: bool = False, overlap_detection: bool = False,
+        match: int = 1, mismatch: int = -1, indel: int = -1, backend: str = 'python', packed: bool = False,
+        band: Optional[int] = None, substitution_matrix: Optional[SubstitutionMatrix] = None, cigar: bool = False):
+    """
+    Calculate the global alignments of two strings
+    :param string_one: The first string
+    :param string_two: The second string
+    :param verbose: Should the function be verbose
+    :param overlap_detection: Whether to use the overlap detection variant
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param backend: Engine used to fill the matrix, 'python' or 'numpy'
+    :param packed: Whether to store the backtrace with two cells per byte
+    :param band: If given, only compute cells within {band} diagonals of the main diagonal, widening the band
+                 until the alignment is provably optimal
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :param cigar: Whether to return the alignment as a CigarAlignment rather than two gapped strings
+    :return: The global alignment of {StringOne} and {StringTwo}
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend}, expected one of {", ".join(BACKENDS)}')
+
+    m = len(string_one)
+    n = len(string_two)
+
+    # Following steps build score_matrix[m+1][n+1] in bottom up fashion. Note
+    # that score_matrix[i][j] contains length of LCS of X[0..i-1] and Y[0..j-1]
     if verbose:
+        print(f'Finding the Longest Common Subsequence of {string_one} and {string_two}\n')
+        print(f'1. Producing the graph:')
+
+    if band is not None:
+        if band < 0:
+            raise ValueError(f'The band must not be negative, got {band}')
+        score, directions = _nwa_banded(string_one, string_two, overlap_detection, match, mismatch, indel,
+                                        band, packed, verbose, substitution_matrix)
+    else:
+        fill = _fill_numpy if backend == 'numpy' else _fill_python
+        score_matrix, directions = fill(string_one, string_two, overlap_detection, match, mismatch, indel, packed,
+                                        substitution_matrix)
+        score = int(score_matrix[m][n])
+
+    index = score
+
+    if verbose and band is None:
         tab = '\t'
         print(f'\t       {" ".join([(" " * (len(str(index)))) + i for i in list(string_two)])}')
         print(f'\t{"-" * (n * (len(str(index)) + 2) + 6)}')
-        for col, letter in zip(score_matrix, list(' ' + string_one)):
+        for col, letter in zip(score_matrix, list(' ' + str(string_one))):
             print(f'\t{letter} | {" ".join([(" " * (len(str(index)) + 1 - len(str(i)))) + str(i) for i in col])}')
         print()
 
         print(f'\t       {tab.join([(" " * (len(str(index)))) + i for i in list(string_two)])}')
         print(f'\t{"-" * (n * (len(str(index)) + 2) + 20)}')
-        for col, letter in zip(backtrace, list(' ' + string_one)):
+        for row, letter in enumerate(list(' ' + str(string_one))):
+            col = [directions.decode(row, j) for j in range(n + 1)]
             print(f'\t{letter} | {tab.join([(" " * (len(str(index)) + 1 - len(str(i)))) + str(i) for i in col])}')
         print()
 
-    to_return_one = ""
-    to_return_two = ""
-
     if verbose:
         print('2. Navigating the graph (backtracking):')
+    # Ops are collected from the end backwards and reversed once, rather than prepending to strings
+    ops = []
     i, j = m + 1, n + 1
     while i > 1 or j > 1:
-        current = backtrace[i - 1][j - 1][1]
+        current = first_direction(directions[i - 1, j - 1])
         if current == 'D':
             i -= 1
             j -= 1
-            to_return_one = string_one[i - 1] + to_return_one
-            to_return_two = string_two[j - 1] + to_return_two
+            ops.append('M' if string_one[i - 1] == string_two[j - 1] else 'X')
         elif current == 'L':
             j -= 1
-            to_return_one = '-' + to_return_one
-            to_return_two = string_two[j - 1] + to_return_two
+            ops.append('D')
         else:
             i -= 1
-            to_return_one = string_one[i - 1] + to_return_one
-            to_return_two = '-' + to_return_two
+            ops.append('I')
         if verbose:
+            to_return_one, to_return_two = CigarAlignment.from_ops(string_one, string_two, ops[::-1], score,
+                                                                   i - 1, j - 1).aligned()
             print(f'\tMoving {current}, Updating strings:\n\t\t{to_return_one}\n\t\t{to_return_two}')
 
-    return (to_return_one, to_return_two), score_matrix[m][n]
+    alignment = CigarAlignment.from_ops(string_one, string_two, reversed(ops), score)
+    if cigar:
+        return alignment, score
+    return alignment.aligned(), score
 
 
 def main(first_string: str, second_string: str, verbose: bool = False,
          indel: int = -1, mismatch: int = -1, match: int = 1,
-         overlap_detection: bool = False):
-    global_alignment, alignment_score = nwa(first_string, second_string, verbose, overlap_detection,
-                           match, mismatch, indel)
-    print(f'Global Alignment of "{first_string}" and "{second_string}": \n'
-          f'{global_alignment[0]} & \n{global_alignment[1]}')
+         overlap_detection: bool = False, backend: str = 'python', band: Optional[int] = None,
+         substitution_matrix: Optional[str] = None, cigar: bool = False):
+    alignment, alignment_score = nwa(first_string, second_string, verbose, overlap_detection,
+                                     match, mismatch, indel, backend, band=band,
+                                     substitution_matrix=MATRICES.get(substitution_matrix), cigar=True)
+    if cigar:
+        print(f'Global Alignment of "{first_string}" and "{second_string}": {alignment}')
+    else:
+        global_alignment = alignment.aligned()
+        print(f'Global Alignment of "{first_string}" and "{second_string}": \n'
+              f'{global_alignment[0]} & \n{global_alignment[1]}')
     print(f'With a score of {alignment_score}')
 
 
@@ -122,6 +418,15 @@ if __name__ == '__main__':
                         help='Reward for accepting a match.')
     parser.add_argument('-od', '--overlap_detection', action='store_true', required=False,
                         help='Allow for overlap detection.')
+    parser.add_argument('-b', '--backend', required=False, type=str, default='python', choices=BACKENDS,
+                        help='Engine used to fill the score matrix.')
+    parser.add_argument('-bw', '--band', required=False, type=int, default=None,
+                        help='Only compute cells within this many diagonals of the main diagonal.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    parser.add_argument('-cg', '--cigar', action='store_true', required=False,
+                        help='Print the alignment as a CIGAR string.')
     args = parser.parse_args()
 
-    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match, args.overlap_detection)
+    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match, args.overlap_detection,
+         args.backend, args.band, args.substitution_matrix, args.cigar)
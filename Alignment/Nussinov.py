@@ -1,83 +1,173 @@
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from Helpful_Structures import RNA as RNA_ALPHABET, read_sequences
 
 # Implementaion of the Nussinov Folding Alogrithm
 # Interactive demo: https://rna.informatik.uni-freiburg.de/Teaching/index.jsp?toolName=Nussinov
 
-def couple(a, b):
+# Watson-Crick base pairs, and the G-U wobble pairs which may optionally be allowed as well
+PAIRS = frozenset({("A", "U"), ("U", "A"), ("G", "C"), ("C", "G")})
+WOBBLE_PAIRS = frozenset({("G", "U"), ("U", "G")})
+
+# Pairs of bases are scored in bulk from a table indexed by their codes, the last code is shared by every
+# character outside of the RNA alphabet, which never pairs
+_OTHER = len(RNA_ALPHABET)
+
+# Splits of a diagonal are scored this many cells at a time, bounding the size of the temporary arrays
+_BLOCK_CELLS = 1 << 20
+
+
+def couple(a, b, wobble: bool = False):
     """
-    Return True if RNA nucleotides are Watson-Crick base pairs
+    Return True if RNA nucleotides are Watson-Crick base pairs, or G-U wobble pairs if {wobble} is set
     """
-    pairs = {("A", "U"), ("U", "A"), ("G", "C"), ("C", "G")}  # ...or a list of tuples...
-    # check if pair is a couple
-    if (a, b) in pairs:
-        return True
+    return (a, b) in PAIRS or (wobble and (a, b) in WOBBLE_PAIRS)
 
-    return False
 
-def traceback(L, rna, fold, i, j, verbose=True, tabs: int = 0):
-    print(i, j)
-    if i < j:
-        if L[i][j] == L[i + 1][j]: # 1st rule
-            print('First rule')
-            traceback(L, rna, fold, i + 1, j)
-        elif L[i][j] == L[i][j - 1]: # 2nd rule
-            print('Second rule')
-            traceback(L, rna, fold, i, j - 1)
-        elif L[i][j] == L[i + 1][j - 1] + couple(rna[i], rna[j]): # 3rd rule
-            print('Third rule')
-            fold.append((i, j))
-            traceback(L, rna, fold, i + 1, j - 1)
-        else:
-            for k in range(i + 1, j - 1):
-                if L[i][j] == L[i, k] + L[k + 1][j]: # 4th rule
-                    traceback(L, rna, fold, i, k)
-                    traceback(L, rna, fold, k + 1, j)
-                    break
-                    # break to only find 1 solution
+def pairing_matrix(complementary: int = 1, uncomplementary: int = 0, wobble: bool = False) -> np.ndarray:
+    """
+    Score of pairing every two bases
+    :param complementary: Score of a complementary pair
+    :param uncomplementary: Score of any other pair
+    :param wobble: Whether G-U pairs count as complementary
+    :return: The scores, indexed by the codes of the bases in the RNA alphabet
+    """
+    pairing = np.full((_OTHER + 1, _OTHER + 1), uncomplementary, dtype=np.int32)
+    for a, b in PAIRS | (WOBBLE_PAIRS if wobble else frozenset()):
+        pairing[RNA_ALPHABET.code(a), RNA_ALPHABET.code(b)] = complementary
+    return pairing
+
+
+def encode(RNA: str) -> np.ndarray:
+    """
+    Encode an RNA sequence for pairing_matrix, characters outside of the alphabet become a base which never pairs
+    """
+    raw = np.frombuffer(RNA.encode('ascii', errors='replace'), dtype=np.uint8)
+    return np.minimum(RNA_ALPHABET.encoder[raw], _OTHER)
+
+
+def _fill(codes: np.ndarray, pairing: np.ndarray, minimum_loop_length: int, verbose: bool = False,
+          max_span: Optional[int] = None):
+    """
+    Fill the matrix a diagonal at a time, every cell of a diagonal at once
+    L[i][j] is stored twice, as by_start[i, j - i] and by_end[j, j - i], so for every cell of a diagonal
+    the scores of the left halves of its splits are a row of by_start and those of the right halves
+    a row of by_end, and the best split of the whole diagonal is a single reduction
+    :param max_span: If given, only fill the cells with j - i < {max_span}, taking O(n * max_span) memory
+    :return: by_start and by_end
+    """
+    n = len(codes)
+    width = n if max_span is None else max(1, min(n, max_span))
+    by_start = np.zeros((n, width), dtype=np.int32)
+    by_end = np.zeros((n, width), dtype=np.int32)
+    for diag in range(1, width):
+        count = n - diag
+        maximum = np.zeros(count, dtype=np.int32)
+        if diag > minimum_loop_length:
+            down = by_start[1:count + 1, diag - 1]
+            left = by_start[:count, diag - 1]
+            inner = by_start[1:count + 1, diag - 2] if diag > 1 else 0
+            diagonal_complementary = inner + pairing[codes[:count], codes[diag:]]
+            maximum = np.maximum(np.maximum(down, left), diagonal_complementary)
+            # Split (i, j) at every k, scoring L[i][k] + L[k + 1][j]
+            block = max(1, _BLOCK_CELLS // diag)
+            for first in range(0, count if diag > 1 else 0, block):
+                last = min(count, first + block)
+                splits = by_start[first:last, 1:diag] + by_end[first + diag:last + diag, diag - 2::-1]
+                np.maximum(maximum[first:last], splits.max(axis=1), out=maximum[first:last])
+        by_start[:count, diag] = maximum
+        by_end[diag:, diag] = maximum
+        if verbose:
+            print(f'\tCreating diagonal {diag}:\n\t  {" ".join(str(value) for value in maximum)} ')
+    return by_start, by_end
 
+
+def _score(by_start: np.ndarray, i: int, j: int) -> int:
+    """
+    L[i][j], which is 0 below the main diagonal
+    """
+    return int(by_start[i, j - i]) if j >= i else 0
+
+
+def traceback(by_start: np.ndarray, by_end: np.ndarray, codes: np.ndarray, pairing: np.ndarray, i: int, j: int,
+              minimum_loop_length: int = 0, verbose: bool = False, tabs: int = 0):
+    """
+    Recover the pairs of an optimal fold of the bases i to j, using an explicit stack rather than recursion
+    :return: The pairs (i, j) of the fold
+    """
+    fold = []
+    stack = [(i, j, tabs)]
+    while stack:
+        i, j, depth = stack.pop()
+        if i >= j:
+            continue
+        tab_space = '\t' * depth
+        if verbose:
+            print(f'{tab_space}{i} {j}')
+        score = _score(by_start, i, j)
+        if score == _score(by_start, i + 1, j):  # 1st rule
+            if verbose:
+                print(f'{tab_space}First rule')
+            stack.append((i + 1, j, depth))
+        elif score == _score(by_start, i, j - 1):  # 2nd rule
+            if verbose:
+                print(f'{tab_space}Second rule')
+            stack.append((i, j - 1, depth))
+        elif j - i > minimum_loop_length and \
+                score == _score(by_start, i + 1, j - 1) + pairing[codes[i], codes[j]]:  # 3rd rule
+            if verbose:
+                print(f'{tab_space}Third rule')
+            fold.append((i, j))
+            stack.append((i + 1, j - 1, depth))
+        else:  # 4th rule
+            diag = j - i
+            splits = by_start[i, 1:diag] + by_end[j, diag - 2::-1]
+            # Only the first split is followed, to only find 1 solution
+            k = i + 1 + int(np.flatnonzero(splits == score)[0])
+            if verbose:
+                print(f'{tab_space}Fourth rule, splitting at {k}')
+            stack.append((k + 1, j, depth + 1))
+            stack.append((i, k, depth + 1))
     return fold
 
 
 def nussinov(RNA, minimum_loop_length: int = 0, verbose: bool = False,
-             complementary: int = 1, uncomplementary: int = 0):
-    L = [[0 for x in range(len(RNA))] for y in range(len(RNA))]
+             complementary: int = 1, uncomplementary: int = 0, wobble: bool = False):
+    """
+    Calculate an optimal folding of an RNA sequence
+    :param RNA: The RNA sequence
+    :param minimum_loop_length: Bases closer than this may not pair
+    :param verbose: Should the function be verbose
+    :param complementary: Score of a complementary pair
+    :param uncomplementary: Score of any other pair
+    :param wobble: Whether G-U pairs count as complementary
+    :return: The fold in dot-bracket notation
+    """
+    codes = encode(RNA)
+    pairing = pairing_matrix(complementary, uncomplementary, wobble)
 
     if verbose:
         print('1. Generating the matrix:')
-    for diag in range(1, len(RNA)):
-        if verbose:
-            print(f'\tCreating diagonal {diag}:\n\t  ', end='')
-        for i in range(0, len(RNA) - diag):
-            j = i + diag
-            maximum = 0
-            if j - i > minimum_loop_length:
-                down = L[i+1][j]
-                left = L[i][j-1]
-                diagonal_complementary = L[i+1][j-1] + (complementary if couple(RNA[i], RNA[j]) else uncomplementary)
-
-                k_max = max([L[i][k] + L[k+1][j] for k in range(i+1, j)], default=-float('inf'))
-                maximum = max(down, left, diagonal_complementary, k_max)
-
-            if verbose:
-                print(f'{maximum} ', end='')
-            L[i][j] = maximum
-        if verbose:
-            print()
+    by_start, by_end = _fill(codes, pairing, minimum_loop_length, verbose)
 
     if verbose:
         print('\n\tThe final matrix:')
-        for count, l in enumerate(L):
-            print('\t     ',end='')
-            for count_inner, i in enumerate(l):
+        for count in range(len(RNA)):
+            print('\t     ', end='')
+            for count_inner in range(len(RNA)):
                 if count_inner < count - 1:
                     print('  ', end='')
                 else:
-                    print(f'{i} ', end='')
+                    print(f'{_score(by_start, count, count_inner)} ', end='')
             print('')
 
     if verbose:
         print('2. Performing traceback on the matrix:')
-    fold = traceback(L, RNA, [], 0, len(RNA)-1, verbose=verbose)
+    fold = traceback(by_start, by_end, codes, pairing, 0, len(RNA) - 1, minimum_loop_length, verbose)
 
     dot = ["." for i in range(len(RNA))]
     for s in fold:
@@ -86,21 +176,218 @@ def nussinov(RNA, minimum_loop_length: int = 0, verbose: bool = False,
     return "".join(dot)
 
 
+def nussinov_windows(RNA, max_span: int, minimum_loop_length: int = 0, verbose: bool = False,
+                     complementary: int = 1, uncomplementary: int = 0, wobble: bool = False,
+                     step: int = 1) -> Iterator[Tuple[int, str]]:
+    """
+    Fold every window of {max_span} bases, for scanning long sequences for local structure
+    Only pairs closer than {max_span} are ever scored, so the band of the matrix holding them is filled once and
+    shared by every window, taking O(n * max_span^2) time and O(n * max_span) memory
+    :param RNA: The RNA sequence
+    :param max_span: Length of the windows, bases further apart than this never pair
+    :param minimum_loop_length: Bases closer than this may not pair
+    :param verbose: Should the function be verbose
+    :param complementary: Score of a complementary pair
+    :param uncomplementary: Score of any other pair
+    :param wobble: Whether G-U pairs count as complementary
+    :param step: Distance between the starts of consecutive windows
+    :return: The start of every window and its optimal fold in dot-bracket notation, as they are traced back
+    """
+    if max_span < 1 or step < 1:
+        raise ValueError(f'The span and step must be positive, got {max_span} and {step}')
+    codes = encode(RNA)
+    pairing = pairing_matrix(complementary, uncomplementary, wobble)
+    span = min(len(RNA), max_span)
+
+    if verbose:
+        print(f'1. Generating the band of the matrix within {span} bases of the diagonal:')
+    by_start, by_end = _fill(codes, pairing, minimum_loop_length, verbose, span)
+
+    if verbose:
+        print('2. Performing traceback on every window:')
+    for start in range(0, max(1, len(RNA) - span + 1), step):
+        if verbose:
+            print(f'\tWindow {start} to {start + span - 1}:')
+        fold = traceback(by_start, by_end, codes, pairing, start, start + span - 1, minimum_loop_length, verbose, 2)
+        dot = ["." for i in range(span)]
+        for s in fold:
+            dot[min(s) - start] = "("
+            dot[max(s) - start] = ")"
+        yield start, "".join(dot)
+
+
+FORMATS = ('tsv', 'dot')
+
+# Settings of the current worker process, set once by _initialise_worker
+_worker: Dict[str, object] = {}
+
+
+def _initialise_worker(settings: dict):
+    _worker['settings'] = settings
+
+
+def _fold(RNA: str, max_span: Optional[int] = None, step: int = 1, **settings) -> List[Tuple[int, str]]:
+    """
+    Fold a sequence whole, or every window of it if {max_span} is given
+    :return: The start and dot-bracket fold of every window, a single window starting at 0 when folded whole
+    """
+    if max_span is not None:
+        return list(nussinov_windows(RNA, max_span, step=step, **settings))
+    return [(0, nussinov(RNA, **settings))]
+
+
+def _fold_chunk(chunk: List[Tuple[int, str]]):
+    return [(index, _fold(RNA, **_worker['settings'])) for index, RNA in chunk]
+
+
+def _schedule(sequences: List[str], processes: int, max_span: Optional[int]) -> List[List[Tuple[int, str]]]:
+    """
+    Order the work longest processing time first, so the longest folds never start last and leave cores idle
+    Folding costs n^3, or n * max_span^2 in windows, so short sequences are grouped into chunks of similar cost
+    to save on sending them to workers one at a time
+    :return: Chunks of (index, sequence), the most expensive first
+    """
+    def cost(RNA: str) -> int:
+        span = len(RNA) if max_span is None else min(len(RNA), max_span)
+        return max(1, len(RNA) * span * span)
+
+    order = sorted(range(len(sequences)), key=lambda index: -cost(sequences[index]))
+    # A few chunks per process, so the last ones to finish are always small
+    cost_per_chunk = max(1, sum(cost(RNA) for RNA in sequences) // max(1, 4 * processes))
+    chunks, chunk, chunk_cost = [], [], 0
+    for index in order:
+        chunk.append((index, sequences[index]))
+        chunk_cost += cost(sequences[index])
+        if chunk_cost >= cost_per_chunk:
+            chunks.append(chunk)
+            chunk, chunk_cost = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def fold_many(sequences: Iterable[str], processes: int = 1, ordered: bool = True, verbose: bool = False,
+              minimum_loop_length: int = 0, complementary: int = 1, uncomplementary: int = 0, wobble: bool = False,
+              max_span: Optional[int] = None, step: int = 1) -> Iterator:
+    """
+    Fold many RNA sequences in a pool of worker processes, streaming results back as they are produced
+    :param sequences: The RNA sequences
+    :param processes: Number of worker processes, 1 folds in the current process
+    :param ordered: Whether to yield results in the order of {sequences}, rather than as soon as they complete
+    :param verbose: Should the function be verbose
+    :param minimum_loop_length: Bases closer than this may not pair
+    :param complementary: Score of a complementary pair
+    :param uncomplementary: Score of any other pair
+    :param wobble: Whether G-U pairs count as complementary
+    :param max_span: If given, fold every window of this many bases of each sequence instead of the whole sequence
+    :param step: Distance between the starts of consecutive windows
+    :return: Pairs (index, folds) where folds holds the start and dot-bracket fold of every window of sequences[index]
+    """
+    if max_span is not None and (max_span < 1 or step < 1):
+        raise ValueError(f'The span and step must be positive, got {max_span} and {step}')
+    sequences = list(sequences)
+    settings = {'minimum_loop_length': minimum_loop_length, 'complementary': complementary,
+                'uncomplementary': uncomplementary, 'wobble': wobble, 'max_span': max_span, 'step': step}
+    chunks = _schedule(sequences, processes, max_span)
+    if verbose:
+        print(f'Folding {len(sequences)} sequences in {len(chunks)} chunks using {processes} processes')
+    return _stream(sequences, chunks, settings, verbose, processes, ordered)
+
+
+def _stream(sequences: List[str], chunks: List[List[Tuple[int, str]]], settings: dict, verbose: bool,
+            processes: int, ordered: bool) -> Iterator:
+    """
+    Generator behind fold_many, kept separate so invalid arguments are reported as soon as it is called
+    """
+    if processes <= 1:
+        if ordered:
+            for index, RNA in enumerate(sequences):
+                yield index, _fold(RNA, **settings)
+        else:
+            for chunk in chunks:
+                for index, RNA in chunk:
+                    yield index, _fold(RNA, **settings)
+        return
+
+    # Results which finished before earlier sequences, held until those are yielded
+    waiting = {}
+    next_index = 0
+    with ProcessPoolExecutor(processes, initializer=_initialise_worker, initargs=(settings,)) as pool:
+        # The pool hands out chunks in the order they are submitted, longest first
+        pending = {pool.submit(_fold_chunk, chunk) for chunk in chunks}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results = future.result()
+                if verbose:
+                    print(f'\tChunk of {len(results)} sequences finished, {len(pending)} chunks remaining')
+                if not ordered:
+                    yield from results
+                    continue
+                waiting.update(results)
+                while next_index in waiting:
+                    yield next_index, waiting.pop(next_index)
+                    next_index += 1
+
+
+def main_batch(path: str, minimum_loop_length: int, verbose: bool = False, wobble: bool = False,
+               max_span: Optional[int] = None, step: int = 1, processes: int = 1, ordered: bool = True,
+               output_format: str = 'tsv'):
+    names, sequences = [], []
+    for name, RNA in read_sequences(path):
+        names.append(name)
+        sequences.append(RNA)
+    if output_format == 'tsv':
+        print('name\tstart\tpairs\tstructure')
+    for index, folds in fold_many(sequences, processes, ordered, verbose, minimum_loop_length, wobble=wobble,
+                                  max_span=max_span, step=step):
+        for start, fold in folds:
+            if output_format == 'tsv':
+                print(f'{names[index]}\t{start}\t{fold.count("(")}\t{fold}')
+            else:
+                header = names[index] if max_span is None else f'{names[index]}/{start}'
+                print(f'>{header}\n{sequences[index][start:start + len(fold)]}\n{fold}')
 
 
-def main(RNA: str, minimum_loop_length: int, verbose: bool = False):
-    fold = nussinov(RNA, minimum_loop_length=minimum_loop_length, verbose=verbose)
+def main(RNA: str, minimum_loop_length: int, verbose: bool = False, wobble: bool = False,
+         max_span: Optional[int] = None, step: int = 1):
+    if max_span is not None:
+        print(f'Optimal folds of every {max_span} base window of {RNA} with a minimum loop length of '
+              f'{minimum_loop_length}:')
+        for start, fold in nussinov_windows(RNA, max_span, minimum_loop_length, verbose, wobble=wobble, step=step):
+            print(f'\t{start}\t{fold}')
+        return
+    fold = nussinov(RNA, minimum_loop_length=minimum_loop_length, verbose=verbose, wobble=wobble)
     print(f'Optimal fold for {RNA} with a minimum loop length of {minimum_loop_length}:\n\t{fold}')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate a folding for a RNA sequence')
-    parser.add_argument('-R', '--RNA', required=True, type=str,
-                        help='RNA Sequence.')
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument('-R', '--RNA', type=str,
+                         help='RNA Sequence.')
+    sources.add_argument('-f', '--file', type=str,
+                         help='FASTA file, or file with one sequence per line, to fold every sequence of.')
     parser.add_argument('-mll', '--minimum_loop_length', type=int, required=False, default=1,
                         help='The minimum length allowed for a loop.')
     parser.add_argument('-v', '--verbose', action='store_true', required=False,
                         help='Verbose output.')
+    parser.add_argument('-w', '--wobble', action='store_true', required=False,
+                        help='Allow G-U wobble pairs.')
+    parser.add_argument('-ms', '--max_span', type=int, required=False, default=None,
+                        help='Fold every window of this many bases instead of the whole sequence.')
+    parser.add_argument('-st', '--step', type=int, required=False, default=1,
+                        help='Distance between the starts of consecutive windows.')
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1,
+                        help='Number of worker processes used with --file.')
+    parser.add_argument('-u', '--unordered', action='store_true', required=False,
+                        help='Print results of --file as soon as they complete rather than in file order.')
+    parser.add_argument('-of', '--output_format', required=False, type=str, default='tsv', choices=FORMATS,
+                        help='Print results of --file as tab separated values or dot-bracket records.')
     args = parser.parse_args()
 
-    main(args.RNA, args.minimum_loop_length, args.verbose)
+    if args.file is not None:
+        main_batch(args.file, args.minimum_loop_length, args.verbose, args.wobble, args.max_span, args.step,
+                   args.processes, not args.unordered, args.output_format)
+    else:
+        main(args.RNA, args.minimum_loop_length, args.verbose, args.wobble, args.max_span, args.step)
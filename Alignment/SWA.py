@@ -1,12 +1,22 @@
 import argparse
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from Alignment.Cigar import CigarAlignment
+from Alignment.Directions import DirectionMatrix, DIAGONAL, UP, LEFT, END, first_direction
+from Alignment.Hirschberg import hirschberg
+from Alignment.NWA import Sequence, _scorer, _substitution_rows
+from Helpful_Structures import SubstitutionMatrix, MATRICES
 
 
 # Dynamic programming implementation of Smith-Waterman Alignment
 # Interactive demo: https://observablehq.com/@manzt/smith-waterman-algorithm
 
 
-def swa(string_one: str, string_two: str, verbose: bool = False,
-        match: int = 1, mismatch: int = -1, indel: int = -1):
+def swa(string_one: Sequence, string_two: Sequence, verbose: bool = False,
+        match: int = 1, mismatch: int = -1, indel: int = -1, packed: bool = False,
+        substitution_matrix: Optional[SubstitutionMatrix] = None, cigar: bool = False):
     """
     Calculate the local alignments of two strings
     :param string_one: The first string
@@ -15,19 +25,20 @@ def swa(string_one: str, string_two: str, verbose: bool = False,
     :param match: Reward for finding a match
     :param mismatch: Penalty for accepting a mismatch
     :param indel: Penalty for accepting an insert / delete
+    :param packed: Whether to store the backtrace with two cells per byte
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :param cigar: Whether to return each alignment as a CigarAlignment rather than two gapped strings
     :return: The local alignment of {StringOne} and {StringTwo}
     """
+    string_one, string_two = str(string_one), str(string_two)
+    substitute = _scorer(match, mismatch, substitution_matrix)
 
     m = len(string_one)
     n = len(string_two)
 
     L = [[0 for x in range(n + 1)] for x in range(m + 1)]
-    backtrace = [[' ' for x in range(n + 1)] for x in range(m + 1)]
-
-    for i in range(m + 1):
-        backtrace[i][0] = '(E)'
-    for j in range(n + 1):
-        backtrace[0][j] = '(E)'
+    backtrace = DirectionMatrix(m + 1, n + 1, packed)
+    backtrace.set_row(0, [END] * (n + 1))
 
     # Following steps build L[m+1][n+1] in bottom up fashion. Note
     # that L[i][j] contains length of LCS of X[0..i-1] and Y[0..j-1]
@@ -39,8 +50,9 @@ def swa(string_one: str, string_two: str, verbose: bool = False,
     max_locations = []
 
     for i in range(1, m + 1):
+        row = [END]
         for j in range(1, n + 1):
-            diagonal = L[i - 1][j - 1] + (match if string_one[i - 1] == string_two[j - 1] else mismatch)
+            diagonal = L[i - 1][j - 1] + substitute(string_one[i - 1], string_two[j - 1])
             up = L[i - 1][j] + indel
             left = L[i][j - 1] + indel
 
@@ -52,12 +64,12 @@ def swa(string_one: str, string_two: str, verbose: bool = False,
                 max_locations.append((i, j))
 
             maximal = max(diagonal, left, up, 0)
-            to_add_to_backtrace = []
             L[i][j] = maximal
-            for score, direction in [(diagonal, 'D'), (up, 'U'), (left, 'L'), (0, 'E')]:
-                if score == maximal:
-                    to_add_to_backtrace.append(direction)
-            backtrace[i][j] = f'({",".join(to_add_to_backtrace)})'
+            row.append((DIAGONAL if diagonal == maximal else 0)
+                       | (UP if up == maximal else 0)
+                       | (LEFT if left == maximal else 0)
+                       | (END if maximal == 0 else 0))
+        backtrace.set_row(i, row)
 
     index = L[m][n]
 
@@ -71,7 +83,8 @@ def swa(string_one: str, string_two: str, verbose: bool = False,
 
         print(f'\t       {tab.join([(" " * (len(str(index)))) + i for i in list(string_two)])}')
         print(f'\t{"-" * (n * (len(str(index)) + 2) + 20)}')
-        for col, letter in zip(backtrace, list(' ' + string_one)):
+        for row, letter in enumerate(list(' ' + string_one)):
+            col = [backtrace.decode(row, j) for j in range(n + 1)]
             print(f'\t{letter} | {tab.join([(" " * (len(str(index)) + 1 - len(str(i)))) + str(i) for i in col])}')
         print()
 
@@ -80,34 +93,34 @@ def swa(string_one: str, string_two: str, verbose: bool = False,
 
     to_return = []
     for i, j in max_locations:
-        to_return_one = ""
-        to_return_two = ""
+        # Ops are collected from the end backwards and reversed once, rather than prepending to strings
+        ops = []
 
         if verbose:
             print(f'\tStarting from ({i}, {j})')
 
         while i > 0 or j > 0:
-            current = backtrace[i - 1][j - 1][1]
+            current = first_direction(backtrace[i - 1, j - 1])
             done = False
             if current == 'D':
-                to_return_one = string_one[i - 1] + to_return_one
-                to_return_two = string_two[j - 1] + to_return_two
+                ops.append('M' if string_one[i - 1] == string_two[j - 1] else 'X')
                 i -= 1
                 j -= 1
             elif current == 'L':
-                to_return_one = '-' + to_return_one
-                to_return_two = string_two[j - 1] + to_return_two
+                ops.append('D')
                 j -= 1
             elif current == 'U':
-                to_return_one = string_one[i - 1] + to_return_one
-                to_return_two = '-' + to_return_two
+                ops.append('I')
                 i -= 1
             else:
-                to_return_one = string_one[i - 1] + to_return_one
-                to_return_two = string_two[j - 1] + to_return_two
-                to_return.append((to_return_one, to_return_two))
+                ops.append('M' if string_one[i - 1] == string_two[j - 1] else 'X')
+                alignment = CigarAlignment.from_ops(string_one, string_two, reversed(ops), max_score, i - 1, j - 1)
+                to_return.append(alignment if cigar else alignment.aligned())
                 done = True
             if verbose:
+                start_one, start_two = (i - 1, j - 1) if done else (i, j)
+                to_return_one, to_return_two = CigarAlignment.from_ops(string_one, string_two, ops[::-1], max_score,
+                                                                       start_one, start_two).aligned()
                 print(f'\t\tMoving {current}, Updating strings:\n\t\t\t{to_return_one}\n\t\t\t{to_return_two}')
             if done:
                 break
@@ -115,11 +128,263 @@ def swa(string_one: str, string_two: str, verbose: bool = False,
     return to_return
 
 
+# Score given to cells which can never be part of an alignment
+_FORBIDDEN = -(1 << 40)
+
+
+def _masked_columns(regions: List[Tuple[int, int, int, int]], i: int, n: int) -> np.ndarray:
+    """
+    Find the cells of row {i} which lie inside any of {regions}
+    :param regions: Rectangles of cells (first_row, last_row, first_column, last_column), inclusive
+    :return: A boolean array over the columns 0..n
+    """
+    masked = np.zeros(n + 1, dtype=bool)
+    for first_row, last_row, first_column, last_column in regions:
+        if first_row <= i <= last_row and last_column >= 0:
+            masked[max(first_column, 0):last_column + 1] = True
+    return masked
+
+
+def _local_row(previous: np.ndarray, substitution: np.ndarray, indel: int, gap_offsets: np.ndarray,
+               masked: np.ndarray, first: int, floor: Optional[int]) -> np.ndarray:
+    """
+    Compute a row of a Smith-Waterman style score matrix from the row above it
+    The left dependency is resolved with a running maximum as in nwa, restarted after every masked cell
+    so no path can start at, finish at or pass through one
+    :param previous: The row above
+    :param substitution: Scores of the row's character against every character of the second string
+    :param indel: Penalty for accepting an insert / delete
+    :param gap_offsets: j * indel for every column j
+    :param masked: Cells of the row which may not be used
+    :param first: Value of the first cell of the row
+    :param floor: Lowest score a cell may take, 0 for local alignment or None for no floor
+    :return: The new row
+    """
+    candidates = np.empty(len(previous), dtype=np.int64)
+    candidates[0] = first
+    np.maximum(previous[:-1] + substitution, previous[1:] + indel, out=candidates[1:])
+    if floor is not None:
+        np.maximum(candidates, floor, out=candidates)
+    candidates -= gap_offsets
+    if masked.any():
+        # Each run of usable cells is resolved on its own, so no score is carried across a masked cell
+        usable = ~masked
+        starts = np.flatnonzero(usable & ~np.concatenate(([False], usable[:-1])))
+        ends = np.flatnonzero(usable & ~np.concatenate((usable[1:], [False]))) + 1
+        for start, end in zip(starts, ends):
+            np.maximum.accumulate(candidates[start:end], out=candidates[start:end])
+    else:
+        np.maximum.accumulate(candidates, out=candidates)
+    candidates += gap_offsets
+    candidates[masked] = _FORBIDDEN
+    return candidates
+
+
+def _best_end(string_one: Sequence, string_two: Sequence, match: int, mismatch: int, indel: int,
+              regions: List[Tuple[int, int, int, int]], max_locations: int = 1,
+              substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Score-only forward pass of Smith-Waterman keeping two rows
+    :return: The best score, and up to {max_locations} cells achieving it in row major order
+    """
+    m = len(string_one)
+    n = len(string_two)
+    gap_offsets = np.arange(n + 1, dtype=np.int64) * indel
+    substitution_rows = _substitution_rows(string_one, string_two, match, mismatch, substitution_matrix)
+    previous = np.where(_masked_columns(regions, 0, n), _FORBIDDEN, 0)
+
+    max_score = 0
+    locations = []
+    for i in range(1, m + 1):
+        current = _local_row(previous, substitution_rows[string_one[i - 1]], indel, gap_offsets,
+                             _masked_columns(regions, i, n), 0, 0)
+        row_max = int(current.max())
+        if row_max > max_score:
+            max_score = row_max
+            locations = []
+        if row_max == max_score and row_max > 0 and len(locations) < max_locations:
+            columns = np.flatnonzero(current == row_max)[:max_locations - len(locations)]
+            locations.extend((i, int(j)) for j in columns)
+        previous = current
+    return max_score, locations
+
+
+def _best_start(string_one: Sequence, string_two: Sequence, match: int, mismatch: int, indel: int,
+                regions: List[Tuple[int, int, int, int]], end: Tuple[int, int], score: int,
+                substitution_matrix: Optional[SubstitutionMatrix] = None) -> Tuple[int, int]:
+    """
+    Find where a local alignment scoring {score} and finishing at cell {end} starts
+    The prefixes ending at {end} are aligned backwards, with every path anchored at {end}, until a cell
+    reaches {score}, so only two rows are kept
+    :return: The positions in {string_one} and {string_two} where the alignment starts
+    """
+    end_i, end_j = end
+    reversed_one = string_one[:end_i][::-1]
+    reversed_two = string_two[:end_j][::-1]
+    # Cell (i, j) of the reversed matrix is cell (end_i - i, end_j - j) of the forward one, so the regions, which
+    # already start one past their hit's start, forbid the same cells in both directions
+    reversed_regions = [(end_i - last_row, end_i - first_row, end_j - last_column, end_j - first_column)
+                        for first_row, last_row, first_column, last_column in regions]
+    n = len(reversed_two)
+    gap_offsets = np.arange(n + 1, dtype=np.int64) * indel
+    substitution_rows = _substitution_rows(reversed_one, reversed_two, match, mismatch, substitution_matrix)
+    previous = np.where(_masked_columns(reversed_regions, 0, n), _FORBIDDEN, gap_offsets)
+
+    for i in range(1, len(reversed_one) + 1):
+        reached = np.flatnonzero(previous == score)
+        if len(reached):
+            return end_i - i + 1, end_j - int(reached[0])
+        previous = _local_row(previous, substitution_rows[reversed_one[i - 1]], indel, gap_offsets,
+                              _masked_columns(reversed_regions, i, n), i * indel, None)
+    reached = np.flatnonzero(previous == score)
+    if len(reached):
+        return 0, end_j - int(reached[0])
+    raise ValueError(f'No alignment scoring {score} finishes at {end}')
+
+
+def swa_score(string_one: Sequence, string_two: Sequence, verbose: bool = False,
+              match: int = 1, mismatch: int = -1, indel: int = -1, max_locations: int = 1,
+              substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Calculate the best local alignment score of two strings keeping only two rows of the matrix
+    :param string_one: The first string
+    :param string_two: The second string
+    :param verbose: Should the function be verbose
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param max_locations: Maximum number of tied end positions to report
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :return: The best score, and the cells (i, j) where the best alignments finish
+    """
+    max_score, locations = _best_end(string_one, string_two, match, mismatch, indel, [], max_locations,
+                                     substitution_matrix)
+    if verbose:
+        print(f'Best local alignment score of {string_one} and {string_two} is {max_score}, finishing at:')
+        for i, j in locations:
+            print(f'\t({i}, {j})')
+    return max_score, locations
+
+
+def swa_linear(string_one: Sequence, string_two: Sequence, verbose: bool = False,
+               match: int = 1, mismatch: int = -1, indel: int = -1,
+               substitution_matrix: Optional[SubstitutionMatrix] = None, cigar: bool = False, processes: int = 1):
+    """
+    Calculate the best local alignment of two strings in O(m + n) space
+    A forward score-only pass finds where the alignment finishes, an anchored reverse pass finds where it starts,
+    and the region between them is aligned globally with Hirschberg's algorithm
+    :param string_one: The first string
+    :param string_two: The second string
+    :param verbose: Should the function be verbose
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :param cigar: Whether to return the alignment as a CigarAlignment rather than two gapped strings
+    :param processes: Number of worker processes used by Hirschberg's algorithm
+    :return: The local alignment finishing at the first best cell in row major order, and its score
+    """
+    max_score, locations = _best_end(string_one, string_two, match, mismatch, indel, [],
+                                     substitution_matrix=substitution_matrix)
+    if not locations:
+        alignment = CigarAlignment(string_one, string_two, [], 0)
+        return (alignment if cigar else alignment.aligned()), 0
+    end_one, end_two = locations[0]
+    start_one, start_two = _best_start(string_one, string_two, match, mismatch, indel, [], (end_one, end_two),
+                                       max_score, substitution_matrix)
+    if verbose:
+        print(f'Best local alignment scores {max_score}, covering [{start_one}:{end_one}] & [{start_two}:{end_two}]')
+    # The best local alignment is an optimal global alignment of the region it covers
+    aligned_one, aligned_two = hirschberg(string_one[start_one:end_one], string_two[start_two:end_two], verbose,
+                                          indel=indel, mismatch=mismatch, match=match, processes=processes,
+                                          substitution_matrix=substitution_matrix)
+    alignment = CigarAlignment.from_aligned(string_one, string_two, aligned_one, aligned_two, max_score,
+                                            start_one, start_two)
+    return (alignment if cigar else alignment.aligned()), max_score
+
+
+def swa_top_k(string_one: Sequence, string_two: Sequence, k: int = 1, verbose: bool = False,
+              match: int = 1, mismatch: int = -1, indel: int = -1,
+              substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Find the {k} best non-overlapping local alignments in the style of Waterman-Eggert
+    After each hit is found every cell reached by a diagonal step over a pair of positions inside it is forbidden
+    and the matrix recomputed, so later hits cannot align any pair of positions inside an earlier hit, but may
+    touch it. Only two rows are ever kept.
+
+    >>> swa_top_k('ACGTACACGTAC', 'ACGTAC', 2)
+    [(6, (0, 0), (6, 6)), (6, (6, 0), (12, 6))]
+
+    :param string_one: The first string
+    :param string_two: The second string
+    :param k: Number of hits to find
+    :param verbose: Should the function be verbose
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :return: Up to {k} hits (score, (start_one, start_two), (end_one, end_two)) in decreasing score, each hit
+             aligns string_one[start_one:end_one] with string_two[start_two:end_two]
+    """
+    hits = []
+    regions = []
+    for count in range(k):
+        max_score, locations = _best_end(string_one, string_two, match, mismatch, indel, regions,
+                                         substitution_matrix=substitution_matrix)
+        if max_score <= 0:
+            break
+        end_one, end_two = locations[0]
+        start_one, start_two = _best_start(string_one, string_two, match, mismatch, indel, regions,
+                                           (end_one, end_two), max_score, substitution_matrix)
+        hits.append((max_score, (start_one, start_two), (end_one, end_two)))
+        # Cell (i, j) is reached by a diagonal step over string_one[i - 1] and string_two[j - 1]
+        regions.append((start_one + 1, end_one, start_two + 1, end_two))
+        if verbose:
+            print(f'Hit {count + 1} scores {max_score}: '
+                  f'{string_one[start_one:end_one]} & {string_two[start_two:end_two]}')
+    return hits
+
+
 def main(first_string: str, second_string: str, verbose: bool = False,
-         indel: int = -1, mismatch: int = -1, match: int = 1):
-    local_alignment = swa(first_string, second_string, verbose, match, mismatch, indel)
+         indel: int = -1, mismatch: int = -1, match: int = 1,
+         score_only: bool = False, top_k: Optional[int] = None, substitution_matrix: Optional[str] = None,
+         cigar: bool = False, linear_space: bool = False):
+    table = MATRICES.get(substitution_matrix)
+    if linear_space:
+        alignment, max_score = swa_linear(first_string, second_string, verbose, match, mismatch, indel, table,
+                                          cigar=True)
+        print(f'Local Alignment of "{first_string}" and "{second_string}":')
+        if cigar:
+            print(f'{alignment} from [{alignment.start_one}:{alignment.end_one}] & '
+                  f'[{alignment.start_two}:{alignment.end_two}]')
+        else:
+            string_one, string_two = alignment.aligned()
+            print(f'{string_one} & \n{string_two}')
+        print(f'With a score of {max_score}')
+        return
+    if score_only:
+        max_score, locations = swa_score(first_string, second_string, verbose, match, mismatch, indel,
+                                         substitution_matrix=table)
+        print(f'Best local alignment score of "{first_string}" and "{second_string}": {max_score}')
+        for i, j in locations:
+            print(f'Finishing at {first_string[:i]} & {second_string[:j]}')
+        return
+    if top_k is not None:
+        hits = swa_top_k(first_string, second_string, top_k, verbose, match, mismatch, indel, table)
+        print(f'Top {top_k} local hits of "{first_string}" and "{second_string}":')
+        for max_score, (start_one, start_two), (end_one, end_two) in hits:
+            print(f'{first_string[start_one:end_one]} [{start_one}:{end_one}] & \n'
+                  f'{second_string[start_two:end_two]} [{start_two}:{end_two}] with a score of {max_score}')
+        return
+    local_alignment = swa(first_string, second_string, verbose, match, mismatch, indel,
+                          substitution_matrix=table, cigar=True)
     print(f'Local Alignment of "{first_string}" and "{second_string}":')
-    for string_one, string_two in local_alignment:
+    for alignment in local_alignment:
+        if cigar:
+            print(f'{alignment} from [{alignment.start_one}:{alignment.end_one}] & '
+                  f'[{alignment.start_two}:{alignment.end_two}]')
+            continue
+        string_one, string_two = alignment.aligned()
         print(f'{string_one} & \n{string_two}')
 
 
@@ -137,6 +402,17 @@ if __name__ == '__main__':
                         help='Penalty for accepting a mismatch.')
     parser.add_argument('-m', '--match', required=False, type=int, default=1,
                         help='Reward for accepting a match.')
+    parser.add_argument('-so', '--score_only', action='store_true', required=False,
+                        help='Only report the best score and where it finishes, using linear space.')
+    parser.add_argument('-k', '--top_k', required=False, type=int, default=None,
+                        help='Report this many non-overlapping local hits, using linear space.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    parser.add_argument('-cg', '--cigar', action='store_true', required=False,
+                        help='Print each alignment as a CIGAR string and the positions it covers.')
+    parser.add_argument('-ls', '--linear_space', action='store_true', required=False,
+                        help='Find the single best local alignment using linear space.')
     args = parser.parse_args()
 
-    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match)
+    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match,
+         args.score_only, args.top_k, args.substitution_matrix, args.cigar, args.linear_space)
@@ -0,0 +1,422 @@
+import argparse
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Alignment.Cigar import CigarAlignment
+from Alignment.NWA import Sequence, nwa, _encode, _best_substitution, _OUTSIDE_BAND
+from Helpful_Structures import SubstitutionMatrix, MATRICES, codes_of
+
+
+# Seed-and-extend alignment of a query against a long target, in the style of BLAST and minimap
+# 1. Index the k-mers (or only the minimizers) of the target
+# 2. Look up the query's k-mers to find seed hits, and chain hits lying on the same diagonal
+# 3. Extend each chain along its diagonal without gaps, stopping once the score drops x_drop below its best
+# 4. Around each surviving hit, find where the alignment starts and ends with a score-only pass over the diagonals
+#    within the band of the hit, then align exactly that region with banded nwa
+
+MODES = ('local', 'global')
+STAGES = ('index', 'seed', 'chain', 'extend', 'align')
+
+# Odd 64 bit multiplier used to scramble k-mers, so minimizers are not biased towards runs of the first symbol
+_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _kmers(codes: np.ndarray, k: int, base: int, valid: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack every k-mer of a code array into a single integer
+    :param codes: Symbol codes in the range [0, base)
+    :param k: Length of the k-mers
+    :param base: Number of symbols
+    :param valid: Positions holding a symbol of the alphabet, k-mers covering any other position are dropped
+    :return: The start position and value of every kept k-mer
+    """
+    count = len(codes) - k + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    codes = codes.astype(np.int64)
+    values = np.zeros(count, dtype=np.int64)
+    for offset in range(k):
+        values *= base
+        values += codes[offset:offset + count]
+    positions = np.arange(count, dtype=np.int64)
+    if valid is not None:
+        # A k-mer is valid when none of its k positions are invalid
+        invalid = np.concatenate(([0], np.cumsum(~valid)))
+        keep = invalid[k:] == invalid[:count]
+        positions, values = positions[keep], values[keep]
+    return positions, values
+
+
+def _minimizers(positions: np.ndarray, values: np.ndarray, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keep only the k-mers with the smallest hash in some window of {w} consecutive k-mers
+    Both the target and the query are sampled the same way, so any w + k - 1 long exact match shares a minimizer
+    """
+    if w <= 1 or len(values) <= w:
+        return positions, values
+    hashed = values.astype(np.uint64) * _HASH
+    windows = np.lib.stride_tricks.sliding_window_view(hashed, w)
+    chosen = np.unique(np.argmin(windows, axis=1) + np.arange(len(windows)))
+    return positions[chosen], values[chosen]
+
+
+class KmerIndex:
+    def __init__(self, target: Sequence, k: int = 11, w: int = 1,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None):
+        """
+        Sorted index of the k-mers of a target, built once and reused for every query
+        :param target: The target string
+        :param k: Length of the k-mers
+        :param w: Only index the minimizer of every {w} consecutive k-mers, 1 indexes every k-mer
+        :param substitution_matrix: If given, symbols are encoded with the matrix's alphabet
+        """
+        self.target = target
+        self.k = k
+        self.w = w
+        self.substitution_matrix = substitution_matrix
+        if substitution_matrix is not None:
+            self.symbols = None
+            self.base = len(substitution_matrix.alphabet)
+        else:
+            self.symbols = np.unique(_encode(str(target)))
+            self.base = max(1, len(self.symbols))
+        if self.base ** k >= 1 << 63:
+            raise ValueError(f'{k}-mers over {self.base} symbols do not fit in 64 bits')
+        self.codes, _ = self.encode(target)
+
+        positions, values = _minimizers(*_kmers(self.codes, k, self.base), w)
+        order = np.argsort(values, kind='stable')
+        self.values = values[order]
+        self.positions = positions[order]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def encode(self, sequence: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Convert a sequence into the codes of the index
+        :return: The code of every character, and whether each character appears in the index's alphabet
+        """
+        if self.substitution_matrix is not None:
+            codes = codes_of(sequence, self.substitution_matrix.alphabet)
+            return codes, np.ones(len(codes), dtype=bool)
+        points = _encode(str(sequence))
+        codes = np.searchsorted(self.symbols, points)
+        valid = codes < len(self.symbols)
+        valid[valid] = self.symbols[codes[valid]] == points[valid]
+        # Unknown characters are given their own code, which never matches anything in the target
+        codes[~valid] = self.base
+        return codes, valid
+
+    def seeds(self, query_codes: np.ndarray, query_valid: np.ndarray,
+              max_occurrences: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find every pair of equal k-mers in the query and the index
+        :param query_codes: The query encoded by {encode}
+        :param query_valid: Which characters of the query are in the index's alphabet
+        :param max_occurrences: Ignore k-mers found more often than this in the target, such as repeats
+        :return: The query and target start positions of every seed hit
+        """
+        positions, values = _minimizers(*_kmers(query_codes, self.k, self.base, query_valid), self.w)
+        first = np.searchsorted(self.values, values, side='left')
+        counts = np.searchsorted(self.values, values, side='right') - first
+        if max_occurrences is not None:
+            counts[counts > max_occurrences] = 0
+        total = int(counts.sum())
+        # Expand each query k-mer into one hit per occurrence, without a Python loop
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        hits = np.repeat(first, counts) + np.arange(total) - starts
+        return np.repeat(positions, counts), self.positions[hits]
+
+
+def _chain(query_hits: np.ndarray, target_hits: np.ndarray, k: int, max_gap: int, min_seeds: int) -> np.ndarray:
+    """
+    Join seed hits lying on the same diagonal, no more than {max_gap} apart
+    :return: Rows (diagonal, query_start, query_end, seeds) of every chain with at least {min_seeds} seeds
+    """
+    if len(query_hits) == 0:
+        return np.empty((0, 4), dtype=np.int64)
+    diagonals = target_hits - query_hits
+    order = np.lexsort((query_hits, diagonals))
+    diagonals, query_hits = diagonals[order], query_hits[order]
+    breaks = np.flatnonzero((diagonals[1:] != diagonals[:-1]) | (query_hits[1:] - query_hits[:-1] > max_gap)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(query_hits)]))
+    chains = np.stack((diagonals[starts], query_hits[starts], query_hits[ends - 1] + k, ends - starts), axis=1)
+    return chains[chains[:, 3] >= min_seeds]
+
+
+def _pair_scores(first: np.ndarray, second: np.ndarray, match: int, mismatch: int,
+                 substitution_matrix: Optional[SubstitutionMatrix]) -> np.ndarray:
+    """
+    Scores of aligning two equal length code arrays position by position
+    """
+    if substitution_matrix is not None:
+        return substitution_matrix.scores[first, second].astype(np.int64)
+    return np.where(first == second, match, mismatch)
+
+
+def _x_drop(query_codes: np.ndarray, target_codes: np.ndarray, q: int, t: int, step: int, length: int,
+            match: int, mismatch: int, x_drop: int,
+            substitution_matrix: Optional[SubstitutionMatrix] = None) -> Tuple[int, int]:
+    """
+    Extend along a diagonal without gaps until the score falls {x_drop} below the best seen
+    The diagonal is scored in chunks of doubling size, so a short extension never reads far ahead
+    :param q: Query position the extension starts from, moving right reads q, q + 1 ... and left q - 1, q - 2 ...
+    :param t: Target position matching {q}
+    :param step: 1 to extend right, -1 to extend left
+    :param length: Most cells the extension may cover
+    :return: The best score gained, and the number of cells it covers
+    """
+    best, best_length, total, done, chunk = 0, 0, 0, 0, 64
+    while done < length:
+        size = min(chunk, length - done)
+        if step > 0:
+            scores = _pair_scores(query_codes[q + done:q + done + size], target_codes[t + done:t + done + size],
+                                  match, mismatch, substitution_matrix)
+        else:
+            scores = _pair_scores(query_codes[q - done - size:q - done][::-1],
+                                  target_codes[t - done - size:t - done][::-1], match, mismatch, substitution_matrix)
+        running = total + np.cumsum(scores)
+        peaks = np.maximum.accumulate(np.maximum(running, best))
+        dropped = np.flatnonzero(running < peaks - x_drop)
+        end = int(dropped[0]) if len(dropped) else size
+        if end > 0:
+            peak = int(np.argmax(running[:end]))
+            if running[peak] > best:
+                best, best_length = int(running[peak]), done + peak + 1
+        if len(dropped):
+            break
+        total = int(running[-1])
+        done += size
+        chunk *= 2
+    return best, best_length
+
+
+def _extend(chains: np.ndarray, query_codes: np.ndarray, target_codes: np.ndarray, match: int, mismatch: int,
+            x_drop: int, substitution_matrix: Optional[SubstitutionMatrix] = None) -> List[Tuple[int, int, int, int]]:
+    """
+    Ungapped X-drop extension of every chain in both directions
+    :return: High scoring segment pairs (score, query_start, query_end, diagonal)
+    """
+    m, n = len(query_codes), len(target_codes)
+    segments = []
+    for diagonal, start, end, _ in chains.tolist():
+        # The cells between the chain's first and last seed are scored as they are
+        core = int(_pair_scores(query_codes[start:end], target_codes[start + diagonal:end + diagonal],
+                                match, mismatch, substitution_matrix).sum())
+        left, left_length = _x_drop(query_codes, target_codes, start, start + diagonal, -1,
+                                    min(start, start + diagonal), match, mismatch, x_drop, substitution_matrix)
+        right, right_length = _x_drop(query_codes, target_codes, end, end + diagonal, 1,
+                                      min(m - end, n - end - diagonal), match, mismatch, x_drop, substitution_matrix)
+        segments.append((core + left + right, start - left_length, end + right_length, diagonal))
+    return segments
+
+
+def _banded_ends(query_codes: np.ndarray, target_codes: np.ndarray, lowest_diagonal: int, highest_diagonal: int,
+                 local: bool, match: int, mismatch: int, indel: int,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None) -> Optional[Tuple[int, int, int, int, int]]:
+    """
+    Score only the cells (i, j) whose diagonal j - i lies between {lowest_diagonal} and {highest_diagonal}, to find
+    where the best alignment within them starts and ends
+    Every cell carries the start of the path it was reached by, so no traceback is kept
+    :param local: Whether to find the best local alignment, rather than one of the whole query with free end gaps
+                  on the target
+    :return: The score, query start, target start, query end and target end of the best alignment, or None if the
+             band holds none
+    """
+    m, n = len(query_codes), len(target_codes)
+    width = highest_diagonal - lowest_diagonal + 1
+    # Column c of row i holds cell (i, i + lowest_diagonal + c), the extra final column is never written
+    previous = np.full(width + 1, _OUTSIDE_BAND, dtype=np.int64)
+    previous_starts = np.zeros((2, width + 1), dtype=np.int64)
+    best = None
+    for i in range(m + 1):
+        current = np.full(width + 1, _OUTSIDE_BAND, dtype=np.int64)
+        current_starts = np.zeros((2, width + 1), dtype=np.int64)
+        offset = i + lowest_diagonal
+        columns = np.arange(max(0, offset), min(n, i + highest_diagonal) + 1)
+        if len(columns):
+            band_columns = columns - offset
+            if i == 0:
+                # Leading gaps in the target are free in both modes
+                scores = np.zeros(len(columns), dtype=np.int64)
+                starts = np.stack((np.zeros(len(columns), dtype=np.int64), columns))
+            else:
+                diagonal = np.full(len(columns), _OUTSIDE_BAND, dtype=np.int64)
+                inside = columns > 0
+                diagonal[inside] = previous[band_columns[inside]] + _pair_scores(
+                    query_codes[i - 1], target_codes[columns[inside] - 1], match, mismatch, substitution_matrix)
+                up = previous[band_columns + 1] + indel
+                vertical = np.maximum(diagonal, up)
+                vertical_starts = np.where(diagonal >= up, previous_starts[:, band_columns],
+                                           previous_starts[:, band_columns + 1])
+                if local:
+                    restart = vertical < 0
+                    vertical[restart] = 0
+                    vertical_starts[:, restart] = np.stack((np.full(int(restart.sum()), i), columns[restart]))
+                # Moves along the row are a running maximum, whose source gives the start of each cell's path
+                gap_offsets = columns * indel
+                candidates = vertical - gap_offsets
+                running = np.maximum.accumulate(candidates)
+                sources = np.maximum.accumulate(np.where(candidates == running, np.arange(len(columns)), 0))
+                scores = running + gap_offsets
+                starts = vertical_starts[:, sources]
+            current[band_columns] = scores
+            current_starts[:, band_columns] = starts
+            if local or i == m:
+                top = int(np.argmax(scores))
+                if best is None or scores[top] > best[0]:
+                    best = (int(scores[top]), int(starts[0, top]), int(starts[1, top]), i, int(columns[top]))
+        previous, previous_starts = current, current_starts
+    # Cells only reachable from outside the band keep a score near _OUTSIDE_BAND
+    if best is None or best[0] <= _OUTSIDE_BAND // 2 or (local and best[0] <= 0):
+        return None
+    return best
+
+
+def seed_extend(query: Sequence, target: Sequence, verbose: bool = False, mode: str = 'local',
+                match: int = 1, mismatch: int = -1, indel: int = -1, k: int = 11, w: int = 1,
+                max_gap: Optional[int] = None, min_seeds: int = 1, x_drop: int = 10,
+                min_ungapped_score: Optional[int] = None, band: int = 16, max_occurrences: Optional[int] = None,
+                max_alignments: Optional[int] = None, index: Optional[KmerIndex] = None,
+                substitution_matrix: Optional[SubstitutionMatrix] = None):
+    """
+    Align a query against a long target, only running the quadratic aligners where seeds hit
+    :param query: The query string
+    :param target: The target string
+    :param verbose: Should the function be verbose
+    :param mode: 'local' finds the best local alignment in each window, 'global' aligns the whole query
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param k: Length of the seeds
+    :param w: Only use the minimizer of every {w} consecutive k-mers as seeds
+    :param max_gap: Seeds on the same diagonal at most this far apart are chained, defaults to 4 * k
+    :param min_seeds: Chains with fewer seeds are discarded
+    :param x_drop: Ungapped extension stops once the score falls this far below its best
+    :param min_ungapped_score: Extended chains scoring less are discarded, defaults to the score of one seed
+    :param band: Diagonals either side of a hit searched by the gapped alignment
+    :param max_occurrences: Ignore k-mers found more often than this in the target
+    :param max_alignments: Stop after this many gapped alignments, best ungapped hits first
+    :param index: A prebuilt index of {target}, so it can be shared between queries
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :return: The alignments in decreasing score, and the time taken and hits produced by each stage
+    """
+    if mode not in MODES:
+        raise ValueError(f'Unknown mode {mode}, expected one of {", ".join(MODES)}')
+    m, n = len(query), len(target)
+    max_gap = 4 * k if max_gap is None else max_gap
+    if min_ungapped_score is None:
+        min_ungapped_score = k * _best_substitution(match, mismatch, substitution_matrix)
+    stats: Dict[str, Dict[str, float]] = {}
+
+    def record(stage: str, started: float, hits: int):
+        stats[stage] = {'seconds': time.perf_counter() - started, 'hits': hits}
+        if verbose:
+            print(f'\t{stage:<8}{hits:>10} hits in {stats[stage]["seconds"]:.4f}s')
+
+    if verbose:
+        print(f'Seed-and-extend alignment of a query of length {m} against a target of length {n}')
+    started = time.perf_counter()
+    if index is None:
+        index = KmerIndex(target, k, w, substitution_matrix)
+    elif index.k != k or index.w != w:
+        raise ValueError(f'The index was built with k={index.k}, w={index.w}, not k={k}, w={w}')
+    record('index', started, len(index))
+
+    started = time.perf_counter()
+    query_codes, query_valid = index.encode(query)
+    query_hits, target_hits = index.seeds(query_codes, query_valid, max_occurrences)
+    record('seed', started, len(query_hits))
+
+    started = time.perf_counter()
+    chains = _chain(query_hits, target_hits, k, max_gap, min_seeds)
+    record('chain', started, len(chains))
+
+    started = time.perf_counter()
+    segments = [segment for segment in _extend(chains, query_codes, index.codes, match, mismatch, x_drop,
+                                               substitution_matrix)
+                if segment[0] >= min_ungapped_score]
+    segments.sort(key=lambda segment: -segment[0])
+    record('extend', started, len(segments))
+
+    started = time.perf_counter()
+    alignments = []
+    windows = []
+    for _, query_start, query_end, diagonal in segments:
+        if max_alignments is not None and len(windows) >= max_alignments:
+            break
+        # Project the whole query onto the target along the hit's diagonal, widened by the band
+        first = max(0, diagonal - band)
+        last = min(n, m + diagonal + band)
+        # A hit whose diagonal was already searched by an overlapping window finds nothing new
+        if any(first < other_last and other_first < last and abs(diagonal - other_diagonal) <= band
+               for other_first, other_last, other_diagonal in windows):
+            continue
+        windows.append((first, last, diagonal))
+        # Global alignments span the whole query and local ones may start anywhere, both end anywhere on the target
+        ends = _banded_ends(query_codes, index.codes, diagonal - band, diagonal + band, mode == 'local', match,
+                            mismatch, indel, substitution_matrix)
+        if ends is None:
+            continue
+        _, start_one, start_two, end_one, end_two = ends
+        # The exact region is aligned globally, with a band so the traceback stays small
+        alignment, score = nwa(query[start_one:end_one], target[start_two:end_two], match=match, mismatch=mismatch,
+                               indel=indel, band=band, substitution_matrix=substitution_matrix, cigar=True)
+        alignments.append(CigarAlignment(query, target, alignment.cigar, score, start_one, start_two))
+    alignments.sort(key=lambda alignment: -alignment.score)
+    record('align', started, len(alignments))
+    return alignments, stats
+
+
+def main(first_string: str, second_string: str, verbose: bool = False,
+         indel: int = -1, mismatch: int = -1, match: int = 1, mode: str = 'local', k: int = 11, w: int = 1,
+         x_drop: int = 10, min_seeds: int = 1, band: int = 16, substitution_matrix: Optional[str] = None):
+    alignments, stats = seed_extend(first_string, second_string, verbose, mode, match, mismatch, indel, k, w,
+                                    min_seeds=min_seeds, x_drop=x_drop, band=band,
+                                    substitution_matrix=MATRICES.get(substitution_matrix))
+    print(f'{len(alignments)} alignments of the query against the target:')
+    for alignment in alignments:
+        aligned_one, aligned_two = alignment.aligned()
+        print(f'Query [{alignment.start_one}:{alignment.end_one}] & target [{alignment.start_two}:{alignment.end_two}] '
+              f'with a score of {alignment.score} and CIGAR {alignment}:\n{aligned_one} & \n{aligned_two}')
+    print('Stage timings:')
+    for stage in STAGES:
+        print(f'\t{stage:<8}{stats[stage]["hits"]:>10} hits in {stats[stage]["seconds"]:.4f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Align a query against a long target using seeds.')
+    parser.add_argument('-f', '--first', required=True, type=str,
+                        help='First string, used as the query.')
+    parser.add_argument('-s', '--second', required=True, type=str,
+                        help='Second string, used as the target.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-id', '--indel', required=False, type=int, default=-1,
+                        help='Penalty for inserting / deleting.')
+    parser.add_argument('-mm', '--mismatch', required=False, type=int, default=-1,
+                        help='Penalty for accepting a mismatch.')
+    parser.add_argument('-m', '--match', required=False, type=int, default=1,
+                        help='Reward for accepting a match.')
+    parser.add_argument('-mo', '--mode', required=False, type=str, default='local', choices=MODES,
+                        help='Find local alignments, or align the whole query.')
+    parser.add_argument('-k', '--kmer', required=False, type=int, default=11,
+                        help='Length of the seeds.')
+    parser.add_argument('-w', '--window', required=False, type=int, default=1,
+                        help='Only seed with the minimizer of this many consecutive k-mers.')
+    parser.add_argument('-x', '--x_drop', required=False, type=int, default=10,
+                        help='Stop extending once the score drops this far below its best.')
+    parser.add_argument('-ms', '--min_seeds', required=False, type=int, default=1,
+                        help='Discard chains with fewer seeds.')
+    parser.add_argument('-bw', '--band', required=False, type=int, default=16,
+                        help='Diagonals either side of a hit searched by the gapped alignment.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    args = parser.parse_args()
+
+    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match, args.mode, args.kmer,
+         args.window, args.x_drop, args.min_seeds, args.band, args.substitution_matrix)
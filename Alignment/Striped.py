@@ -0,0 +1,214 @@
+import argparse
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from Alignment.NWA import Sequence
+from Helpful_Structures import SubstitutionMatrix, MATRICES, codes_of
+
+
+# Striped Smith-Waterman (Farrar, 2007) on NumPy vectors
+# Paper: https://doi.org/10.1093/bioinformatics/btl582
+# Query position k * segments + s is held in segment s of lane k, so every lane is independent and a whole column can
+# be updated at once. Vertical gaps only cross from one lane to the next at the end of a column, where the lazy-F
+# loop corrects them and usually stops after a single pass.
+
+# Scores are computed in the narrowest type first, and recomputed in a wider one if they would saturate
+DTYPES = (np.int8, np.int16, np.int32)
+
+
+class QueryProfile:
+    def __init__(self, query: Sequence, match: int = 1, mismatch: int = -1, segments: int = 32,
+                 substitution_matrix: Optional[SubstitutionMatrix] = None):
+        """
+        Precomputed scores of every query position against every symbol, built once per query
+        :param query: The query string
+        :param match: Reward for finding a match
+        :param mismatch: Penalty for accepting a mismatch
+        :param segments: Number of segments each lane of the striped layout is split into
+        :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and
+                                    {mismatch}
+        """
+        self.query = query
+        self.match = match
+        self.mismatch = mismatch
+        self.segments = segments
+        self.lanes = max(1, -(-len(query) // segments))
+        self.substitution_matrix = substitution_matrix
+
+        if substitution_matrix is not None:
+            # Row r scores code r of the matrix's alphabet, so encoded targets index the profile directly
+            self.alphabet = substitution_matrix.alphabet.symbols
+            self.symbols = {symbol: row for row, symbol in enumerate(self.alphabet)}
+            table = np.full((len(self.alphabet) + 1, len(query)), substitution_matrix.min_score, dtype=np.int64)
+            table[:-1] = substitution_matrix.scores[:, codes_of(query, substitution_matrix.alphabet)]
+        else:
+            # Row r scores symbol alphabet[r], the final row scores any symbol missing from the query
+            self.alphabet = ''.join(sorted(set(query)))
+            self.symbols = {symbol: row for row, symbol in enumerate(self.alphabet)}
+            table = np.full((len(self.alphabet) + 1, len(query)), mismatch, dtype=np.int64)
+            for row, symbol in enumerate(self.alphabet):
+                table[row, [position for position, character in enumerate(query) if character == symbol]] = match
+        self.table = table
+        self.max_score = int(table.max()) if table.size else 0
+        self.min_score = int(table.min()) if table.size else 0
+
+        # Padding positions past the end of the query are never reported, their score only has to be valid
+        padded = np.full((len(table), self.segments * self.lanes), min(self.min_score, 0), dtype=np.int64)
+        padded[:, :len(query)] = table
+        # Striped order: padded[row, k * segments + s] moves to striped[row, s, k]
+        self.striped = padded.reshape(len(table), self.lanes, self.segments).transpose(0, 2, 1).copy()
+        self._typed: Dict[type, np.ndarray] = {}
+
+    def encode(self, target: Sequence) -> np.ndarray:
+        """
+        Convert a target into rows of the profile
+        :param target: The target string
+        :return: The profile row used for every character of {target}
+        """
+        if self.substitution_matrix is not None:
+            return codes_of(target, self.substitution_matrix.alphabet).astype(np.intp)
+        unknown = len(self.alphabet)
+        return np.array([self.symbols.get(character, unknown) for character in target], dtype=np.intp)
+
+    def typed(self, dtype) -> np.ndarray:
+        """
+        The striped profile in {dtype}, converted on first use
+        """
+        if dtype not in self._typed:
+            self._typed[dtype] = self.striped.astype(dtype)
+        return self._typed[dtype]
+
+    def position(self, segment: int, lane: int) -> int:
+        return lane * self.segments + segment
+
+
+def _fits(profile: QueryProfile, indel: int, dtype) -> bool:
+    """
+    Whether every score and penalty can be represented in {dtype}
+    """
+    info = np.iinfo(dtype)
+    return info.min <= min(profile.min_score, indel, 0) and profile.max_score < info.max
+
+
+def _striped_kernel(profile: QueryProfile, target_rows: np.ndarray, indel: int, dtype):
+    """
+    Run the striped recurrence over every target character in {dtype}
+    :return: The best score, its segment, lane and target column, or None if the scores would saturate
+    """
+    info = np.iinfo(dtype)
+    striped = profile.typed(dtype)
+    segments, lanes = profile.segments, profile.lanes
+    gap = dtype(indel)
+    # Vertical gaps within a lane are resolved with a running maximum over s * indel offset scores, as in nwa
+    offsets = (np.arange(segments, dtype=dtype) * gap)[:, np.newaxis]
+    # A cell can gain at most the largest profile score per step and is offset by at most segments * |indel|,
+    # stop before either could overflow
+    limit = info.max - max(profile.max_score, 0) - segments * abs(indel)
+    if limit <= 0:
+        return None
+
+    H = np.zeros((segments, lanes), dtype=dtype)
+    diagonal = np.zeros((segments, lanes), dtype=dtype)
+    carried = np.empty((segments, lanes), dtype=dtype)
+    F = np.zeros(lanes, dtype=dtype)
+    best, best_cell = 0, (0, 0, 0)
+    for j, row in enumerate(target_rows):
+        # The cell above-left of segment 0 in lane k is the last segment of lane k - 1
+        diagonal[1:] = H[:-1]
+        diagonal[0, 1:] = H[-1, :-1]
+        diagonal[0, 0] = 0
+        diagonal += striped[row]
+        # Horizontal gaps come from the same position in the previous column
+        H += gap
+        np.maximum(H, diagonal, out=H)
+        np.maximum(H, 0, out=H)
+
+        # Vertical gaps within each lane, every lane at once
+        H -= offsets
+        np.maximum.accumulate(H, axis=0, out=H)
+        H += offsets
+
+        # Lazy-F: carry vertical gaps from the bottom of each lane into the top of the next, until none improve
+        F[1:] = H[-1, :-1]
+        F[1:] += gap
+        while F.max() > 0:
+            np.add(F, offsets, out=carried)
+            if not (carried > H).any():
+                break
+            np.maximum(H, carried, out=H)
+            F[1:] = carried[-1, :-1]
+            F[1:] += gap
+            # Gaps that can no longer improve a cell are dropped, which also keeps them from underflowing
+            np.maximum(F, 0, out=F)
+
+        # Padding cells only ever hold scores carried from earlier cells, so a new best is always a real cell
+        column_best = int(H.max())
+        if column_best > limit:
+            return None
+        if column_best > best:
+            best = column_best
+            segment, lane = np.unravel_index(np.argmax(H), H.shape)
+            best_cell = (int(segment), int(lane), j + 1)
+    return best, best_cell
+
+
+def striped_swa(profile: QueryProfile, target: Sequence, indel: int = -1,
+                verbose: bool = False) -> Tuple[int, int, int]:
+    """
+    Calculate the best local alignment score of a profiled query against a target
+    :param profile: The profile of the query
+    :param target: The target string
+    :param indel: Penalty for accepting an insert / delete
+    :param verbose: Should the function be verbose
+    :return: The best score, and the lengths of the query and target prefixes where it finishes
+    """
+    target_rows = profile.encode(target)
+    for dtype in DTYPES:
+        if not _fits(profile, indel, dtype):
+            continue
+        result = _striped_kernel(profile, target_rows, indel, dtype)
+        if result is None:
+            if verbose:
+                print(f'Scores saturated {np.dtype(dtype).name}, retrying with a wider type')
+            continue
+        best, (segment, lane, j) = result
+        if verbose:
+            print(f'Scored with {np.dtype(dtype).name}')
+        if best == 0:
+            return 0, 0, 0
+        return best, profile.position(segment, lane) + 1, j
+    raise OverflowError('Scores do not fit in any supported integer type')
+
+
+def main(first_string: str, second_string: str, verbose: bool = False,
+         indel: int = -1, mismatch: int = -1, match: int = 1, segments: int = 32,
+         substitution_matrix: Optional[str] = None):
+    profile = QueryProfile(first_string, match, mismatch, segments, MATRICES.get(substitution_matrix))
+    max_score, end_one, end_two = striped_swa(profile, second_string, indel, verbose)
+    print(f'Best local alignment score of "{first_string}" and "{second_string}": {max_score}')
+    print(f'Finishing at {first_string[:end_one]} & {second_string[:end_two]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the optimal local alignment score of two strings.')
+    parser.add_argument('-f', '--first', required=True, type=str,
+                        help='First string, used as the query.')
+    parser.add_argument('-s', '--second', required=True, type=str,
+                        help='Second string, used as the target.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-id', '--indel', required=False, type=int, default=-1,
+                        help='Penalty for inserting / deleting.')
+    parser.add_argument('-mm', '--mismatch', required=False, type=int, default=-1,
+                        help='Penalty for accepting a mismatch.')
+    parser.add_argument('-m', '--match', required=False, type=int, default=1,
+                        help='Reward for accepting a match.')
+    parser.add_argument('-sg', '--segments', required=False, type=int, default=32,
+                        help='Number of segments in each lane of the striped query profile.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    args = parser.parse_args()
+
+    main(args.first, args.second, args.verbose, args.indel, args.mismatch, args.match, args.segments,
+         args.substitution_matrix)
@@ -0,0 +1,400 @@
+import argparse
+import heapq
+import struct
+import sys
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+from itertools import islice
+from typing import BinaryIO, Iterator, List, Tuple
+
+import numpy as np
+
+from Genome_Assembly.Burrows_Wheeler import lf_from_codes, walk_lf_mapping
+from Genome_Assembly.Suffix_Array import suffix_array
+
+# Block-sorting compression, in the manner of bzip2
+# The input is cut into blocks, and each block is transformed in four stages:
+#   1. The BWT groups equal symbols together, the sentinel's row being stored instead of the sentinel
+#   2. Move-to-front turns each symbol into its position in a list of recently seen symbols, so runs become zeros
+#   3. Runs of zeros are written in bijective base 2 with the two symbols RUNA and RUNB, other values being shifted
+#      up by one. Unlike printing counts between the symbols, this can never be mistaken for the data
+#   4. Canonical Huffman coding of the resulting symbols, only the code length of every symbol being stored
+# A compressed stream is a header followed by one frame per block, each frame holding everything needed to decode its
+# block, and an empty frame marking the end. Blocks are compressed and decompressed in parallel, and frames can be
+# decoded one at a time as they are read.
+
+MAGIC = b'BWTZ'
+FORMAT_VERSION = 1
+BLOCK_SIZE = 1 << 20
+# Symbols of the run length stage: RUNA, RUNB and every non-zero move-to-front value shifted up by one
+RUNA, RUNB = 0, 1
+SYMBOLS = 257
+# Longest Huffman code, bounding the decoding table at 2 ** MAX_CODE_LENGTH entries
+MAX_CODE_LENGTH = 16
+# Stream header: magic, format version, block size
+_HEADER = struct.Struct('<4sBI')
+# Frame header: block length, sentinel row, run length symbols, Huffman payload bytes, CRC-32 of the block
+_FRAME = struct.Struct('<IIIII')
+# Bits of the Huffman payload decoded per table lookup pass
+_DECODE_BITS = 1 << 22
+
+
+def _bwt(block: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    :return: The BWT of the block with its sentinel removed, and the row the sentinel was in
+    """
+    array = suffix_array(block)
+    primary = int(np.flatnonzero(array == 0)[0])
+    rows = np.delete(array, primary)
+    return block[rows - 1], primary
+
+
+def _inverse_bwt(bwt: np.ndarray, primary: int) -> bytearray:
+    codes = np.insert(bwt.astype(np.int16) + 1, primary, 0)
+    decoded = bytearray(len(bwt))
+    walk_lf_mapping(lf_from_codes(codes), np.insert(bwt, primary, 0), np.frombuffer(decoded, dtype=np.uint8))
+    return decoded
+
+
+def _move_to_front(bwt: np.ndarray) -> np.ndarray:
+    """
+    Move-to-front transform, only the first symbol of every run needing a list lookup as the rest of a run are zeros
+    """
+    mtf = np.zeros(len(bwt), dtype=np.uint8)
+    heads = np.flatnonzero(np.diff(bwt.astype(np.int16), prepend=-1))
+    recent = list(range(256))
+    ranks = []
+    for symbol in bwt[heads].tolist():
+        rank = recent.index(symbol)
+        ranks.append(rank)
+        if rank:
+            del recent[rank]
+            recent.insert(0, symbol)
+    mtf[heads] = ranks
+    return mtf
+
+
+def _inverse_move_to_front(values: List[int], lengths: np.ndarray) -> np.ndarray:
+    """
+    Undo move-to-front, where every value is repeated the given number of times
+    """
+    recent = list(range(256))
+    symbols = []
+    for value in values:
+        if value:
+            symbol = recent.pop(value)
+            recent.insert(0, symbol)
+        symbols.append(recent[0])
+    return np.repeat(np.array(symbols, dtype=np.uint8), lengths)
+
+
+def _run_length(mtf: np.ndarray) -> np.ndarray:
+    """
+    Write every run of zeros as its length in bijective base 2, RUNA being the digit 1 and RUNB the digit 2
+    :return: The run length symbols, least significant digit first
+    """
+    zero = np.concatenate(([False], mtf == 0, [False]))
+    changes = np.flatnonzero(zero[1:] != zero[:-1])
+    starts, ends = changes[::2], changes[1::2]
+    lengths = ends - starts
+    # A run of length L needs floor(log2(L + 1)) digits, read exactly off the exponent of L + 1
+    digits = np.frexp((lengths + 1).astype(np.float64))[1].astype(np.int64) - 1
+    # Every zero run shrinks to its digits, every other value stays a single symbol
+    size = len(mtf) - int(lengths.sum()) + int(digits.sum())
+    keep = np.ones(len(mtf), dtype=np.int64)
+    keep[mtf == 0] = 0
+    keep[starts] = digits
+    positions = np.cumsum(keep) - keep
+    symbols = np.empty(size, dtype=np.uint16)
+    others = mtf != 0
+    symbols[positions[others]] = mtf[others].astype(np.uint16) + 1
+    remaining, offsets = lengths.copy(), positions[starts].copy()
+    while len(remaining):
+        active = remaining > 0
+        remaining, offsets = remaining[active], offsets[active]
+        if not len(remaining):
+            break
+        odd = (remaining & 1).astype(bool)
+        symbols[offsets] = np.where(odd, RUNA, RUNB)
+        remaining = np.where(odd, remaining - 1, remaining - 2) >> 1
+        offsets += 1
+    return symbols
+
+
+def _inverse_run_length(symbols: np.ndarray) -> Tuple[List[int], np.ndarray]:
+    """
+    :return: The move-to-front values, and how many times each is repeated
+    """
+    digit = symbols <= RUNB
+    # Each group of consecutive RUNA / RUNB digits is one run of zeros
+    group_start = digit & ~np.concatenate(([False], digit[:-1]))
+    group = np.cumsum(group_start) - 1
+    digit_positions = np.flatnonzero(digit)
+    # Place value of every digit within its group
+    places = digit_positions - np.flatnonzero(group_start)[group[digit_positions]]
+    run_lengths = np.zeros(int(group_start.sum()), dtype=np.int64)
+    np.add.at(run_lengths, group[digit_positions], (symbols[digit_positions].astype(np.int64) + 1) << places)
+
+    # One value per group of digits and per other symbol, in stream order
+    heads = group_start | ~digit
+    values = np.where(digit[heads], 0, symbols[heads].astype(np.int64) - 1)
+    lengths = np.ones(int(heads.sum()), dtype=np.int64)
+    lengths[digit[heads]] = run_lengths
+    return values.tolist(), lengths
+
+
+def _code_lengths(frequencies: np.ndarray) -> np.ndarray:
+    """
+    Huffman code lengths, flattening the frequencies until no code is longer than MAX_CODE_LENGTH
+    """
+    lengths = np.zeros(len(frequencies), dtype=np.uint8)
+    used = np.flatnonzero(frequencies)
+    if len(used) == 1:
+        lengths[used] = 1
+        return lengths
+    weights = frequencies.astype(np.int64)
+    while True:
+        # Every heap entry holds the symbols of its subtree, each merge deepening them by one
+        heap = [(int(weights[symbol]), int(symbol), [int(symbol)]) for symbol in used]
+        heapq.heapify(heap)
+        depth = np.zeros(len(frequencies), dtype=np.int64)
+        while len(heap) > 1:
+            weight_one, tie, one = heapq.heappop(heap)
+            weight_two, _, two = heapq.heappop(heap)
+            merged = one + two
+            depth[merged] += 1
+            heapq.heappush(heap, (weight_one + weight_two, tie, merged))
+        if depth.max(initial=0) <= MAX_CODE_LENGTH:
+            lengths[used] = depth[used]
+            return lengths
+        weights[used] = np.maximum(1, weights[used] >> 1)
+
+
+def _canonical_codes(lengths: np.ndarray) -> np.ndarray:
+    """
+    Canonical Huffman codes, assigned in order of length then symbol
+    """
+    codes = np.zeros(len(lengths), dtype=np.int64)
+    code, previous = 0, 0
+    for symbol in np.lexsort((np.arange(len(lengths)), lengths)).tolist():
+        if not lengths[symbol]:
+            continue
+        code <<= int(lengths[symbol]) - previous
+        previous = int(lengths[symbol])
+        codes[symbol] = code
+        code += 1
+    return codes
+
+
+def _huffman_encode(symbols: np.ndarray) -> Tuple[np.ndarray, bytes]:
+    """
+    :return: The code length of every symbol, and the packed codes of {symbols}
+    """
+    lengths = _code_lengths(np.bincount(symbols, minlength=SYMBOLS))
+    codes = _canonical_codes(lengths)
+    symbol_lengths = lengths[symbols].astype(np.int64)
+    # Spread every code over its bits, most significant first
+    owners = np.repeat(np.arange(len(symbols)), symbol_lengths)
+    starts = np.cumsum(symbol_lengths) - symbol_lengths
+    shifts = symbol_lengths[owners] - 1 - (np.arange(len(owners)) - starts[owners])
+    bits = (codes[symbols][owners] >> shifts) & 1
+    return lengths, np.packbits(bits.astype(np.uint8)).tobytes()
+
+
+def _huffman_decode(lengths: np.ndarray, payload: bytes, count: int) -> np.ndarray:
+    """
+    Decode {count} symbols, looking up the symbol starting at every bit position a slice of the payload at a time
+    """
+    longest = int(lengths.max(initial=0))
+    codes = _canonical_codes(lengths)
+    # Every table entry whose leading bits are a code decodes to that code's symbol
+    table_symbols = np.zeros(1 << longest, dtype=np.int64)
+    table_lengths = np.zeros(1 << longest, dtype=np.int64)
+    for symbol in np.flatnonzero(lengths).tolist():
+        spare = longest - int(lengths[symbol])
+        start = int(codes[symbol]) << spare
+        table_symbols[start:start + (1 << spare)] = symbol
+        table_lengths[start:start + (1 << spare)] = lengths[symbol]
+
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+    bits = np.concatenate((bits, np.zeros(longest, dtype=np.uint8)))
+    decoded = []
+    position = 0
+    for first in range(0, len(bits) - longest, _DECODE_BITS):
+        last = min(first + _DECODE_BITS, len(bits) - longest)
+        window = np.zeros(last - first, dtype=np.int64)
+        for offset in range(longest):
+            window = (window << 1) | bits[first + offset:last + offset]
+        slice_symbols = table_symbols[window].tolist()
+        slice_lengths = table_lengths[window].tolist()
+        while position < last and len(decoded) < count:
+            decoded.append(slice_symbols[position - first])
+            position += slice_lengths[position - first]
+    return np.array(decoded, dtype=np.uint16)
+
+
+def compress_block(block: bytes) -> bytes:
+    """
+    Compress one block into a frame
+    :param block: Up to 2 ** 32 - 1 bytes
+    :return: The frame, header included
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    bwt, primary = _bwt(data)
+    symbols = _run_length(_move_to_front(bwt))
+    lengths, payload = _huffman_encode(symbols)
+    return _FRAME.pack(len(data), primary, len(symbols), len(payload), zlib.crc32(block)) + lengths.tobytes() + \
+        payload
+
+
+def decompress_block(frame: bytes) -> bytes:
+    """
+    Decompress one frame written by compress_block
+    """
+    length, primary, count, payload_length, crc = _FRAME.unpack_from(frame)
+    lengths = np.frombuffer(frame, dtype=np.uint8, count=SYMBOLS, offset=_FRAME.size)
+    payload = frame[_FRAME.size + SYMBOLS:_FRAME.size + SYMBOLS + payload_length]
+    symbols = _huffman_decode(lengths, payload, count)
+    values, repeats = _inverse_run_length(symbols)
+    bwt = _inverse_move_to_front(values, repeats)
+    if len(bwt) != length:
+        raise ValueError(f'Corrupt frame: decoded {len(bwt)} bytes, expected {length}')
+    block = bytes(_inverse_bwt(bwt, primary))
+    if zlib.crc32(block) != crc:
+        raise ValueError('Corrupt frame: the CRC-32 of the decoded block does not match')
+    return block
+
+
+def _read_exactly(source: BinaryIO, size: int) -> bytes:
+    data = source.read(size)
+    if len(data) != size:
+        raise ValueError(f'Truncated stream: expected {size} bytes, got {len(data)}')
+    return data
+
+
+def read_frames(source: BinaryIO) -> Iterator[bytes]:
+    """
+    Read the frames of a compressed stream one at a time, stopping at the end frame
+    """
+    magic, version, _ = _HEADER.unpack(_read_exactly(source, _HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('Not a block-sorting compressed stream')
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Stream of format version {version}, expected version {FORMAT_VERSION}')
+    while True:
+        header = _read_exactly(source, _FRAME.size)
+        length, _, _, payload_length, _ = _FRAME.unpack(header)
+        if not length:
+            return
+        yield header + _read_exactly(source, SYMBOLS + payload_length)
+
+
+def _blocks(source: BinaryIO, block_size: int) -> Iterator[bytes]:
+    return iter(lambda: source.read(block_size), b'')
+
+
+def _parallel(function, items: Iterator, processes: int) -> Iterator:
+    """
+    Apply {function} to every item in a process pool, yielding results in order with a few items read ahead
+    """
+    if processes <= 1:
+        yield from map(function, items)
+        return
+    # Results which finished before earlier items, held until those are yielded
+    waiting = {}
+    next_index = 0
+    items = enumerate(items)
+    with ProcessPoolExecutor(processes) as pool:
+        pending = {pool.submit(function, item): index for index, item in islice(items, 2 * processes)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                waiting[pending.pop(future)] = future.result()
+                for index, item in islice(items, 1):
+                    pending[pool.submit(function, item)] = index
+            while next_index in waiting:
+                yield waiting.pop(next_index)
+                next_index += 1
+
+
+def compress(source: BinaryIO, destination: BinaryIO, block_size: int = BLOCK_SIZE, processes: int = 1,
+             verbose: bool = False) -> Tuple[int, int]:
+    """
+    Compress a binary stream into another
+    :param source: Stream to compress
+    :param destination: Stream to write the compressed frames to
+    :param block_size: Bytes per block, larger blocks compress better but use more memory per process
+    :param processes: Number of worker processes, 1 compresses in the current process
+    :param verbose: Should the function be verbose
+    :return: The number of bytes read and written
+    """
+    if not 0 < block_size < 1 << 32:
+        raise ValueError(f'Block size must be between 1 and {(1 << 32) - 1}, got {block_size}')
+    read, written = 0, _HEADER.size
+    destination.write(_HEADER.pack(MAGIC, FORMAT_VERSION, block_size))
+    for number, frame in enumerate(_parallel(compress_block, _blocks(source, block_size), processes)):
+        length = _FRAME.unpack_from(frame)[0]
+        read += length
+        written += len(frame)
+        destination.write(frame)
+        if verbose:
+            print(f'\tBlock {number}: {length} bytes compressed to {len(frame)}', file=sys.stderr)
+    destination.write(_FRAME.pack(0, 0, 0, 0, 0))
+    return read, written + _FRAME.size
+
+
+def decompress(source: BinaryIO, destination: BinaryIO, processes: int = 1, verbose: bool = False) -> int:
+    """
+    Decompress a stream written by compress into another
+    :return: The number of bytes written
+    """
+    written = 0
+    for number, block in enumerate(_parallel(decompress_block, read_frames(source), processes)):
+        destination.write(block)
+        written += len(block)
+        if verbose:
+            print(f'\tBlock {number}: {len(block)} bytes decompressed', file=sys.stderr)
+    return written
+
+
+def compress_bytes(data: bytes, block_size: int = BLOCK_SIZE, processes: int = 1) -> bytes:
+    frames = _parallel(compress_block, (data[start:start + block_size] for start in range(0, len(data), block_size)),
+                       processes)
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, block_size) + b''.join(frames) + _FRAME.pack(0, 0, 0, 0, 0)
+
+
+def decompress_bytes(data: bytes, processes: int = 1) -> bytes:
+    return b''.join(_parallel(decompress_block, read_frames(BytesIO(data)), processes))
+
+
+def main(input_path: str, output_path: str, decompressing: bool = False, block_size: int = BLOCK_SIZE,
+         processes: int = 1, verbose: bool = False):
+    with open(input_path, 'rb') as source, open(output_path, 'wb') as destination:
+        if decompressing:
+            written = decompress(source, destination, processes, verbose)
+            print(f'Decompressed {input_path} into {written} bytes')
+            return
+        read, written = compress(source, destination, block_size, processes, verbose)
+    print(f'Compressed {read} bytes into {written}, {round(100 * (1 - written / max(1, read)), 2)}% smaller '
+          f'at {round(8 * written / max(1, read), 3)} bits per byte')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compress or decompress a file with the BWT, move-to-front, '
+                                                 'run length and Huffman coding.')
+    parser.add_argument('-i', '--input', required=True, type=str,
+                        help='File to read.')
+    parser.add_argument('-o', '--output', required=True, type=str,
+                        help='File to write.')
+    parser.add_argument('-d', '--decompress', action='store_true', required=False,
+                        help='Decompress rather than compress.')
+    parser.add_argument('-b', '--block_size', required=False, type=int, default=BLOCK_SIZE,
+                        help='Bytes per block.')
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    args = parser.parse_args()
+
+    main(args.input, args.output, args.decompress, args.block_size, args.processes, args.verbose)
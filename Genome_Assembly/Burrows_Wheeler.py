@@ -1,16 +1,29 @@
 import argparse
 
+import numpy as np
+
+from Genome_Assembly.Suffix_Array import Text, _as_array, encode, index_dtype, suffix_array
+
+
+def _bwt_from_suffix_array(sentinel_string: str, array: np.ndarray) -> str:
+    """
+    Read the BWT off a suffix array, the last column of the sorted rotations holds the symbol before each suffix
+    """
+    symbols = _as_array(sentinel_string)
+    # The sentinel's own rotation wraps around to the sentinel, which is the final symbol
+    return symbols[array - 1].tobytes().decode('ascii' if symbols.dtype == np.uint8 else 'utf-32-le')
+
 
 def burrows_wheeler_transform(string: str, verbose: bool = False) -> str:
     sentinel_String = (string + '$') if not string.endswith('$') else string
-    # To emulate cycling back to the beginning
-    double_sentinel_string = sentinel_String * 2
-
-    # Generate the matrix of left-rotated strings
-    burrows_wheeler_matrix = [
-        list(double_sentinel_string[i:i + len(string) + 1]) for i in range(len(string) + 1)
-    ]
     if verbose:
+        # To emulate cycling back to the beginning
+        double_sentinel_string = sentinel_String * 2
+
+        # Generate the matrix of left-rotated strings, only ever built to be printed
+        burrows_wheeler_matrix = [
+            list(double_sentinel_string[i:i + len(sentinel_String)]) for i in range(len(sentinel_String))
+        ]
         print('############')
         print('# ENCODING #')
         print('############')
@@ -23,33 +36,30 @@ def burrows_wheeler_transform(string: str, verbose: bool = False) -> str:
             print(f'\t{" ".join(i)}')
         print()
 
-    # Take the last column
-    return ''.join(map(lambda x: x[-1], burrows_wheeler_matrix))
+    # Take the last column of the sorted matrix, whose rows are in suffix array order
+    return _bwt_from_suffix_array(sentinel_String, suffix_array(sentinel_String[:-1]))
 
 
 def burrows_wheeler_transform_suffix_array(string: str, verbose: bool = False) -> str:
     sentinel_string = (string + '$')
-    # Generate a stored suffix array but also store the original position before sorting
-    suffix_array = [(sentinel_string[i:], i) for i in range(len(sentinel_string))]
+    # The suffix array is built on the encoded string, so no suffix is ever copied
+    array = suffix_array(string)
     if verbose:
         print('############')
         print('# ENCODING #')
         print('############')
         print(f'The generated unsorted Burrows-Wheeler suffix array is:')
-        for value, index in suffix_array:
-            print(f'\t{index}:\t{" ".join(list(value))}')
+        for index in range(len(sentinel_string)):
+            print(f'\t{index}:\t{" ".join(list(sentinel_string[index:]))}')
         print()
 
         print(f'The generated sorted Burrows-Wheeler suffix array is:')
-        for value, index in sorted(suffix_array):
-            print(f'\t{index}:\t{" ".join(list(value))}')
+        for index in array:
+            print(f'\t{index}:\t{" ".join(list(sentinel_string[index:]))}')
         print()
 
-    suffix_array = sorted(suffix_array)
-
     # Generate the BWT of the string from the suffix array
-    return ''.join([sentinel_string[suffix_array[i][1] - 1] if suffix_array[i][1] > 0 else '$'
-                    for i in range(len(sentinel_string))])
+    return _bwt_from_suffix_array(sentinel_string, array)
 
 
 def inverse_burrows_wheeler_inefficient(string: str) -> str:
@@ -67,31 +77,108 @@ def inverse_burrows_wheeler_inefficient(string: str) -> str:
     return ''.join(inverse_matrix[0])[1:]
 
 
-def inverse_burrows_wheeler(string: str, verbose: bool = False) -> str:
-    last_row = [(i, string[:count].count(i)) for count, i in enumerate(string)]
-    first_row = sorted(last_row)
+# Alphabets up to this size find the rank of every occurrence with one cumulative sum per symbol
+_COUNTED_SYMBOLS = 16
+
+
+def lf_mapping(bwt: Text) -> np.ndarray:
+    """
+    The LF-mapping of a BWT, taking each row of the sorted rotations to the row of its rotation one to the right
+    Row i ends with bwt[i], and the rows starting with a symbol keep the order of its occurrences in the last column,
+    so LF[i] is the number of smaller symbols plus the number of earlier occurrences of bwt[i]
+    :param bwt: The BWT, holding a single '$' sentinel which sorts before every other symbol
+    :return: The LF-mapping, int32 or int64 depending on the length of {bwt}
+    """
+    symbols = _as_array(bwt)
+    sentinel_rows = np.flatnonzero(symbols == ord('$'))
+    if len(sentinel_rows) != 1:
+        raise ValueError(f'A BWT holds exactly one $, got {len(sentinel_rows)}')
+    codes, _ = encode(symbols)
+    codes[sentinel_rows[0]] = 0
+    return lf_from_codes(codes)
+
+
+def lf_from_codes(codes: np.ndarray) -> np.ndarray:
+    """
+    The LF-mapping of a BWT of dense integer codes, the sentinel being its only 0
+    """
+    n = len(codes)
+    lf = np.empty(n, dtype=index_dtype(n))
+    counts = np.bincount(codes)
+    present = np.flatnonzero(counts)
+    if len(present) <= _COUNTED_SYMBOLS:
+        # The first row starting with each symbol follows every row starting with a smaller one
+        first_rows = np.cumsum(counts) - counts
+        for symbol in present:
+            occurrences = codes == symbol
+            ranks = np.cumsum(occurrences, dtype=lf.dtype) - 1
+            lf[occurrences] = first_rows[symbol] + ranks[occurrences]
+    else:
+        # A stable sort lists each symbol's rows in order of occurrence, in linear time for byte sized codes
+        lf[np.argsort(codes, kind='stable')] = np.arange(n, dtype=lf.dtype)
+    return lf
+
+
+# Rows walked between writes of the decoded symbols, bounding the memory the walk holds besides the LF-mapping
+_WALK_BLOCK = 1 << 16
+
+
+def walk_lf_mapping(lf: np.ndarray, symbols: np.ndarray, decoded: np.ndarray):
+    """
+    Write out the string of a BWT, right to left, by following its LF-mapping from the sentinel's rotation
+    The rows are walked a block at a time and the block's symbols written at once, so no list as long as the BWT
+    is ever built
+    :param lf: The LF-mapping
+    :param symbols: The symbol of every row of the BWT
+    :param decoded: Writable array of len(lf) - 1 items to write the string into
+    """
+    # Row 0 starts with the sentinel, so it ends with the last symbol of the string. Each step moves one symbol left
+    rows = np.empty(min(_WALK_BLOCK, max(len(lf) - 1, 0)), dtype=lf.dtype)
+    row = 0
+    end = len(lf) - 1
+    while end > 0:
+        start = max(0, end - _WALK_BLOCK)
+        for offset in range(end - start - 1, -1, -1):
+            rows[offset] = row
+            row = lf.item(row)
+        decoded[start:end] = symbols[rows[:end - start]]
+        end = start
+
+
+def inverse_burrows_wheeler(string: Text, verbose: bool = False, out=None):
+    """
+    Recover a string from its BWT in linear time by following the LF-mapping from the sentinel's row
+    :param string: The BWT, holding a single '$' sentinel
+    :param verbose: Should the function be verbose
+    :param out: If given, a writable buffer of len(string) - 1 bytes to decode an ASCII BWT into, such as a
+                bytearray or a numpy uint8 array, which is returned instead of a string
+    :return: The string the BWT was built from, without its sentinel
+    """
+    symbols = _as_array(string)
+    n = len(symbols)
+    lf = lf_mapping(symbols)
     if verbose:
         print('############')
         print('# DECODING #')
         print('############')
-        print(f'Calculated first and last row of the Burrows-Wheeler Matrix')
-        for (f, ind_f), (s, ind_s) in zip(first_row, last_row):
-            print(f'\t{f}_{ind_f}\t{s}_{ind_s}')
-    current, value = '', 0
-    index = last_row.index(('$', 0))
-    reconstructed_string = ''
-    print('Inversing the transformed string')
-    while current != '$':
-        if verbose:
-            print(f'\tCurrent index is: {current if current != "" else "$"}_{value}', end='')
-        current, value = first_row[index]
-        if verbose:
-            print(f' -> {current if current != "" else "$"}_{value}')
-        reconstructed_string += current
-        index = last_row.index((current, value))
-
-    # Remove the $ That was added in during BWT
-    return reconstructed_string[:-1]
+        print(f'Calculated the LF-mapping of the Burrows-Wheeler Matrix')
+        for row, (symbol, target) in enumerate(zip(symbols.tolist(), lf.tolist())):
+            print(f'\t{row}: {chr(symbol)} -> {target}')
+        print('Inversing the transformed string')
+
+    if out is not None:
+        if symbols.dtype != np.uint8:
+            raise ValueError('Only ASCII BWTs can be decoded into a buffer')
+        decoded = np.frombuffer(memoryview(out).cast('B'), dtype=np.uint8)
+        if len(decoded) != n - 1:
+            raise ValueError(f'The buffer holds {len(decoded)} bytes, the decoded string has {n - 1}')
+    else:
+        decoded = np.empty(n - 1, dtype=symbols.dtype)
+
+    walk_lf_mapping(lf, symbols, decoded)
+    if out is not None:
+        return out
+    return decoded.tobytes().decode('ascii' if symbols.dtype == np.uint8 else 'utf-32-le')
 
 
 def RLE(string: str) -> str:
@@ -0,0 +1,249 @@
+import argparse
+import os
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from Genome_Assembly.Burrows_Wheeler import lf_from_codes
+from Genome_Assembly.Suffix_Array import suffix_array
+from Helpful_Structures import read_sequences
+
+# BWT of a collection of sequences too large to hold in memory, built a batch of sequences at a time
+# Every sequence ends with its own sentinel, the sentinels sorting before every symbol and in the order of their
+# sequences, and each sequence is treated as cyclic, so the symbol before its first suffix is its own sentinel.
+# Each batch small enough for the memory budget has its BWT built in memory from a suffix array, and is then merged
+# into the BWT of all earlier batches, which is kept on disk with Occ checkpoints every _OCC_RATE rows.
+# Merging needs, for every suffix of the batch, the number of earlier suffixes smaller than it. Starting from each
+# sentinel, which follows every earlier sentinel, the batch's sequences are walked right to left through its own
+# LF-mapping while the same symbols are backward searched in the BWT on disk. All sequences of a batch are walked
+# together, so every step is a handful of numpy operations. Both BWTs are then interleaved in one streaming pass.
+# Memory is bounded by the batch and the chunks streamed, whatever the size of the collection.
+
+# Peak bytes used per symbol of a batch, by suffix array construction and the arrays of the merge
+_BYTES_PER_SYMBOL = 64
+# Rows between Occ checkpoints of the BWT on disk
+_OCC_RATE = 32
+SENTINEL = ord('$')
+
+
+def _alphabet(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the collection once to find its symbols
+    :return: Lookup tables from byte to code and from code to byte, code 0 being the sentinel
+    """
+    seen = np.zeros(256, dtype=bool)
+    for _, sequence in read_sequences(path):
+        seen[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)] = True
+    if seen[SENTINEL]:
+        raise ValueError(f'Sequences can not hold the sentinel {chr(SENTINEL)}')
+    present = np.flatnonzero(seen)
+    encoder = np.zeros(256, dtype=np.uint8)
+    encoder[present] = np.arange(1, len(present) + 1)
+    return encoder, np.concatenate(([SENTINEL], present)).astype(np.uint8)
+
+
+def _batches(path: str, encoder: np.ndarray, batch_symbols: int) -> Iterator[List[np.ndarray]]:
+    """
+    Group the encoded sequences of a file into batches of at most {batch_symbols} symbols, sentinels included
+    A sequence longer than a batch forms a batch of its own
+    """
+    batch, size = [], 0
+    for _, sequence in read_sequences(path):
+        codes = encoder[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+        if batch and size + len(codes) + 1 > batch_symbols:
+            yield batch
+            batch, size = [], 0
+        batch.append(codes)
+        size += len(codes) + 1
+    if batch:
+        yield batch
+
+
+def collection_bwt(sequences: List[np.ndarray]) -> np.ndarray:
+    """
+    BWT of a collection held in memory
+    :param sequences: The sequences as codes from 1, code 0 being kept for the sentinels
+    :return: The BWT as codes, the first len(sequences) rows being the sentinels' suffixes in order
+    """
+    m = len(sequences)
+    lengths = np.array([len(sequence) + 1 for sequence in sequences], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    # Sentinels are coded by their sequence's index and symbols shifted above them, so every sentinel is distinct
+    text = np.empty(int(ends[-1]) if m else 0, dtype=np.int64)
+    for sequence, start, end in zip(sequences, starts.tolist(), ends.tolist()):
+        text[start:end - 1] = sequence.astype(np.int64) + m
+    text[ends - 1] = np.arange(m)
+
+    # The suffix array's own final sentinel is dropped, no comparison ever reaching it past a distinct sentinel
+    array = suffix_array(text)[1:]
+    previous = text[array - 1]
+    bwt = np.where(previous >= m, previous - m, 0).astype(np.uint8)
+    first_suffixes = np.zeros(len(text), dtype=bool)
+    first_suffixes[starts] = True
+    bwt[first_suffixes[array]] = 0
+    return bwt
+
+
+def _checkpoints(bwt: np.ndarray, symbols: int, path: str, chunk: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Write the Occ checkpoints of a BWT on disk, a chunk of rows at a time
+    :return: The checkpoints, memory mapped, and the first row of every code
+    """
+    blocks = len(bwt) // _OCC_RATE + 1
+    checkpoints = np.memmap(path, dtype=np.int64, mode='w+', shape=(blocks, symbols))
+    totals = np.zeros(symbols, dtype=np.int64)
+    chunk = max(_OCC_RATE, chunk // _OCC_RATE * _OCC_RATE)
+    for first in range(0, len(bwt), chunk):
+        rows = np.asarray(bwt[first:first + chunk])
+        block_count = -(-len(rows) // _OCC_RATE)
+        padded = np.full(block_count * _OCC_RATE, symbols, dtype=np.int64)
+        padded[:len(rows)] = rows
+        padded = padded.reshape(block_count, _OCC_RATE)
+        first_block = first // _OCC_RATE
+        # Row k of the chunk's counts holds the total before its block k, the row after its last block being
+        # written too so the final checkpoint is set, and overwritten with the same totals by the next chunk
+        counts = np.zeros((block_count + 1, symbols), dtype=np.int64)
+        for code in range(symbols):
+            np.cumsum(np.count_nonzero(padded == code, axis=1), out=counts[1:, code])
+        last_block = min(blocks, first_block + block_count + 1)
+        checkpoints[first_block:last_block] = totals + counts[:last_block - first_block]
+        totals += counts[-1]
+    checkpoints.flush()
+    first_rows = np.concatenate(([0], np.cumsum(totals)[:-1]))
+    return checkpoints.view(np.ndarray), first_rows
+
+
+def _ranks(bwt: np.ndarray, checkpoints: np.ndarray, codes: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """
+    Occ(codes[i], rows[i]) for every i, from the preceding checkpoint and a scan of the rows after it
+    """
+    blocks = rows // _OCC_RATE
+    counts = checkpoints[blocks, codes]
+    positions = blocks * _OCC_RATE
+    for _ in range(_OCC_RATE - 1):
+        inside = positions < rows
+        if not inside.any():
+            break
+        counts += inside & (bwt[np.minimum(positions, len(bwt) - 1)] == codes)
+        positions += 1
+    return counts
+
+
+def _insertion_points(bwt: np.ndarray, checkpoints: np.ndarray, first_rows: np.ndarray, sequences: int,
+                      batch: np.ndarray) -> np.ndarray:
+    """
+    For every row of a batch's BWT, the number of rows of the BWT on disk whose suffixes are smaller
+    :param bwt: The BWT on disk
+    :param checkpoints: Its Occ checkpoints
+    :param first_rows: Its first row of every code
+    :param sequences: Number of sequences it holds, whose sentinels all precede the batch's
+    :param batch: The batch's BWT
+    :return: The insertion point of every row of {batch}, never decreasing
+    """
+    m = int(np.count_nonzero(batch == 0))
+    lf = lf_from_codes(batch)
+    insert = np.empty(len(batch), dtype=np.int64)
+    # The sentinels' suffixes follow every earlier sentinel and precede every symbol
+    rows = np.arange(m)
+    points = np.full(m, sequences, dtype=np.int64)
+    insert[rows] = points
+    while len(rows):
+        codes = batch[rows].astype(np.int64)
+        # A sentinel ends the walk back through its sequence
+        alive = codes != 0
+        rows, points, codes = rows[alive], points[alive], codes[alive]
+        points = first_rows[codes] + _ranks(bwt, checkpoints, codes, points)
+        rows = lf[rows]
+        insert[rows] = points
+    return insert
+
+
+def _merge(bwt: np.ndarray, batch: np.ndarray, insert: np.ndarray, path: str, chunk: int) -> np.ndarray:
+    """
+    Interleave the BWT on disk with a batch's into a new file, a chunk of rows at a time
+    :return: The merged BWT, memory mapped
+    """
+    merged = np.memmap(path, dtype=np.uint8, mode='w+', shape=(len(bwt) + len(batch),))
+    # Row j of the batch lands after insert[j] rows on disk and j rows of the batch
+    merged[insert + np.arange(len(batch))] = batch
+    for first in range(0, len(bwt), chunk):
+        rows = np.arange(first, min(first + chunk, len(bwt)))
+        merged[rows + np.searchsorted(insert, rows, side='right')] = bwt[first:first + chunk]
+    merged.flush()
+    return merged.view(np.ndarray)
+
+
+def external_bwt(sequences_path: str, output_path: str, memory_budget: int = 1 << 30,
+                 temp_dir: Optional[str] = None, verbose: bool = False) -> int:
+    """
+    Build the BWT of every sequence of a file, holding only a bounded part of it in memory
+    :param sequences_path: FASTA file, or file with one sequence per line, read twice
+    :param output_path: File to write the BWT to, as bytes with a '$' for every sentinel
+    :param memory_budget: Bytes of memory to stay within, bounding the size of each batch
+    :param temp_dir: Directory to keep the partial BWTs in, the system's temporary directory if not given
+    :param verbose: Should the function be verbose
+    :return: The length of the BWT
+    """
+    batch_symbols = max(1, memory_budget // _BYTES_PER_SYMBOL)
+    chunk = max(_OCC_RATE, memory_budget // 16)
+    encoder, decoder = _alphabet(sequences_path)
+    symbols = len(decoder)
+    if verbose:
+        print(f'Building the BWT in batches of up to {batch_symbols} symbols over {symbols - 1} symbols')
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+        bwt = np.zeros(0, dtype=np.uint8)
+        checkpoints, first_rows = None, None
+        sequences = 0
+        for number, batch_sequences in enumerate(_batches(sequences_path, encoder, batch_symbols)):
+            batch = collection_bwt(batch_sequences)
+            path = os.path.join(directory, f'bwt.{number}')
+            if sequences:
+                insert = _insertion_points(bwt, checkpoints, first_rows, sequences, batch)
+                merged = _merge(bwt, batch, insert, path, chunk)
+                del insert
+            else:
+                merged = np.memmap(path, dtype=np.uint8, mode='w+', shape=(len(batch),))
+                merged[:] = batch
+                merged.flush()
+                merged = merged.view(np.ndarray)
+            # The previous generation is no longer needed once merged
+            for previous in (f'bwt.{number - 1}', f'occ.{number - 1}'):
+                if os.path.exists(os.path.join(directory, previous)):
+                    os.remove(os.path.join(directory, previous))
+            bwt = merged
+            sequences += len(batch_sequences)
+            checkpoints, first_rows = _checkpoints(bwt, symbols, os.path.join(directory, f'occ.{number}'), chunk)
+            if verbose:
+                print(f'\tMerged batch {number} of {len(batch_sequences)} sequences, the BWT now holds {len(bwt)} '
+                      f'symbols of {sequences} sequences')
+
+        with open(output_path, 'wb') as output:
+            for first in range(0, len(bwt), chunk):
+                output.write(decoder[bwt[first:first + chunk]].tobytes())
+        return len(bwt)
+
+
+def main(sequences_path: str, output_path: str, memory_budget: int = 1024, temp_dir: Optional[str] = None,
+         verbose: bool = False):
+    length = external_bwt(sequences_path, output_path, memory_budget << 20, temp_dir, verbose)
+    print(f'Wrote the BWT of {sequences_path}, {length} symbols, to {output_path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the BWT of a collection of sequences larger than memory.')
+    parser.add_argument('-f', '--file', required=True, type=str,
+                        help='FASTA file, or file with one sequence per line, of the collection.')
+    parser.add_argument('-o', '--output', required=True, type=str,
+                        help='File to write the BWT to.')
+    parser.add_argument('-m', '--memory', required=False, type=int, default=1024,
+                        help='Memory budget in MB.')
+    parser.add_argument('-t', '--temp_dir', required=False, type=str, default=None,
+                        help='Directory to keep the partial BWTs in.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    args = parser.parse_args()
+
+    main(args.file, args.output, args.memory, args.temp_dir, args.verbose)
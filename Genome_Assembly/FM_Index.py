@@ -0,0 +1,355 @@
+import argparse
+import json
+import struct
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from Genome_Assembly.Suffix_Array import Text, _as_array, index_dtype, suffix_array
+from Helpful_Structures import read_sequences
+
+# FM-index: the BWT of a text together with what is needed to search it without the text
+# Symbols are stored as dense codes, 0 being the sentinel, and C[c] counts the symbols smaller than c, which is the
+# first row of the sorted rotations starting with c. The number of c in the first i symbols of the BWT is read from
+# a checkpoint every {occ_rate} rows plus a short scan, so backward search costs O(|pattern|) rank queries.
+# The suffix array is only kept at text positions divisible by {sa_rate}, the others are found by walking the
+# LF-mapping back to one of those, which takes fewer than {sa_rate} steps.
+# A collection of records is indexed as one text, the records joined by a separator no pattern should contain.
+#
+# Saved indexes are a single file: the magic bytes, the format version and the length of a JSON header as uint32,
+# then the JSON header describing the rates, records and the dtype, shape and offset of every array, then the arrays
+# themselves, each starting on a 64 byte boundary. Loading memory maps the arrays read only, so opening an index costs
+# the same whatever its size and every process opening the same file shares one page cached copy.
+
+MAGIC = b'FMINDEX\x00'
+FORMAT_VERSION = 1
+# Byte placed between the records of a collection
+SEPARATOR = ord('\n')
+# Arrays written to, and memory mapped from, an index file
+_ARRAYS = ('bwt', 'alphabet', 'first_rows', 'checkpoints', 'sampled_rows', 'samples', 'starts')
+_ALIGNMENT = 64
+
+
+class FMIndex:
+    def __init__(self, bwt: np.ndarray, alphabet: np.ndarray, first_rows: np.ndarray, checkpoints: np.ndarray,
+                 sampled_rows: np.ndarray, samples: np.ndarray, occ_rate: int, sa_rate: int,
+                 names: Optional[List[str]] = None, starts: Optional[np.ndarray] = None):
+        """
+        FM-index over prebuilt arrays, which may be memory maps. Use FMIndex.build to index a text
+        :param bwt: The BWT as uint8 codes, holding a single 0 for the sentinel
+        :param alphabet: The byte of every code, the sentinel's being '$'
+        :param first_rows: C, the first row starting with every code, with a final entry holding the length of {bwt}
+        :param checkpoints: Row k holds the number of every code in bwt[:k * occ_rate]
+        :param sampled_rows: The rows, in increasing order, whose suffix starts at a sampled text position
+        :param samples: The text position of every row in {sampled_rows}
+        :param occ_rate: Rows between checkpoints
+        :param sa_rate: Distance between sampled text positions
+        :param names: Name of every record of the text, a single unnamed record if not given
+        :param starts: Text position of the start of every record
+        """
+        if len(first_rows) != len(alphabet) + 1 or checkpoints.shape[1] != len(alphabet):
+            raise ValueError(f'An alphabet of {len(alphabet)} symbols needs {len(alphabet) + 1} first rows and '
+                             f'{len(alphabet)} checkpoint columns')
+        if len(sampled_rows) != len(samples):
+            raise ValueError(f'{len(sampled_rows)} sampled rows need as many samples, got {len(samples)}')
+        self.bwt = bwt
+        self.alphabet = alphabet
+        self.first_rows = first_rows
+        self.checkpoints = checkpoints
+        self.sampled_rows = sampled_rows
+        self.samples = samples
+        self.occ_rate = occ_rate
+        self.sa_rate = sa_rate
+        self.names = [''] if names is None else list(names)
+        self.starts = np.zeros(1, dtype=np.int64) if starts is None else starts
+        if len(self.names) != len(self.starts):
+            raise ValueError(f'{len(self.names)} records need as many starts, got {len(self.starts)}')
+        # Lookup table from byte value to code, -1 for bytes absent from the text
+        self.encoder = np.full(256, -1, dtype=np.int16)
+        self.encoder[alphabet[1:]] = np.arange(1, len(alphabet), dtype=np.int16)
+
+    @classmethod
+    def build(cls, text: Text, occ_rate: int = 64, sa_rate: int = 32, verbose: bool = False,
+              names: Optional[List[str]] = None, starts: Optional[np.ndarray] = None) -> 'FMIndex':
+        """
+        Index an ASCII text
+        :param text: The text, as a string, bytes or an array of bytes
+        :param occ_rate: Rows between Occ checkpoints, larger rates save memory but slow every rank query
+        :param sa_rate: Distance between sampled suffix array entries, larger rates save memory but slow locate
+        :param verbose: Should the function be verbose
+        :param names: Name of every record of the text, a single unnamed record if not given
+        :param starts: Text position of the start of every record
+        :return: The FM-index of {text}
+        """
+        if occ_rate < 1 or sa_rate < 1:
+            raise ValueError(f'Sampling rates must be positive, got {occ_rate} and {sa_rate}')
+        symbols = _as_array(text)
+        if symbols.dtype != np.uint8:
+            raise ValueError('Only ASCII texts can be indexed')
+        array = suffix_array(symbols, verbose)
+        n = len(array)
+        if verbose:
+            print(f'Built the suffix array of {n - 1} symbols')
+
+        present = np.flatnonzero(np.bincount(symbols, minlength=256))
+        if len(present) == 256:
+            raise ValueError('Texts using all 256 byte values leave no code for the sentinel')
+        alphabet = np.concatenate(([ord('$')], present)).astype(np.uint8)
+        table = np.zeros(256, dtype=np.uint8)
+        table[present] = np.arange(1, len(present) + 1)
+        codes = np.zeros(n, dtype=np.uint8)
+        codes[:n - 1] = table[symbols]
+        # The sentinel's own rotation wraps around to the sentinel, which is the final symbol
+        bwt = codes[array - 1]
+        del codes
+
+        counts = np.bincount(bwt, minlength=len(alphabet))
+        first_rows = np.zeros(len(alphabet) + 1, dtype=np.int64)
+        first_rows[1:] = np.cumsum(counts)
+
+        # Count every code per block of rows, the checkpoints being the running totals before each block
+        blocks = n // occ_rate + 1
+        padded = np.zeros(blocks * occ_rate, dtype=np.int16)
+        padded[:n] = bwt.astype(np.int16) + 1
+        padded = padded.reshape(blocks, occ_rate)
+        checkpoints = np.zeros((blocks, len(alphabet)), dtype=index_dtype(n))
+        for code in range(len(alphabet)):
+            np.cumsum(np.count_nonzero(padded[:-1] == code + 1, axis=1), out=checkpoints[1:, code])
+        del padded
+
+        sampled_rows = np.flatnonzero(array % sa_rate == 0).astype(index_dtype(n))
+        samples = array[sampled_rows]
+        if verbose:
+            print(f'\tIndexed {len(alphabet) - 1} symbols with {blocks} checkpoints and {len(samples)} '
+                  f'suffix array samples')
+        return cls(bwt, alphabet, first_rows, checkpoints, sampled_rows, samples, occ_rate, sa_rate, names, starts)
+
+    @classmethod
+    def build_records(cls, records: Iterable[Tuple[str, str]], occ_rate: int = 64, sa_rate: int = 32,
+                      verbose: bool = False) -> 'FMIndex':
+        """
+        Index a collection of records as one text, joined by the separator
+        :param records: Pairs (name, sequence), as read by read_sequences
+        :return: The FM-index of the collection
+        """
+        names, sequences = [], []
+        for name, sequence in records:
+            names.append(name)
+            sequences.append(sequence.encode('ascii'))
+        if any(SEPARATOR in sequence for sequence in sequences):
+            raise ValueError(f'Records can not hold the separator {chr(SEPARATOR)!r}')
+        lengths = np.array([len(sequence) + 1 for sequence in sequences], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        return cls.build(bytes([SEPARATOR]).join(sequences), occ_rate, sa_rate, verbose, names or None,
+                         starts if names else None)
+
+    def save(self, path: str):
+        """
+        Write the index to a single file, to be memory mapped by FMIndex.load
+        :param path: Path of the file
+        """
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in _ARRAYS}
+        # Little endian throughout, so an index can be moved between machines
+        arrays = {name: array.astype(array.dtype.newbyteorder('<'), copy=False) for name, array in arrays.items()}
+        header = {'occ_rate': self.occ_rate, 'sa_rate': self.sa_rate, 'names': self.names, 'arrays': {}}
+        # Offsets are laid out relative to the first array, then shifted past the header once its length is known
+        offset = 0
+        for name, array in arrays.items():
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        prefix_length = len(MAGIC) + 8
+        encoded = json.dumps(header).encode()
+        # Widening the header can widen the offsets written into it, so repeat until the length settles
+        while True:
+            data_start = -(-(prefix_length + len(encoded)) // _ALIGNMENT) * _ALIGNMENT
+            for name in arrays:
+                header['arrays'][name]['start'] = data_start + header['arrays'][name]['offset']
+            widened = json.dumps(header).encode()
+            settled = len(widened) == len(encoded)
+            encoded = widened
+            if settled:
+                break
+        with open(path, 'wb') as file:
+            file.write(MAGIC + struct.pack('<II', FORMAT_VERSION, len(encoded)) + encoded)
+            for name, array in arrays.items():
+                file.seek(header['arrays'][name]['start'])
+                file.write(array.tobytes())
+            file.truncate(data_start + offset)
+
+    @classmethod
+    def load(cls, path: str) -> 'FMIndex':
+        """
+        Open an index written by save, memory mapping its arrays read only rather than reading them
+        :param path: Path of the file
+        :return: The FM-index
+        """
+        with open(path, 'rb') as file:
+            prefix = file.read(len(MAGIC) + 8)
+            if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{path} is not an FM-index')
+            version, header_length = struct.unpack('<II', prefix[len(MAGIC):])
+            if version != FORMAT_VERSION:
+                raise ValueError(f'{path} holds an FM-index of format version {version}, '
+                                 f'expected version {FORMAT_VERSION}')
+            header = json.loads(file.read(header_length))
+        arrays = {}
+        for name in _ARRAYS:
+            layout = header['arrays'][name]
+            shape = tuple(layout['shape'])
+            # A memory map can not be empty, so an empty array is held in memory instead. Maps are viewed as plain
+            # arrays, sharing their memory, as slicing a np.memmap costs several times more than slicing an array
+            arrays[name] = np.memmap(path, dtype=np.dtype(layout['dtype']), mode='r', offset=layout['start'],
+                                     shape=shape).view(np.ndarray) if np.prod(shape) else \
+                np.zeros(shape, dtype=layout['dtype'])
+        return cls(arrays['bwt'], arrays['alphabet'], arrays['first_rows'], arrays['checkpoints'],
+                   arrays['sampled_rows'], arrays['samples'], header['occ_rate'], header['sa_rate'],
+                   header['names'], arrays['starts'])
+
+    def __len__(self) -> int:
+        """
+        Length of the indexed text, without the sentinel
+        """
+        return len(self.bwt) - 1
+
+    def rank(self, code: int, row: int) -> int:
+        """
+        Occ(code, row), the number of {code} in the first {row} symbols of the BWT
+        """
+        block = row // self.occ_rate
+        start = block * self.occ_rate
+        return int(self.checkpoints[block, code]) + int(np.count_nonzero(self.bwt[start:row] == code))
+
+    def ranks(self, row: int) -> np.ndarray:
+        """
+        Occ of every code at once in the first {row} symbols of the BWT
+        """
+        block = row // self.occ_rate
+        start = block * self.occ_rate
+        return self.checkpoints[block].astype(np.int64) + np.bincount(self.bwt[start:row],
+                                                                      minlength=len(self.alphabet))
+
+    def lf(self, row: int) -> int:
+        """
+        The row of the rotation one symbol to the right of row {row}, starting with its last symbol
+        """
+        code = int(self.bwt[row])
+        return int(self.first_rows[code]) + self.rank(code, row)
+
+    def encode(self, pattern: Text) -> np.ndarray:
+        """
+        Codes of a pattern, -1 for symbols absent from the text
+        """
+        symbols = _as_array(pattern)
+        if symbols.dtype != np.uint8:
+            return np.full(len(symbols), -1, dtype=np.int16)
+        return self.encoder[symbols]
+
+    def backward_search(self, pattern: Text) -> Tuple[int, int]:
+        """
+        Find the rows of the sorted rotations starting with a pattern, extending it one symbol to the left at a time
+        :param pattern: The pattern to search for
+        :return: The range [top, bottom) of matching rows, empty if {pattern} does not occur
+        """
+        top, bottom = 0, len(self.bwt)
+        for code in reversed(self.encode(pattern).tolist()):
+            if code < 0:
+                return 0, 0
+            top = int(self.first_rows[code]) + self.rank(code, top)
+            bottom = int(self.first_rows[code]) + self.rank(code, bottom)
+            if top >= bottom:
+                return 0, 0
+        return top, bottom
+
+    def count(self, pattern: Text) -> int:
+        """
+        Number of occurrences of a pattern in the text
+        """
+        top, bottom = self.backward_search(pattern)
+        return bottom - top
+
+    def position(self, row: int) -> int:
+        """
+        The text position of the suffix of a row, walking the LF-mapping back to a sampled position
+        """
+        steps = 0
+        while True:
+            sample = int(np.searchsorted(self.sampled_rows, row))
+            if sample < len(self.sampled_rows) and self.sampled_rows[sample] == row:
+                return int(self.samples[sample]) + steps
+            row = self.lf(row)
+            steps += 1
+
+    def record(self, position: int) -> Tuple[int, int]:
+        """
+        The record holding a text position
+        :return: The index of the record and the position within it
+        """
+        record = int(np.searchsorted(self.starts, position, side='right')) - 1
+        return record, position - int(self.starts[record])
+
+    def locate(self, pattern: Text) -> List[int]:
+        """
+        Every position of a pattern in the text
+        :return: The start of every occurrence of {pattern} in increasing order
+        """
+        top, bottom = self.backward_search(pattern)
+        return sorted(self.position(row) for row in range(top, bottom))
+
+
+def build_index(sequences_path: str, index_path: str, occ_rate: int = 64, sa_rate: int = 32,
+                verbose: bool = False) -> FMIndex:
+    """
+    Index every record of a file and save the index
+    :param sequences_path: FASTA file, or file with one sequence per line
+    :param index_path: Path to write the index to
+    :return: The FM-index
+    """
+    index = FMIndex.build_records(read_sequences(sequences_path), occ_rate, sa_rate, verbose)
+    index.save(index_path)
+    if verbose:
+        print(f'Saved the index of {len(index.names)} records to {index_path}')
+    return index
+
+
+def main(patterns: List[str], string: Optional[str] = None, sequences_path: Optional[str] = None,
+         index_path: Optional[str] = None, output: Optional[str] = None, verbose: bool = False, occ_rate: int = 64,
+         sa_rate: int = 32):
+    if string is not None:
+        index = FMIndex.build(string, occ_rate, sa_rate, verbose)
+        if output is not None:
+            index.save(output)
+    elif sequences_path is not None:
+        index = build_index(sequences_path, output, occ_rate, sa_rate, verbose) if output is not None else \
+            FMIndex.build_records(read_sequences(sequences_path), occ_rate, sa_rate, verbose)
+    else:
+        index = FMIndex.load(index_path)
+    for pattern in patterns:
+        positions = []
+        for position in index.locate(pattern):
+            record, offset = index.record(position)
+            positions.append(f'{index.names[record]}:{offset}' if index.names[record] else str(offset))
+        print(f'{pattern} occurs {len(positions)} times{" at " + ", ".join(positions) if positions else ""}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search strings for patterns through their FM-index.")
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument('-s', '--string', type=str,
+                         help='Word to index.')
+    sources.add_argument('-f', '--file', type=str,
+                         help='FASTA file, or file with one string per line, to index.')
+    sources.add_argument('-i', '--index', type=str,
+                         help='Index file to load.')
+    parser.add_argument('-o', '--output', type=str, required=False, default=None,
+                        help='Save the built index to this file.')
+    parser.add_argument('-p', '--patterns', type=str, nargs='*', required=False, default=[],
+                        help='Patterns to search for.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-or', '--occ_rate', type=int, required=False, default=64,
+                        help='Rows between Occ checkpoints.')
+    parser.add_argument('-sa', '--sa_rate', type=int, required=False, default=32,
+                        help='Distance between sampled suffix array entries.')
+    args = parser.parse_args()
+
+    main(args.patterns, args.string, args.file, args.index, args.output, args.verbose, args.occ_rate, args.sa_rate)
@@ -0,0 +1,248 @@
+import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from Genome_Assembly.FM_Index import SEPARATOR, FMIndex
+from Helpful_Structures import read_reads
+
+# Mapping of short reads against a saved FM-index, reporting every hit with at most k mismatches
+# Reads are matched right to left by backward search, branching into every other symbol at each position while
+# mismatches remain. The branching is bounded by a lower bound D[i] on the mismatches needed by the first i symbols
+# of the read: the read is cut right to left into the shortest pieces which do not occur in the reference, each of
+# which needs a mismatch, and D[i] counts the pieces lying within the first i symbols. A branch with fewer mismatches
+# left than D[i] can not lead to a hit and is dropped.
+# Worker processes memory map the same index file, so the index is held in memory once however many workers run.
+
+STRANDS = ('+', '-')
+_COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+# Index and settings of the current worker process, set once by _initialise_worker
+_worker: Dict[str, object] = {}
+
+
+def reverse_complement(sequence: str) -> str:
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def lower_bounds(index: FMIndex, codes: List[int]) -> List[int]:
+    """
+    The D-array of a read, D[i] being a lower bound on the mismatches needed to match the first i symbols
+    :param index: The FM-index of the reference
+    :param codes: The codes of the read, -1 for symbols absent from the reference
+    :return: D[0] to D[len(codes)]
+    """
+    # Ends of the pieces which do not occur in the reference, found right to left
+    ends = []
+    top, bottom = 0, len(index.bwt)
+    end = len(codes)
+    for position in range(len(codes) - 1, -1, -1):
+        code = codes[position]
+        if code >= 0:
+            top = int(index.first_rows[code]) + index.rank(code, top)
+            bottom = int(index.first_rows[code]) + index.rank(code, bottom)
+        if code < 0 or top >= bottom:
+            ends.append(end)
+            top, bottom = 0, len(index.bwt)
+            end = position
+    bounds = [0] * (len(codes) + 1)
+    ends.reverse()
+    piece = 0
+    for i in range(len(codes) + 1):
+        while piece < len(ends) and ends[piece] <= i:
+            piece += 1
+        bounds[i] = piece
+    return bounds
+
+
+def search(index: FMIndex, codes: List[int], max_mismatches: int) -> List[Tuple[int, int, int]]:
+    """
+    Bounded backtracking backward search for every string within {max_mismatches} substitutions of a read
+    :param index: The FM-index of the reference
+    :param codes: The codes of the read, -1 for symbols absent from the reference
+    :param max_mismatches: Most substitutions allowed
+    :return: Triples (top, bottom, mismatches) of the rows matched by every string found, fewest mismatches first
+    """
+    bounds = lower_bounds(index, codes)
+    # Symbols a mismatch may substitute, never the sentinel or the separator between records
+    substitutes = [code for code in range(1, len(index.alphabet)) if index.alphabet[code] != SEPARATOR]
+    first_rows = index.first_rows[:-1]
+    hits = []
+    stack = [(len(codes), 0, len(index.bwt), 0)]
+    while stack:
+        remaining, top, bottom, mismatches = stack.pop()
+        if max_mismatches - mismatches < bounds[remaining]:
+            continue
+        if remaining == 0:
+            hits.append((top, bottom, mismatches))
+            continue
+        expected = codes[remaining - 1]
+        if mismatches == max_mismatches:
+            # Only the read's own symbol can follow, which needs two rank queries rather than a row of them
+            if expected < 0:
+                continue
+            next_top = int(first_rows[expected]) + index.rank(expected, top)
+            next_bottom = int(first_rows[expected]) + index.rank(expected, bottom)
+            if next_top < next_bottom:
+                stack.append((remaining - 1, next_top, next_bottom, mismatches))
+            continue
+        tops = (first_rows + index.ranks(top)).tolist()
+        bottoms = (first_rows + index.ranks(bottom)).tolist()
+        # The matching symbol is pushed last, so exact extensions are explored first
+        for code in substitutes:
+            if code != expected and tops[code] < bottoms[code]:
+                stack.append((remaining - 1, tops[code], bottoms[code], mismatches + 1))
+        if expected >= 0 and tops[expected] < bottoms[expected]:
+            stack.append((remaining - 1, tops[expected], bottoms[expected], mismatches))
+    hits.sort(key=lambda hit: hit[2])
+    return hits
+
+
+def map_read(index: FMIndex, read: str, max_mismatches: int = 2, max_hits: int = 100,
+             both_strands: bool = True) -> List[Tuple[int, int, str, int]]:
+    """
+    Map a single read against the reference
+    :param index: The FM-index of the reference
+    :param read: The read
+    :param max_mismatches: Most substitutions allowed
+    :param max_hits: Most hits reported, the ones with fewest mismatches being kept
+    :param both_strands: Whether to also map the reverse complement of the read
+    :return: Hits (record, position, strand, mismatches), fewest mismatches first
+    """
+    found = []
+    for strand in STRANDS[:2 if both_strands else 1]:
+        sequence = read if strand == '+' else reverse_complement(read)
+        codes = index.encode(sequence).tolist()
+        found.extend((mismatches, strand, top, bottom) for top, bottom, mismatches in
+                     search(index, codes, max_mismatches))
+    found.sort(key=lambda hit: hit[0])
+
+    hits = []
+    for mismatches, strand, top, bottom in found:
+        for row in range(top, min(bottom, top + max_hits - len(hits))):
+            record, position = index.record(index.position(row))
+            hits.append((record, position, strand, mismatches))
+        if len(hits) >= max_hits:
+            break
+    return hits
+
+
+def _initialise_worker(index_path: str, settings: dict):
+    _worker['index'] = FMIndex.load(index_path)
+    _worker['settings'] = settings
+
+
+def _map_chunk(chunk: List[Tuple[int, str]]):
+    index, settings = _worker['index'], _worker['settings']
+    return [(number, map_read(index, read, **settings)) for number, read in chunk]
+
+
+def map_many(index_path: str, reads: Iterable[str], verbose: bool = False, max_mismatches: int = 2,
+             max_hits: int = 100, both_strands: bool = True, processes: int = 1, chunk_size: int = 256,
+             ordered: bool = True) -> Iterator:
+    """
+    Map reads against a saved index, streaming results back as they are produced
+    :param index_path: Path of an index saved by FMIndex.save
+    :param reads: The reads, consumed lazily so files of any size can be mapped
+    :param verbose: Should the function be verbose
+    :param max_mismatches: Most substitutions allowed
+    :param max_hits: Most hits reported per read
+    :param both_strands: Whether to also map the reverse complement of every read
+    :param processes: Number of worker processes, 1 maps in the current process
+    :param chunk_size: Reads sent to a worker at once
+    :param ordered: Whether to yield results in the order of {reads}, rather than as soon as they complete
+    :return: Pairs (number, hits) where hits are the hits of the read numbered {number}, as returned by map_read
+    """
+    if max_mismatches < 0:
+        raise ValueError(f'The number of mismatches can not be negative, got {max_mismatches}')
+    settings = {'max_mismatches': max_mismatches, 'max_hits': max_hits, 'both_strands': both_strands}
+    if verbose:
+        print(f'Mapping with at most {max_mismatches} mismatches using {processes} processes')
+    return _stream(index_path, enumerate(reads), settings, verbose, processes, chunk_size, ordered)
+
+
+def _stream(index_path: str, reads: Iterator[Tuple[int, str]], settings: dict, verbose: bool, processes: int,
+            chunk_size: int, ordered: bool) -> Iterator:
+    """
+    Generator behind map_many, kept separate so invalid arguments are reported as soon as it is called
+    """
+    if processes <= 1:
+        _initialise_worker(index_path, settings)
+        for chunk in iter(lambda: list(islice(reads, chunk_size)), []):
+            yield from _map_chunk(chunk)
+        return
+
+    # Results which finished before earlier reads, held until those are yielded
+    waiting = {}
+    next_number = 0
+    chunks = iter(lambda: list(islice(reads, chunk_size)), [])
+    with ProcessPoolExecutor(processes, initializer=_initialise_worker, initargs=(index_path, settings)) as pool:
+        # Only a few chunks per worker are read ahead, so the reads are never all held in memory
+        pending = {pool.submit(_map_chunk, chunk) for chunk in islice(chunks, 2 * processes)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results = future.result()
+                if verbose:
+                    print(f'\tChunk of {len(results)} reads finished')
+                for chunk in islice(chunks, 1):
+                    pending.add(pool.submit(_map_chunk, chunk))
+                if not ordered:
+                    yield from results
+                    continue
+                waiting.update(results)
+                while next_number in waiting:
+                    yield next_number, waiting.pop(next_number)
+                    next_number += 1
+
+
+def main(index_path: str, reads_path: str, verbose: bool = False, max_mismatches: int = 2, max_hits: int = 100,
+         both_strands: bool = True, processes: int = 1, chunk_size: int = 256, ordered: bool = True):
+    index = FMIndex.load(index_path)
+    names = []
+
+    def reads():
+        for name, read in read_reads(reads_path):
+            names.append(name)
+            yield read
+
+    start = time.perf_counter()
+    mapped = 0
+    print('read\trecord\tposition\tstrand\tmismatches')
+    for number, hits in map_many(index_path, reads(), verbose, max_mismatches, max_hits, both_strands, processes,
+                                 chunk_size, ordered):
+        mapped += bool(hits)
+        for record, position, strand, mismatches in hits:
+            print(f'{names[number]}\t{index.names[record]}\t{position}\t{strand}\t{mismatches}')
+        if not hits:
+            print(f'{names[number]}\t*\t*\t*\t*')
+    elapsed = time.perf_counter() - start
+    print(f'# Mapped {mapped} of {len(names)} reads in {elapsed:.2f}s, '
+          f'{len(names) / max(elapsed, 1e-9):.0f} reads per second')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map short reads against a saved FM-index.')
+    parser.add_argument('-i', '--index', required=True, type=str,
+                        help='Index file built by Genome_Assembly.FM_Index.')
+    parser.add_argument('-r', '--reads', required=True, type=str,
+                        help='FASTQ or FASTA file, or file with one read per line, of the reads.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-k', '--mismatches', required=False, type=int, default=2,
+                        help='Most mismatches allowed in a hit.')
+    parser.add_argument('-mh', '--max_hits', required=False, type=int, default=100,
+                        help='Most hits reported per read.')
+    parser.add_argument('-fs', '--forward_strand', action='store_true', required=False,
+                        help='Only map the reads as given, not their reverse complements.')
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-c', '--chunk_size', required=False, type=int, default=256,
+                        help='Reads sent to a worker at once.')
+    parser.add_argument('-u', '--unordered', action='store_true', required=False,
+                        help='Print results as soon as they complete rather than in file order.')
+    args = parser.parse_args()
+
+    main(args.index, args.reads, args.verbose, args.mismatches, args.max_hits, not args.forward_strand,
+         args.processes, args.chunk_size, not args.unordered)
@@ -0,0 +1,124 @@
+import argparse
+from typing import Union
+
+import numpy as np
+
+# Suffix array construction by prefix doubling (Manber-Myers) on numpy arrays
+# The text is encoded into dense integer codes with a unique smallest sentinel at its end, and every suffix is
+# first ranked by as many of its leading codes as fit in an int64. Each round then sorts the suffixes by the pair
+# (rank of their first h codes, rank of the h codes after those), doubling the length ranked until all ranks differ.
+# Memory is a handful of arrays of n integers, so a 100 Mbp genome fits in a few GB.
+
+Text = Union[str, bytes, np.ndarray]
+
+
+def index_dtype(length: int) -> np.dtype:
+    """
+    The smallest integer type able to index {length} positions
+    """
+    return np.dtype(np.int32) if length < np.iinfo(np.int32).max else np.dtype(np.int64)
+
+
+def _as_array(text: Text) -> np.ndarray:
+    """
+    View a text as an array of integer symbols, bytes for ASCII strings and code points otherwise
+    """
+    if isinstance(text, str):
+        try:
+            return np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+        except UnicodeEncodeError:
+            return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        return np.frombuffer(text, dtype=np.uint8)
+    return np.asarray(text)
+
+
+def encode(text: Text):
+    """
+    Replace every symbol of a text by its rank among the distinct symbols, starting at 1
+    :return: The codes, and the number of distinct symbols
+    """
+    symbols = _as_array(text)
+    if symbols.dtype == np.uint8:
+        # A lookup table is much faster than np.unique for bytes
+        present = np.flatnonzero(np.bincount(symbols, minlength=256))
+        # Codes start at 1, so all 256 byte values need a wider type
+        table = np.zeros(256, dtype=np.uint8 if len(present) < 256 else np.uint16)
+        table[present] = np.arange(1, len(present) + 1)
+        return table[symbols], len(present)
+    distinct, codes = np.unique(symbols, return_inverse=True)
+    return (codes.reshape(-1) + 1).astype(np.int64), len(distinct)
+
+
+def _dense_ranks(keys: np.ndarray, dtype: np.dtype):
+    """
+    Sort positions by their keys and rank them, equal keys sharing a rank
+    :return: The positions in sorted order, their ranks, and the number of distinct keys
+    """
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    ranks = np.empty(len(keys), dtype=dtype)
+    if len(keys):
+        ranks[order[0]] = 0
+        ranks[order[1:]] = np.cumsum(sorted_keys[1:] != sorted_keys[:-1], dtype=dtype)
+    distinct = int(ranks[order[-1]]) + 1 if len(keys) else 0
+    return order.astype(dtype, copy=False), ranks, distinct
+
+
+def suffix_array(text: Text, verbose: bool = False) -> np.ndarray:
+    """
+    Build the suffix array of a text followed by a sentinel smaller than every symbol of the text
+    :param text: The text, as a string, bytes or an array of integer symbols
+    :param verbose: Should the function be verbose
+    :return: The start of every suffix of {text} + sentinel in sorted order, the sentinel's suffix first.
+             Indices are int32, or int64 once the text is too long for them
+    """
+    codes, alphabet_size = encode(text)
+    n = len(codes) + 1
+    dtype = index_dtype(n)
+
+    # Leading codes packed into one int64 key per suffix, codes past the sentinel are 0 like the sentinel
+    bits = max(1, int(alphabet_size).bit_length())
+    width = max(1, min(n, 63 // bits))
+    padded = np.zeros(n + width, dtype=np.int64)
+    padded[:n - 1] = codes
+    keys = np.zeros(n, dtype=np.int64)
+    for offset in range(width):
+        keys <<= bits
+        keys |= padded[offset:offset + n]
+    del padded
+    order, ranks, distinct = _dense_ranks(keys, dtype)
+    if verbose:
+        print(f'Ranked the suffixes of {n - 1} symbols by their first {width} symbols: {distinct} distinct ranks')
+
+    h = width
+    while distinct < n:
+        # The rank of the next h symbols, 0 once the suffix has ended
+        following = np.zeros(n, dtype=np.int64)
+        following[:max(0, n - h)] = ranks[h:].astype(np.int64) + 1
+        keys = ranks.astype(np.int64) * (n + 1) + following
+        del following
+        order, ranks, distinct = _dense_ranks(keys, dtype)
+        h *= 2
+        if verbose:
+            print(f'\tRanked the suffixes by their first {h} symbols: {distinct} distinct ranks')
+    return order
+
+
+def main(string: str, verbose: bool = False):
+    array = suffix_array(string, verbose)
+    sentinel_string = string + '$'
+    print(f'The suffix array of {string} is:')
+    for index in array:
+        print(f'\t{index}:\t{sentinel_string[index:]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the suffix array of a given string.")
+    parser.add_argument('-s', '--string', type=str, required=True,
+                        help='Word to build the suffix array of.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    args = parser.parse_args()
+
+    main(args.string, args.verbose)
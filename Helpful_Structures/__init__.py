@@ -1 +1,5 @@
-from .binary_tree import BinaryTree
\ No newline at end of file
+from .binary_tree import BinaryTree
+from .encoded_sequence import Alphabet, EncodedSequence, DNA, RNA, PROTEIN, codes_of
+from .substitution_matrix import SubstitutionMatrix, BLOSUM62, DNA_MATCH_MISMATCH, MATRICES
+from .fasta import read_sequences, read_reads
+from .condensed_matrix import CondensedDistanceMatrix
@@ -0,0 +1,48 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class CondensedDistanceMatrix:
+    def __init__(self, names: List[str], distances: Optional[np.ndarray] = None):
+        """
+        Symmetric distance matrix with a zero diagonal, holding only the pairs i < j in row major order
+        :param names: Name of every row
+        :param distances: The condensed pairs, zeros if not given, may be a memory map
+        """
+        self.names = list(names)
+        size = len(self.names) * (len(self.names) - 1) // 2
+        if distances is None:
+            distances = np.zeros(size, dtype=np.float32)
+        if len(distances) != size:
+            raise ValueError(f'{len(self.names)} names need {size} distances, got {len(distances)}')
+        self.distances = distances
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def index(self, i: int, j: int) -> int:
+        """
+        Position of the pair (i, j), i != j, in the condensed array
+        """
+        if i > j:
+            i, j = j, i
+        return len(self.names) * i - i * (i + 1) // 2 + j - i - 1
+
+    def __getitem__(self, pair: Tuple[int, int]) -> float:
+        i, j = pair
+        return 0.0 if i == j else float(self.distances[self.index(i, j)])
+
+    def __setitem__(self, pair: Tuple[int, int], distance: float):
+        self.distances[self.index(*pair)] = distance
+
+    def square(self) -> np.ndarray:
+        """
+        Expand into a full float64 matrix
+        """
+        n = len(self.names)
+        matrix = np.zeros((n, n), dtype=np.float64)
+        rows, columns = np.triu_indices(n, 1)
+        matrix[rows, columns] = self.distances
+        matrix[columns, rows] = self.distances
+        return matrix
@@ -0,0 +1,132 @@
+from typing import Iterator, Union
+
+import numpy as np
+
+# Symbol used by encoders for characters outside of an alphabet
+_UNKNOWN = 255
+
+
+class Alphabet:
+    def __init__(self, symbols: str, case_sensitive: bool = False):
+        """
+        An ordered set of ASCII symbols, each encoded as its index
+        :param symbols: The symbols of the alphabet, in code order
+        :param case_sensitive: Whether lower case characters should be rejected rather than encoded as upper case
+        """
+        if len(set(symbols)) != len(symbols) or len(symbols) >= _UNKNOWN:
+            raise ValueError(f'Alphabet symbols must be unique and fewer than {_UNKNOWN}, got {symbols}')
+        self.symbols = symbols
+        # Lookup tables from byte value to code, and from code back to byte value
+        self.encoder = np.full(256, _UNKNOWN, dtype=np.uint8)
+        for code, symbol in enumerate(symbols):
+            self.encoder[ord(symbol)] = code
+            if not case_sensitive:
+                self.encoder[ord(symbol.lower())] = code
+        self.decoder = np.frombuffer(symbols.encode('ascii'), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str) -> bool:
+        return len(symbol) == 1 and ord(symbol) < 256 and self.encoder[ord(symbol)] != _UNKNOWN
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Alphabet) and self.symbols == other.symbols
+
+    def __hash__(self) -> int:
+        return hash(self.symbols)
+
+    def __repr__(self) -> str:
+        return f'Alphabet({self.symbols!r})'
+
+    def code(self, symbol: str) -> int:
+        """
+        Encode a single symbol
+        """
+        if symbol not in self:
+            raise ValueError(f'{symbol!r} is not in the alphabet {self.symbols}')
+        return int(self.encoder[ord(symbol)])
+
+    def encode(self, string: str) -> np.ndarray:
+        """
+        Encode a string through the lookup table
+        :param string: The string to encode
+        :return: A uint8 array holding the code of every character of {string}
+        """
+        try:
+            raw = np.frombuffer(string.encode('ascii'), dtype=np.uint8)
+        except UnicodeEncodeError:
+            raise ValueError(f'Only ASCII strings can be encoded with the alphabet {self.symbols}')
+        codes = self.encoder[raw]
+        if (codes == _UNKNOWN).any():
+            unknown = sorted(set(chr(i) for i in raw[codes == _UNKNOWN]))
+            raise ValueError(f'{"".join(unknown)} not in the alphabet {self.symbols}')
+        return codes
+
+    def decode(self, codes: np.ndarray) -> str:
+        """
+        Decode an array of codes back into a string
+        """
+        return self.decoder[codes].tobytes().decode('ascii')
+
+
+DNA = Alphabet('ACGT')
+RNA = Alphabet('ACGU')
+# Same order as the NCBI substitution matrices, so codes index them directly
+PROTEIN = Alphabet('ARNDCQEGHILKMFPSTWYVBZX*')
+
+
+class EncodedSequence:
+    def __init__(self, sequence: Union[str, np.ndarray, 'EncodedSequence'], alphabet: Alphabet = DNA):
+        """
+        A sequence stored as uint8 codes of an alphabet, encoded once and shared by every algorithm
+        :param sequence: A string to encode, or an array of codes which is used as it is
+        :param alphabet: The alphabet of the sequence
+        """
+        if isinstance(sequence, EncodedSequence):
+            codes = sequence.codes if sequence.alphabet == alphabet else alphabet.encode(str(sequence))
+        elif isinstance(sequence, str):
+            codes = alphabet.encode(sequence)
+        else:
+            codes = np.asarray(sequence, dtype=np.uint8)
+        self.codes = codes
+        self.alphabet = alphabet
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EncodedSequence(self.codes[index], self.alphabet)
+        return self.alphabet.symbols[self.codes[index]]
+
+    def __iter__(self) -> Iterator[str]:
+        symbols = self.alphabet.symbols
+        return (symbols[code] for code in self.codes.tolist())
+
+    def __str__(self) -> str:
+        return self.alphabet.decode(self.codes)
+
+    def __repr__(self) -> str:
+        return f'EncodedSequence({str(self)!r}, {self.alphabet!r})'
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, str):
+            return str(self) == other
+        return (isinstance(other, EncodedSequence) and self.alphabet == other.alphabet
+                and np.array_equal(self.codes, other.codes))
+
+    def __hash__(self) -> int:
+        return hash((self.alphabet, self.codes.tobytes()))
+
+
+def codes_of(sequence: Union[str, EncodedSequence], alphabet: Alphabet) -> np.ndarray:
+    """
+    The codes of a sequence in {alphabet}, reusing them when it is already encoded with it
+    :param sequence: A string or an encoded sequence
+    :param alphabet: The alphabet to encode with
+    :return: A uint8 array of codes
+    """
+    if isinstance(sequence, EncodedSequence) and sequence.alphabet == alphabet:
+        return sequence.codes
+    return alphabet.encode(str(sequence))
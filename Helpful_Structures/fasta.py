@@ -0,0 +1,52 @@
+from typing import Iterator, Tuple
+
+
+def read_sequences(path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Read the sequences of a FASTA file, or of a plain file holding one sequence per line
+    Records are yielded as they are read, so large files are never held in memory at once
+    :param path: Path of the file
+    :return: The name and sequence of every record, plain lines are named by their line number
+    """
+    with open(path) as file:
+        name, parts = None, []
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(parts)
+                name, parts = line[1:].split(maxsplit=1)[0] if len(line) > 1 else '', []
+            elif name is None:
+                yield str(number), line
+            else:
+                parts.append(line)
+        if name is not None:
+            yield name, ''.join(parts)
+
+
+def read_reads(path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Read the sequences of a FASTQ file, or of any file read_sequences reads, qualities being dropped
+    :param path: Path of the file
+    :return: The name and sequence of every record
+    """
+    with open(path) as file:
+        first = next((line for line in file if line.strip()), '')
+    if not first.startswith('@'):
+        yield from read_sequences(path)
+        return
+    with open(path) as file:
+        lines = (line.strip() for line in file)
+        for header in lines:
+            if not header:
+                continue
+            if not header.startswith('@'):
+                raise ValueError(f'Expected a FASTQ header in {path}, got {header[:20]}')
+            name = header[1:].split(maxsplit=1)[0] if len(header) > 1 else ''
+            try:
+                sequence, _, _ = next(lines), next(lines), next(lines)
+            except StopIteration:
+                raise ValueError(f'Incomplete FASTQ record {name} at the end of {path}') from None
+            yield name, sequence
@@ -0,0 +1,91 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .encoded_sequence import Alphabet, DNA, PROTEIN
+
+
+class SubstitutionMatrix:
+    def __init__(self, alphabet: Alphabet, scores):
+        """
+        A table of the score for aligning any symbol of an alphabet against any other
+        :param alphabet: The alphabet the rows and columns are indexed by
+        :param scores: A square table, scores[a][b] is the score for aligning code a against code b
+        """
+        scores = np.asarray(scores, dtype=np.int32)
+        if scores.shape != (len(alphabet), len(alphabet)):
+            raise ValueError(f'Expected a {len(alphabet)}x{len(alphabet)} table, got {scores.shape}')
+        self.alphabet = alphabet
+        self.scores = scores
+        # Plain dictionary for the cell by cell algorithms, where indexing numpy arrays is slow
+        self._lookup: Dict[Tuple[str, str], int] = {}
+        for a, first in enumerate(alphabet.symbols):
+            for b, second in enumerate(alphabet.symbols):
+                for x in {first, first.lower()}:
+                    for y in {second, second.lower()}:
+                        self._lookup[(x, y)] = int(scores[a, b])
+
+    @classmethod
+    def from_scores(cls, alphabet: Alphabet, match: int = 1, mismatch: int = -1) -> 'SubstitutionMatrix':
+        """
+        Expand a match / mismatch scheme into a table
+        :param alphabet: The alphabet of the table
+        :param match: Reward for finding a match
+        :param mismatch: Penalty for accepting a mismatch
+        """
+        return cls(alphabet, np.where(np.eye(len(alphabet), dtype=bool), match, mismatch))
+
+    @property
+    def max_score(self) -> int:
+        return int(self.scores.max())
+
+    @property
+    def min_score(self) -> int:
+        return int(self.scores.min())
+
+    def score(self, a: str, b: str) -> int:
+        """
+        The score for aligning symbol {a} against symbol {b}
+        """
+        try:
+            return self._lookup[(a, b)]
+        except KeyError:
+            raise ValueError(f'{a!r} or {b!r} is not in the alphabet {self.alphabet.symbols}')
+
+    def __getitem__(self, pair: Tuple[str, str]) -> int:
+        return self.score(*pair)
+
+
+DNA_MATCH_MISMATCH = SubstitutionMatrix.from_scores(DNA, 1, -1)
+
+# NCBI BLOSUM62, rows and columns in the order of the PROTEIN alphabet
+BLOSUM62 = SubstitutionMatrix(PROTEIN, [
+    # A   R   N   D   C   Q   E   G   H   I   L   K   M   F   P   S   T   W   Y   V   B   Z   X   *
+    [4, -1, -2, -2, 0, -1, -1, 0, -2, -1, -1, -1, -1, -2, -1, 1, 0, -3, -2, 0, -2, -1, 0, -4],  # A
+    [-1, 5, 0, -2, -3, 1, 0, -2, 0, -3, -2, 2, -1, -3, -2, -1, -1, -3, -2, -3, -1, 0, -1, -4],  # R
+    [-2, 0, 6, 1, -3, 0, 0, 0, 1, -3, -3, 0, -2, -3, -2, 1, 0, -4, -2, -3, 3, 0, -1, -4],  # N
+    [-2, -2, 1, 6, -3, 0, 2, -1, -1, -3, -4, -1, -3, -3, -1, 0, -1, -4, -3, -3, 4, 1, -1, -4],  # D
+    [0, -3, -3, -3, 9, -3, -4, -3, -3, -1, -1, -3, -1, -2, -3, -1, -1, -2, -2, -1, -3, -3, -2, -4],  # C
+    [-1, 1, 0, 0, -3, 5, 2, -2, 0, -3, -2, 1, 0, -3, -1, 0, -1, -2, -1, -2, 0, 3, -1, -4],  # Q
+    [-1, 0, 0, 2, -4, 2, 5, -2, 0, -3, -3, 1, -2, -3, -1, 0, -1, -3, -2, -2, 1, 4, -1, -4],  # E
+    [0, -2, 0, -1, -3, -2, -2, 6, -2, -4, -4, -2, -3, -3, -2, 0, -2, -2, -3, -3, -1, -2, -1, -4],  # G
+    [-2, 0, 1, -1, -3, 0, 0, -2, 8, -3, -3, -1, -2, -1, -2, -1, -2, -2, 2, -3, 0, 0, -1, -4],  # H
+    [-1, -3, -3, -3, -1, -3, -3, -4, -3, 4, 2, -3, 1, 0, -3, -2, -1, -3, -1, 3, -3, -3, -1, -4],  # I
+    [-1, -2, -3, -4, -1, -2, -3, -4, -3, 2, 4, -2, 2, 0, -3, -2, -1, -2, -1, 1, -4, -3, -1, -4],  # L
+    [-1, 2, 0, -1, -3, 1, 1, -2, -1, -3, -2, 5, -1, -3, -1, 0, -1, -3, -2, -2, 0, 1, -1, -4],  # K
+    [-1, -1, -2, -3, -1, 0, -2, -3, -2, 1, 2, -1, 5, 0, -2, -1, -1, -1, -1, 1, -3, -1, -1, -4],  # M
+    [-2, -3, -3, -3, -2, -3, -3, -3, -1, 0, 0, -3, 0, 6, -4, -2, -2, 1, 3, -1, -3, -3, -1, -4],  # F
+    [-1, -2, -2, -1, -3, -1, -1, -2, -2, -3, -3, -1, -2, -4, 7, -1, -1, -4, -3, -2, -2, -1, -2, -4],  # P
+    [1, -1, 1, 0, -1, 0, 0, 0, -1, -2, -2, 0, -1, -2, -1, 4, 1, -3, -2, -2, 0, 0, 0, -4],  # S
+    [0, -1, 0, -1, -1, -1, -1, -2, -2, -1, -1, -1, -1, -2, -1, 1, 5, -2, -2, 0, -1, -1, 0, -4],  # T
+    [-3, -3, -4, -4, -2, -2, -3, -2, -2, -3, -2, -3, -1, 1, -4, -3, -2, 11, 2, -3, -4, -3, -2, -4],  # W
+    [-2, -2, -2, -3, -2, -1, -2, -3, 2, -1, -1, -2, -1, 3, -3, -2, -2, 2, 7, -1, -3, -2, -1, -4],  # Y
+    [0, -3, -3, -3, -1, -2, -2, -3, -3, 3, 1, -2, 1, -1, -2, -2, 0, -3, -1, 4, -3, -2, -1, -4],  # V
+    [-2, -1, 3, 4, -3, 0, 1, -1, 0, -3, -4, 0, -3, -3, -2, 0, -1, -4, -3, -3, 4, 1, -1, -4],  # B
+    [-1, 0, 0, 1, -3, 3, 4, -2, 0, -3, -3, 1, -1, -3, -1, 0, -1, -3, -2, -2, 1, 4, -1, -4],  # Z
+    [0, -1, -1, -1, -2, -1, -1, -1, -1, -1, -1, -1, -1, -1, -2, 0, 0, -2, -1, -1, -1, -1, -1, -4],  # X
+    [-4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, -4, 1],  # *
+])
+
+# Tables which can be chosen by name from the command line
+MATRICES = {'BLOSUM62': BLOSUM62}
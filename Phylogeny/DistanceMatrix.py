@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence as Sequences, Tuple
+
+import numpy as np
+
+from Alignment.Hirschberg import nwaScore
+from Alignment.NWA import Sequence
+from Helpful_Structures import CondensedDistanceMatrix, SubstitutionMatrix, MATRICES, codes_of, read_sequences
+from Phylogeny.NJ import neighbour_joining
+from Phylogeny.UPGMA import UPGMA
+
+
+# All-vs-all alignment distances, stored as a condensed float32 matrix
+# Only the upper triangle is computed, in square tiles of pairs which are shared out between processes.
+# With a path the matrix is memory mapped and the finished tiles are recorded next to it, so an interrupted
+# run picks up where it stopped. UPGMA and neighbour joining accept the result as it is.
+
+
+def _self_score(sequence: Sequence, match: int, substitution_matrix: Optional[SubstitutionMatrix]) -> int:
+    """
+    Score of aligning a sequence against itself
+    """
+    if substitution_matrix is None:
+        return match * len(sequence)
+    codes = codes_of(sequence, substitution_matrix.alphabet)
+    return int(substitution_matrix.scores[codes, codes].sum())
+
+
+def _tiles(n: int, tile_size: int) -> List[Tuple[int, int]]:
+    """
+    The first rows and columns of the tiles covering the upper triangle of an n x n matrix
+    """
+    starts = range(0, n, tile_size)
+    return [(first_row, first_column) for first_row in starts for first_column in starts if first_row <= first_column]
+
+
+# Sequences and scoring of the current worker process, set once by _initialise_worker
+_worker: Dict[str, object] = {}
+
+
+def _initialise_worker(sequences: List[Sequence], self_scores: List[int], tile_size: int, settings: dict):
+    _worker.update(sequences=sequences, self_scores=self_scores, tile_size=tile_size, settings=settings)
+
+
+def _distance_tile(tile: int, first_row: int, first_column: int):
+    """
+    Distances of every pair i < j in a tile
+    A distance is the mean of the two self scores minus the score of the pair, the edit distance when
+    match is 0 and mismatch and indel are -1
+    :return: The tile, the condensed indices of its pairs and their distances
+    """
+    sequences, self_scores = _worker['sequences'], _worker['self_scores']
+    tile_size, settings = _worker['tile_size'], _worker['settings']
+    n = len(sequences)
+    pairs, distances = [], []
+    for i in range(first_row, min(n, first_row + tile_size)):
+        for j in range(max(i + 1, first_column), min(n, first_column + tile_size)):
+            score = int(nwaScore(sequences[i], sequences[j], **settings)[-1])
+            pairs.append(n * i - i * (i + 1) // 2 + j - i - 1)
+            distances.append((self_scores[i] + self_scores[j]) / 2 - score)
+    return tile, np.array(pairs, dtype=np.int64), np.array(distances, dtype=np.float32)
+
+
+def _digest(sequences: List[Sequence]) -> str:
+    """
+    SHA-256 of the sequences in order, each prefixed by its length so different splits never collide
+    """
+    digest = hashlib.sha256()
+    for sequence in sequences:
+        text = str(sequence).encode()
+        digest.update(f'{len(text)}:'.encode())
+        digest.update(text)
+    return digest.hexdigest()
+
+
+def pairwise_distances(sequences: Sequences[Sequence], names: Optional[List[str]] = None,
+                       path: Optional[str] = None, verbose: bool = False, match: int = 0, mismatch: int = -1,
+                       indel: int = -1, processes: int = 1, tile_size: int = 32,
+                       substitution_matrix: Optional[SubstitutionMatrix] = None) -> CondensedDistanceMatrix:
+    """
+    Align every pair of sequences globally in linear space and collect their distances
+    :param sequences: The sequences
+    :param names: Name of every sequence, defaults to their positions
+    :param path: If given, memory map the matrix here and resume from any tiles already finished
+    :param verbose: Should the function be verbose
+    :param match: Reward for finding a match
+    :param mismatch: Penalty for accepting a mismatch
+    :param indel: Penalty for accepting an insert / delete
+    :param processes: Number of worker processes, 1 computes in the current process
+    :param tile_size: Tiles of tile_size x tile_size pairs are the unit of work and of resumption
+    :param substitution_matrix: If given, score pairs of characters from this table instead of {match} and {mismatch}
+    :return: The distance matrix
+    """
+    sequences = list(sequences)
+    n = len(sequences)
+    names = [str(i) for i in range(n)] if names is None else list(names)
+    if len(names) != n:
+        raise ValueError(f'Got {len(names)} names for {n} sequences')
+    tiles = _tiles(n, tile_size)
+    size = n * (n - 1) // 2
+
+    if path is None:
+        matrix = CondensedDistanceMatrix(names)
+        done = np.zeros(len(tiles), dtype=np.uint8)
+    else:
+        # The description is checked on resumption, so tiles are never mixed between different runs
+        description = {'names': names, 'sequences': _digest(sequences), 'tile_size': tile_size, 'match': match,
+                       'mismatch': mismatch, 'indel': indel,
+                       'substitution_matrix': None if substitution_matrix is None else
+                       substitution_matrix.scores.tolist()}
+        resume = os.path.exists(f'{path}.json')
+        if resume:
+            with open(f'{path}.json') as file:
+                if json.load(file) != description:
+                    raise ValueError(f'{path} holds a distance matrix of different sequences or settings')
+        mode = 'r+' if resume else 'w+'
+        # A memory map can not be empty, so a matrix without pairs is held by an empty array instead
+        distances = np.memmap(path, dtype=np.float32, mode=mode, shape=(size,)) if size else \
+            np.zeros(0, dtype=np.float32)
+        matrix = CondensedDistanceMatrix(names, distances)
+        done = np.memmap(f'{path}.tiles', dtype=np.uint8, mode=mode, shape=(len(tiles),)) if tiles else \
+            np.zeros(0, dtype=np.uint8)
+        # Written last, so a run is only resumed once both of its files exist
+        if not resume:
+            with open(f'{path}.json', 'w') as file:
+                json.dump(description, file)
+
+    remaining = [(tile, first_row, first_column) for tile, (first_row, first_column) in enumerate(tiles)
+                 if not done[tile]]
+    if verbose:
+        print(f'{len(tiles) - len(remaining)} of {len(tiles)} tiles already finished')
+
+    settings = {'match': match, 'mismatch': mismatch, 'indel': indel, 'substitution_matrix': substitution_matrix}
+    self_scores = [_self_score(sequence, match, substitution_matrix) for sequence in sequences]
+    initargs = (sequences, self_scores, tile_size, settings)
+
+    def store(tile: int, pairs: np.ndarray, distances: np.ndarray):
+        matrix.distances[pairs] = distances
+        # The distances are written out before the tile is marked, so a finished tile is always complete
+        if isinstance(matrix.distances, np.memmap):
+            matrix.distances.flush()
+        done[tile] = 1
+        if isinstance(done, np.memmap):
+            done.flush()
+        if verbose:
+            print(f'\tTile {tile + 1} of {len(tiles)} finished')
+
+    if processes <= 1:
+        _initialise_worker(*initargs)
+        for task in remaining:
+            store(*_distance_tile(*task))
+        return matrix
+
+    with ProcessPoolExecutor(processes, initializer=_initialise_worker, initargs=initargs) as pool:
+        pending = {pool.submit(_distance_tile, *task) for task in remaining}
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                store(*future.result())
+    return matrix
+
+
+def main(sequences_path: str, output: Optional[str] = None, verbose: bool = False,
+         indel: int = -1, mismatch: int = -1, match: int = 0, processes: int = 1, tile_size: int = 32,
+         tree: Optional[str] = None, substitution_matrix: Optional[str] = None):
+    names, sequences = [], []
+    for name, sequence in read_sequences(sequences_path):
+        names.append(name)
+        sequences.append(sequence)
+    matrix = pairwise_distances(sequences, names, output, verbose, match, mismatch, indel, processes, tile_size,
+                                MATRICES.get(substitution_matrix))
+    if tree == 'upgma':
+        print(UPGMA(matrix))
+    elif tree == 'nj':
+        print(neighbour_joining(matrix, verbose))
+    else:
+        square = matrix.square()
+        print('\t' + '\t'.join(names))
+        for name, row in zip(names, square):
+            print(name + '\t' + '\t'.join(f'{distance:g}' for distance in row))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the alignment distance between every pair of strings.')
+    parser.add_argument('-f', '--file', required=True, type=str,
+                        help='FASTA file, or file with one string per line.')
+    parser.add_argument('-o', '--output', required=False, type=str, default=None,
+                        help='Memory map the matrix to this file, resuming if it already exists.')
+    parser.add_argument('-v', '--verbose', action='store_true', required=False,
+                        help='Verbose output.')
+    parser.add_argument('-id', '--indel', required=False, type=int, default=-1,
+                        help='Penalty for inserting / deleting.')
+    parser.add_argument('-mm', '--mismatch', required=False, type=int, default=-1,
+                        help='Penalty for accepting a mismatch.')
+    parser.add_argument('-m', '--match', required=False, type=int, default=0,
+                        help='Reward for accepting a match.')
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-t', '--tile_size', required=False, type=int, default=32,
+                        help='Pairs are computed in tiles of this many rows and columns.')
+    parser.add_argument('-tr', '--tree', required=False, type=str, default=None, choices=('upgma', 'nj'),
+                        help='Build a tree from the matrix rather than printing it.')
+    parser.add_argument('-sm', '--substitution_matrix', required=False, type=str, default=None, choices=MATRICES,
+                        help='Score substitutions from this table instead of the match / mismatch scores.')
+    args = parser.parse_args()
+
+    main(args.file, args.output, args.verbose, args.indel, args.mismatch, args.match, args.processes,
+         args.tile_size, args.tree, args.substitution_matrix)
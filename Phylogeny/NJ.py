@@ -1,9 +1,59 @@
 import argparse
-from typing import Dict
+from typing import Dict, Union
+
+import numpy as np
+
+from Helpful_Structures import CondensedDistanceMatrix
 
 
 # Implementation of Neighbour Joining
-def neighbour_joining(distance_matrix: Dict[str, Dict[str, float]], verbose: bool = False):
+def _neighbour_joining_condensed(distance_matrix: CondensedDistanceMatrix, verbose: bool = False):
+    """
+    Neighbour joining on a condensed matrix, working on a single square array instead of nested dictionaries
+    The new node of every join reuses the row of one of the joined nodes
+    """
+    matrix = distance_matrix.square()
+    labels = list(distance_matrix.names)
+    limb_length = dict()
+    new_node_number = 0
+    # Rows still in use, in the order the dictionary version would hold their keys
+    order = list(range(len(labels)))
+    while len(order) > 2:
+        active = matrix[np.ix_(order, order)]
+        if verbose:
+            print(f'Iteration: {new_node_number + 1}')
+            print('\t\t' + '\t'.join(labels[key] for key in order))
+            for key, value in zip(order, active):
+                print('\t' + labels[key] + '\t' + '\t'.join([str(distance) for distance in value]))
+        total_distance = active.sum(axis=1)
+
+        distance_star = (len(order) - 2) * active - total_distance[:, np.newaxis] - total_distance[np.newaxis, :]
+        np.fill_diagonal(distance_star, np.inf)
+        row, column = np.unravel_index(np.argmin(distance_star), distance_star.shape)
+        first, second = order[row], order[column]
+
+        new_node_name = f'node_{new_node_number}'
+        new_node_number += 1
+        delta = (total_distance[row] - total_distance[column]) / (len(order) - 2)
+        limb_length[labels[first]] = {new_node_name: float((1 / 2) * (active[row, column] + delta))}
+        limb_length[labels[second]] = {new_node_name: float((1 / 2) * (active[row, column] - delta))}
+
+        new_row = (matrix[first] + matrix[second] - matrix[first, second]) / 2
+        matrix[first], matrix[:, first] = new_row, new_row
+        matrix[first, first] = 0
+        labels[first] = new_node_name
+        order.remove(first)
+        order.remove(second)
+        order.append(first)
+
+    last, other = order
+    return {**limb_length, **{labels[last]: {labels[other]: float(matrix[last, other])}}}
+
+
+def neighbour_joining(distance_matrix: Union[Dict[str, Dict[str, float]], CondensedDistanceMatrix],
+                      verbose: bool = False):
+    if isinstance(distance_matrix, CondensedDistanceMatrix):
+        return _neighbour_joining_condensed(distance_matrix, verbose)
     limb_length = dict()
     new_node_number = 0
     while len(distance_matrix) > 2:
@@ -1,6 +1,10 @@
 import argparse
 import re
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Union
+
+import numpy as np
+
+from Helpful_Structures import CondensedDistanceMatrix
 
 
 # Implementation of UPGMA
@@ -16,7 +20,41 @@ def combinations(first: str, second: str) -> List[Tuple]:
     return to_return
 
 
-def UPGMA(distance_matrix: Dict[str, Dict[str, float]]):
+def _upgma_condensed(distance_matrix: CondensedDistanceMatrix) -> Dict[str, float]:
+    """
+    UPGMA on a condensed matrix, working on a single square array instead of nested dictionaries
+    Merged clusters reuse the row of one of their children, and the distance to a cluster is the
+    size weighted mean of its children's distances, the mean over all pairs of leaves
+    """
+    matrix = distance_matrix.square()
+    labels = list(distance_matrix.names)
+    sizes = np.ones(len(labels))
+    distances = {key: 0 for key in labels}
+    # Rows still in use, in the order the dictionary version would hold their keys
+    order = list(range(len(labels)))
+
+    while len(order) >= 2:
+        active = matrix[np.ix_(order, order)]
+        np.fill_diagonal(active, np.inf)
+        row, column = np.unravel_index(np.argmin(active), active.shape)
+        first, second = order[row], order[column]
+        new_node_name = f'({labels[first]}, {labels[second]})'
+        distances[new_node_name] = float(active[row, column]) / 2
+
+        merged = (sizes[first] * matrix[first] + sizes[second] * matrix[second]) / (sizes[first] + sizes[second])
+        matrix[first], matrix[:, first] = merged, merged
+        matrix[first, first] = 0
+        sizes[first] += sizes[second]
+        labels[first] = new_node_name
+        order.remove(first)
+        order.remove(second)
+        order.append(first)
+    return distances
+
+
+def UPGMA(distance_matrix: Union[Dict[str, Dict[str, float]], CondensedDistanceMatrix]):
+    if isinstance(distance_matrix, CondensedDistanceMatrix):
+        return _upgma_condensed(distance_matrix)
     distance_copy = {i: {j: v_ for j, v_ in v.items()} for i, v in distance_matrix.items()}
     distances = {key: 0 for key in distance_matrix}
 